@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+"""
+Precomputed log-mel features for the Persian speech datasets.
+
+Decoding mp3/wav and computing spectrograms every epoch keeps the CPU busy
+with work whose result never changes. This decodes Common Voice fa
+(datasets/speech/commonvoice_fa: parquet files with embedded audio) and
+FLEURS fa_ir (datasets/speech/fleurs_fa: TSV transcripts plus audio tar
+archives or directories) once, in a process pool, and stores the features:
+
+  - audio is decoded with soundfile, downmixed to mono and resampled to
+    --sample-rate with a windowed-sinc polyphase filter,
+  - log-mel features (--n-mels, 25 ms window, 10 ms hop at 16 kHz) are
+    stored as float16 rows of one growing memory-mapped array,
+  - an append-only index records each clip's offset, frame count, duration,
+    transcript, dataset and split.
+
+Runs are incremental: clips already in the index are skipped, so adding a
+dataset or re-running after an interruption only processes what is missing.
+Clips that fail to decode, or are longer than --max-duration, are recorded
+and not retried (raising --max-duration retries the ones it now admits).
+A change of feature settings starts the store over.
+
+Store layout (<cache_dir>/):
+    meta.json       feature settings
+    features.f16    [total_frames, n_mels] float16
+    index.jsonl     one clip per line: key, dataset, split, offset, frames,
+                    duration, text
+    skipped.jsonl   clips left out: key, dataset, split, reason, duration
+
+Training reads it with make_dataloader(): clips are grouped into duration
+buckets (boundaries from sequence_profiler.optimal_buckets) and each batch
+holds at most --max-batch-frames frames, so batches of short clips are large
+and batches of long clips small, with little padding either way.
+
+Usage:
+    python3 scripts/audio_features.py --data-root datasets/speech --cache-dir datasets/speech/features
+    python3 scripts/audio_features.py --cache-dir datasets/speech/features --stats
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import torch
+    PYTORCH_AVAILABLE = True
+except ImportError:
+    PYTORCH_AVAILABLE = False
+
+try:
+    import soundfile
+    HAS_SOUNDFILE = True
+except ImportError:
+    HAS_SOUNDFILE = False
+
+STORE_VERSION = 1
+SKIPPED_NAME = "skipped.jsonl"
+DATASETS = ("commonvoice_fa", "fleurs_fa")
+FLEURS_LANGUAGE = "fa_ir"
+TEXT_COLUMNS = ("sentence", "transcription", "raw_transcription", "text", "normalized_text")
+
+_worker_settings = None
+
+
+# ---------------------------------------------------------------------------
+# Feature extraction
+
+
+def resample(waveform: "torch.Tensor", orig_freq: int, new_freq: int, width: int = 6,
+             rolloff: float = 0.99) -> "torch.Tensor":
+    """Band-limited (Hann-windowed sinc) polyphase resampling of a 1-D waveform"""
+    if orig_freq == new_freq:
+        return waveform
+    g = math.gcd(orig_freq, new_freq)
+    orig, new = orig_freq // g, new_freq // g
+    base = min(orig, new) * rolloff
+    pad = math.ceil(width * orig / base)
+    # One filter per output phase, sampled at the input positions it covers
+    idx = torch.arange(-pad, pad + orig, dtype=torch.float64)[None] / orig
+    t = (torch.arange(0, -new, -1, dtype=torch.float64)[:, None] / new + idx) * base
+    t = t.clamp(-width, width)
+    window = torch.cos(t * math.pi / width / 2) ** 2
+    t = t * math.pi
+    kernels = torch.where(t == 0, torch.ones_like(t), torch.sin(t) / t) * window * base / orig
+
+    length = waveform.shape[-1]
+    x = torch.nn.functional.pad(waveform.double()[None, None], (pad, pad + orig))
+    out = torch.nn.functional.conv1d(x, kernels[:, None], stride=orig)
+    out = out[0].t().reshape(-1)
+    return out[:math.ceil(new * length / orig)].to(waveform.dtype)
+
+
+def mel_filters(sample_rate: int, n_fft: int, n_mels: int) -> "torch.Tensor":
+    """[n_fft // 2 + 1, n_mels] Slaney mel filter bank"""
+    from transformers.audio_utils import mel_filter_bank
+
+    return torch.from_numpy(mel_filter_bank(
+        num_frequency_bins=n_fft // 2 + 1, num_mel_filters=n_mels, min_frequency=0.0,
+        max_frequency=sample_rate / 2, sampling_rate=sample_rate, norm="slaney", mel_scale="slaney"
+    )).float()
+
+
+def log_mel(waveform: "torch.Tensor", n_fft: int, hop_length: int, filters: "torch.Tensor") -> np.ndarray:
+    """[frames, n_mels] natural-log mel power spectrogram"""
+    spec = torch.stft(waveform, n_fft, hop_length, window=torch.hann_window(n_fft), return_complex=True)
+    power = spec.abs() ** 2
+    mel = filters.t() @ power
+    return torch.log(mel.clamp(min=1e-10)).t().numpy()
+
+
+def decode_audio(data: bytes) -> Tuple[np.ndarray, int]:
+    """Mono float32 samples and sample rate of an encoded clip (wav, flac, ogg, mp3)"""
+    samples, rate = soundfile.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    return samples.mean(axis=1), rate
+
+
+def _init_worker(settings: Dict):
+    global _worker_settings
+    # Parallelism comes from the pool; one intra-op thread per process
+    torch.set_num_threads(1)
+    _worker_settings = dict(settings, filters=mel_filters(settings["sample_rate"], settings["n_fft"],
+                                                          settings["n_mels"]))
+
+
+def _extract(item: Tuple) -> Tuple:
+    """(key, dataset, split, text, audio bytes) -> (key, dataset, split, text, features | None, duration | error)
+
+    A clip longer than max_duration comes back with features None and its duration.
+    """
+    key, dataset, split, text, data = item
+    s = _worker_settings
+    try:
+        samples, rate = decode_audio(data)
+        waveform = resample(torch.from_numpy(samples), rate, s["sample_rate"])
+        duration = waveform.shape[0] / s["sample_rate"]
+        if s["max_duration"] and duration > s["max_duration"]:
+            return key, dataset, split, text, None, duration
+        features = log_mel(waveform, s["n_fft"], s["hop_length"], s["filters"]).astype(np.float16)
+        return key, dataset, split, text, features, duration
+    except Exception as e:
+        return key, dataset, split, text, None, f"{type(e).__name__}: {e}"
+
+
+# ---------------------------------------------------------------------------
+# Sources
+
+
+def _data_files(root: Path, pattern: str) -> List[Path]:
+    """Files under `root` matching `pattern`, ignoring the Hugging Face download cache"""
+    return sorted(p for p in root.rglob(pattern) if ".cache" not in p.parts)
+
+
+def iter_commonvoice(root: Path, splits: Optional[List[str]] = None) -> Iterator[Tuple]:
+    """(key, dataset, split, text, audio bytes) from Common Voice parquet files"""
+    import pyarrow.parquet as pq
+
+    for path in _data_files(root, "*.parquet"):
+        split = path.name.split("-")[0]
+        if splits and split not in splits:
+            continue
+        parquet = pq.ParquetFile(path)
+        names = parquet.schema_arrow.names
+        text_column = next((c for c in TEXT_COLUMNS if c in names), None)
+        columns = ["audio"] + ([text_column] if text_column else [])
+        row = 0
+        for batch in parquet.iter_batches(batch_size=64, columns=columns):
+            for record in batch.to_pylist():
+                audio = record["audio"] or {}
+                key = f"commonvoice_fa/{split}/{audio.get('path') or f'{path.name}:{row}'}"
+                row += 1
+                if audio.get("bytes"):
+                    yield key, "commonvoice_fa", split, record.get(text_column) or "", audio["bytes"]
+
+
+def iter_fleurs(root: Path, splits: Optional[List[str]] = None, language: str = FLEURS_LANGUAGE) -> Iterator[Tuple]:
+    """(key, dataset, split, text, audio bytes) from FLEURS TSV transcripts and audio archives"""
+    for tsv in _data_files(root, "*.tsv"):
+        if tsv.parent.name != language or (splits and tsv.stem not in splits):
+            continue
+        split = tsv.stem
+        texts = {}
+        with open(tsv, "r", encoding="utf-8") as f:
+            for line in f:
+                # id, file_name, raw_transcription, transcription, characters, num_samples, gender
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) >= 3:
+                    texts[fields[1]] = fields[2]
+
+        audio_dir = tsv.parent / "audio"
+        archive = audio_dir / f"{split}.tar.gz"
+        if (audio_dir / split).is_dir():
+            for path in sorted((audio_dir / split).iterdir()):
+                if path.name in texts:
+                    yield f"fleurs_fa/{split}/{path.name}", "fleurs_fa", split, texts[path.name], path.read_bytes()
+        elif archive.exists():
+            # Streamed: the archive is read once, front to back
+            with tarfile.open(archive, "r|gz") as tar:
+                for member in tar:
+                    name = os.path.basename(member.name)
+                    if member.isfile() and name in texts:
+                        yield f"fleurs_fa/{split}/{name}", "fleurs_fa", split, texts[name], \
+                            tar.extractfile(member).read()
+
+
+SOURCES = {"commonvoice_fa": iter_commonvoice, "fleurs_fa": iter_fleurs}
+
+
+# ---------------------------------------------------------------------------
+# Store
+
+
+class AudioFeatureStore:
+    """Append-only float16 feature rows plus a JSONL index of clips"""
+
+    def __init__(self, path: str, settings: Optional[Dict] = None):
+        self.path = Path(path)
+        meta_path = self.path / "meta.json"
+        if settings is None:
+            # Read-only use: settings come from the store
+            with open(meta_path, "r", encoding="utf-8") as f:
+                settings = json.load(f)
+        else:
+            self.path.mkdir(parents=True, exist_ok=True)
+            settings = {"version": STORE_VERSION, **settings}
+            existing = None
+            if meta_path.exists():
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    existing = json.load(f)
+            if existing != settings:
+                # Different feature settings: start over
+                for name in ("features.f16", "index.jsonl", SKIPPED_NAME):
+                    (self.path / name).unlink(missing_ok=True)
+                with open(meta_path, "w", encoding="utf-8") as f:
+                    json.dump(settings, f, indent=2)
+        self.settings = settings
+        self.n_mels = settings["n_mels"]
+        self.entries = []
+        index_path = self.path / "index.jsonl"
+        if index_path.exists():
+            with open(index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        try:
+                            self.entries.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            # Torn last line of an interrupted run
+                            break
+        self.keys = {e["key"] for e in self.entries}
+        # Clips that failed or were too long; the last record of a key wins
+        self.skipped: Dict[str, Dict] = {}
+        skipped_path = self.path / SKIPPED_NAME
+        if skipped_path.exists():
+            with open(skipped_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    if record["key"] not in self.keys:
+                        self.skipped[record["key"]] = record
+        self.total_frames = max((e["offset"] + e["frames"] for e in self.entries), default=0)
+        self._features = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def open_for_append(self):
+        """Drop rows past the last indexed clip (an interrupted run) and open both files for appending"""
+        features_path = self.path / "features.f16"
+        row_bytes = self.n_mels * 2
+        with open(features_path, "ab") as f:
+            f.truncate(self.total_frames * row_bytes)
+        with open(self.path / "index.jsonl", "w", encoding="utf-8") as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        with open(self.path / SKIPPED_NAME, "w", encoding="utf-8") as f:
+            for record in self.skipped.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._feature_file = open(features_path, "ab")
+        self._index_file = open(self.path / "index.jsonl", "a", encoding="utf-8")
+        self._skipped_file = open(self.path / SKIPPED_NAME, "a", encoding="utf-8")
+
+    def append(self, key: str, dataset: str, split: str, text: str, features: np.ndarray, duration: float):
+        self._feature_file.write(np.ascontiguousarray(features, dtype=np.float16).tobytes())
+        entry = {"key": key, "dataset": dataset, "split": split, "offset": self.total_frames,
+                 "frames": int(features.shape[0]), "duration": round(duration, 3), "text": text}
+        self.total_frames += entry["frames"]
+        self.entries.append(entry)
+        self.keys.add(key)
+        self.skipped.pop(key, None)
+        self._index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def skip(self, key: str, dataset: str, split: str, reason: str, duration: Optional[float] = None):
+        """Record a clip that is left out, so later runs do not decode it again"""
+        record = {"key": key, "dataset": dataset, "split": split, "reason": reason,
+                  "duration": None if duration is None else round(duration, 3)}
+        self.skipped[key] = record
+        self._skipped_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def is_skipped(self, key: str, max_duration: Optional[float] = None) -> bool:
+        """True for clips that failed to decode, or are still longer than `max_duration`"""
+        record = self.skipped.get(key)
+        if record is None:
+            return False
+        if record["duration"] is None:
+            return True
+        return bool(max_duration) and record["duration"] > max_duration
+
+    def flush(self):
+        # Features reach the file before the index lines that point at them
+        self._feature_file.flush()
+        self._index_file.flush()
+        self._skipped_file.flush()
+
+    def close(self):
+        self.flush()
+        self._feature_file.close()
+        self._index_file.close()
+        self._skipped_file.close()
+
+    def features(self, entry: Dict) -> np.ndarray:
+        """[frames, n_mels] float16 view of one clip"""
+        if self._features is None or len(self._features) < self.total_frames:
+            self._features = np.memmap(self.path / "features.f16", dtype=np.float16, mode="r",
+                                       shape=(self.total_frames, self.n_mels))
+        return self._features[entry["offset"]:entry["offset"] + entry["frames"]]
+
+    def summary(self) -> Dict:
+        groups = {}
+        for e in self.entries:
+            g = groups.setdefault(f"{e['dataset']}/{e['split']}", {"clips": 0, "hours": 0.0, "frames": 0})
+            g["clips"] += 1
+            g["hours"] += e["duration"] / 3600
+            g["frames"] += e["frames"]
+        for g in groups.values():
+            g["hours"] = round(g["hours"], 2)
+        return {"clips": len(self.entries), "skipped_clips": len(self.skipped), "frames": self.total_frames,
+                "size_mb": round(self.total_frames * self.n_mels * 2 / 1024 ** 2, 1), "splits": groups}
+
+
+def build_features(data_root: str, cache_dir: str, datasets: List[str], splits: Optional[List[str]] = None,
+                   workers: int = None, sample_rate: int = 16000, n_mels: int = 80, max_duration: float = 30.0,
+                   limit: Optional[int] = None) -> Dict:
+    """Extract features for clips not yet in the store; returns counts"""
+    if not HAS_SOUNDFILE:
+        raise RuntimeError("soundfile is required to decode audio. Install with: pip install soundfile")
+    settings = {"sample_rate": sample_rate, "n_mels": n_mels, "n_fft": sample_rate // 40,
+                "hop_length": sample_rate // 100}
+    store = AudioFeatureStore(cache_dir, settings)
+    existing = len(store)
+    workers = workers or os.cpu_count() or 1
+
+    def pending() -> Iterator[Tuple]:
+        count = 0
+        for name in datasets:
+            root = Path(data_root) / name
+            if not root.exists():
+                print(f"⚠️  {root} not found, skipping {name}")
+                continue
+            for item in SOURCES[name](root, splits):
+                if item[0] in store.keys or store.is_skipped(item[0], max_duration):
+                    continue
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield item
+
+    added, failed = 0, {}
+    start = time.perf_counter()
+    store.open_for_append()
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(dict(settings, max_duration=max_duration),)) as pool:
+            items = pending()
+            while True:
+                # Bounded windows: only a few clips per worker are held in memory at a time
+                window = [item for _, item in zip(range(workers * 16), items)]
+                if not window:
+                    break
+                for key, dataset, split, text, features, result in pool.map(_extract, window, chunksize=4):
+                    if features is None:
+                        if isinstance(result, str):
+                            store.skip(key, dataset, split, result)
+                        else:
+                            store.skip(key, dataset, split, f"longer than {max_duration}s", duration=result)
+                        failed[key] = store.skipped[key]["reason"]
+                        continue
+                    store.append(key, dataset, split, text, features, result)
+                    added += 1
+                store.flush()
+                print(f"[PROGRESS] {existing + added} clips ({added} new, {len(failed)} skipped), "
+                      f"{added / (time.perf_counter() - start):.1f} clips/s", flush=True)
+    finally:
+        store.close()
+    return {"existing": existing, "added": added, "skipped": len(failed),
+            "skipped_examples": dict(list(failed.items())[:10]),
+            "seconds": round(time.perf_counter() - start, 2), **store.summary()}
+
+
+# ---------------------------------------------------------------------------
+# Loading
+
+
+if PYTORCH_AVAILABLE:
+
+    class AudioFeatureDataset(torch.utils.data.Dataset):
+        """Clips of a feature store, optionally restricted to some datasets / splits"""
+
+        def __init__(self, cache_dir: str, splits: Optional[List[str]] = None,
+                     datasets: Optional[List[str]] = None):
+            self.store = AudioFeatureStore(cache_dir)
+            self.entries = [e for e in self.store.entries
+                            if (not splits or e["split"] in splits) and (not datasets or e["dataset"] in datasets)]
+
+        def __len__(self) -> int:
+            return len(self.entries)
+
+        def __getitem__(self, i: int) -> Dict:
+            entry = self.entries[i]
+            return {"input_features": torch.from_numpy(self.store.features(entry).astype(np.float32)),
+                    "text": entry["text"], "key": entry["key"]}
+
+
+    class LengthBucketBatchSampler(torch.utils.data.Sampler):
+        """Batches of clips from the same duration bucket, at most `max_batch_frames` padded frames each"""
+
+        def __init__(self, frames: List[int], max_batch_frames: int = 30000, num_buckets: int = 8,
+                     shuffle: bool = True, seed: int = 0):
+            from sequence_profiler import optimal_buckets
+
+            self.frames = np.asarray(frames)
+            longest = int(self.frames.max()) if len(self.frames) else 1
+            self.boundaries = optimal_buckets(self.frames, longest, num_buckets, multiple=100) \
+                if num_buckets > 1 else [longest]
+            self.bucket = np.searchsorted(self.boundaries, self.frames, side="left")
+            self.max_batch_frames = max_batch_frames
+            self.shuffle = shuffle
+            self.seed = seed
+            self.epoch = 0
+
+        def set_epoch(self, epoch: int):
+            self.epoch = epoch
+
+        def _batches(self) -> List[List[int]]:
+            rng = np.random.default_rng(self.seed + self.epoch)
+            batches = []
+            for b, boundary in enumerate(self.boundaries):
+                members = np.flatnonzero(self.bucket == b)
+                if self.shuffle:
+                    rng.shuffle(members)
+                size = max(1, self.max_batch_frames // boundary)
+                batches.extend(members[i:i + size].tolist() for i in range(0, len(members), size))
+            if self.shuffle:
+                batches = [batches[i] for i in rng.permutation(len(batches))]
+            return batches
+
+        def __iter__(self):
+            return iter(self._batches())
+
+        def __len__(self) -> int:
+            return len(self._batches())
+
+
+    def collate_features(batch: List[Dict]) -> Dict:
+        """Pad a batch to its longest clip: input_features [B, T, n_mels], attention_mask [B, T]"""
+        longest = max(item["input_features"].shape[0] for item in batch)
+        n_mels = batch[0]["input_features"].shape[1]
+        features = torch.zeros(len(batch), longest, n_mels)
+        mask = torch.zeros(len(batch), longest, dtype=torch.long)
+        for i, item in enumerate(batch):
+            n = item["input_features"].shape[0]
+            features[i, :n] = item["input_features"]
+            mask[i, :n] = 1
+        return {"input_features": features, "attention_mask": mask,
+                "texts": [item["text"] for item in batch], "keys": [item["key"] for item in batch]}
+
+
+    def make_dataloader(cache_dir: str, splits: Optional[List[str]] = None, datasets: Optional[List[str]] = None,
+                        max_batch_frames: int = 30000, num_buckets: int = 8, shuffle: bool = True,
+                        num_workers: int = 0, seed: int = 0) -> "torch.utils.data.DataLoader":
+        """Length-bucketed DataLoader over a feature store"""
+        dataset = AudioFeatureDataset(cache_dir, splits, datasets)
+        sampler = LengthBucketBatchSampler([e["frames"] for e in dataset.entries], max_batch_frames,
+                                           num_buckets, shuffle, seed)
+        return torch.utils.data.DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_features,
+                                           num_workers=num_workers)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Precompute log-mel features for the speech datasets')
+    parser.add_argument('--data-root', type=str, default='datasets/speech',
+                        help='Directory holding commonvoice_fa/ and fleurs_fa/')
+    parser.add_argument('--cache-dir', type=str, default='datasets/speech/features', help='Feature store')
+    parser.add_argument('--datasets', type=str, default=','.join(DATASETS), help='Comma-separated datasets')
+    parser.add_argument('--splits', type=str, default=None, help='Comma-separated splits (default: all)')
+    parser.add_argument('--workers', type=int, default=None, help='Decoding processes (default: all cores)')
+    parser.add_argument('--sample-rate', type=int, default=16000, help='Target sample rate')
+    parser.add_argument('--n-mels', type=int, default=80, help='Mel bands')
+    parser.add_argument('--max-duration', type=float, default=30.0, help='Skip clips longer than this (seconds)')
+    parser.add_argument('--limit', type=int, default=None, help='Process at most this many new clips')
+    parser.add_argument('--stats', action='store_true', help='Only print a summary of the store')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.stats:
+        if not os.path.exists(os.path.join(args.cache_dir, "meta.json")):
+            print(f"❌ No feature store at {args.cache_dir}", file=sys.stderr)
+            return 1
+        print(json.dumps(AudioFeatureStore(args.cache_dir).summary(), indent=2))
+        return 0
+    if not PYTORCH_AVAILABLE:
+        print("❌ PyTorch is required. Install with: pip install torch transformers", file=sys.stderr)
+        return 1
+
+    datasets = args.datasets.split(',')
+    unknown = [d for d in datasets if d not in SOURCES]
+    if unknown:
+        print(f"❌ Unknown dataset(s): {', '.join(unknown)} (choose from {', '.join(DATASETS)})", file=sys.stderr)
+        return 1
+    print(f"🎙️  Extracting {args.n_mels}-band log-mel features at {args.sample_rate} Hz into {args.cache_dir}")
+    try:
+        result = build_features(args.data_root, args.cache_dir, datasets,
+                                args.splits.split(',') if args.splits else None, args.workers,
+                                args.sample_rate, args.n_mels, args.max_duration, args.limit)
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(f"✅ {result['added']} clips added ({result['existing']} already cached, {result['skipped']} skipped) "
+          f"in {result['seconds']}s; store: {result['clips']} clips, {result['size_mb']} MB")
+    print(json.dumps(result["splits"], indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Find the largest batch size / sequence length that fits a RAM budget.
+
+Candidate configurations are probed with a few real training steps (with
+the optimizer the job will use and lr=0, so weights are not changed) while
+peak RSS is sampled with psutil. The fastest configuration that fits is
+returned together with the gradient accumulation needed to reach the target
+effective batch size. Probe results are cached per (model, host, sequence
+lengths, target, optimizer) and the choice is re-made against each job's
+budget, so later jobs only probe configurations not measured yet.
+
+Used by train_real_pytorch.py --auto-batch-size; can also be run directly:
+    python3 scripts/batch_autotune.py --model-name gpt2 --ram-budget-gb 6 --max-length 512
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+DEFAULT_CACHE = "artifacts/autotune_cache.json"
+
+
+class PeakRSSMonitor:
+    """Sample this process's RSS in a background thread and keep the maximum"""
+
+    def __init__(self, interval: float = 0.005):
+        if not HAS_PSUTIL:
+            raise RuntimeError("psutil is required for memory probing. Install with: pip install psutil")
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def host_fingerprint() -> str:
+    total = psutil.virtual_memory().total if HAS_PSUTIL else 0
+    return f"{platform.node()}|{platform.machine()}|{os.cpu_count()}|{total}"
+
+
+def _cache_key(model_name: str, seq_lengths: List[int], target_batch_size: int, optimizer: str = "adamw") -> str:
+    # No RAM budget: it varies from run to run, the probe measurements do not
+    raw = f"{model_name}|{host_fingerprint()}|{sorted(seq_lengths)}|{target_batch_size}"
+    if optimizer != "adamw":
+        raw += f"|{optimizer}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _load_cache(cache_path: str) -> Dict:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def probe_step(model, batch_size: int, seq_len: int, steps: int = 2, optimizer_name: str = "adamw") -> Dict:
+    """Run a few zero-lr training steps; return step time and peak RSS"""
+    import tempfile
+
+    import torch
+
+    vocab = model.config.vocab_size
+    input_ids = torch.randint(0, vocab, (batch_size, seq_len))
+    state_dir = None
+    if optimizer_name == "adamw":
+        optimizer = torch.optim.AdamW(model.parameters(), lr=0.0, weight_decay=0.0)
+    else:
+        from lean_optimizers import create_optimizer
+        state_dir = tempfile.mkdtemp(prefix="autotune_optim_")
+        optimizer = create_optimizer(optimizer_name, model, 0.0, weight_decay=0.0,
+                                     state_dir=os.path.join(state_dir, "state"))
+    model.train()
+
+    try:
+        with PeakRSSMonitor() as monitor:
+            times = []
+            for _ in range(steps + 1):
+                start = time.perf_counter()
+                loss = model(input_ids=input_ids, labels=input_ids).loss
+                loss.backward()
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+                times.append(time.perf_counter() - start)
+    finally:
+        if hasattr(optimizer, "close"):
+            optimizer.close()
+        if state_dir:
+            shutil.rmtree(state_dir, ignore_errors=True)
+        del optimizer
+        model.zero_grad(set_to_none=True)
+        gc.collect()
+
+    # First step includes optimizer state allocation
+    step_seconds = sum(times[1:]) / max(1, len(times) - 1)
+    return {
+        "batch_size": batch_size,
+        "max_length": seq_len,
+        "step_seconds": round(step_seconds, 4),
+        "tokens_per_second": round(batch_size * seq_len / step_seconds, 1),
+        "peak_rss_gb": round(monitor.peak / (1024 ** 3), 3)
+    }
+
+
+def autotune_batch_size(
+    model,
+    model_name: str,
+    ram_budget_gb: float,
+    seq_lengths: List[int],
+    target_batch_size: int = 16,
+    cache_path: Optional[str] = DEFAULT_CACHE,
+    max_batch_size: Optional[int] = None,
+    optimizer: str = "adamw"
+) -> Dict:
+    """
+    Probe power-of-two batch sizes for each sequence length (longest first)
+    and return the fastest config at the longest length that fits the budget.
+    """
+    limit = getattr(model.config, "max_position_embeddings", None) or getattr(model.config, "n_positions", None)
+    if limit:
+        seq_lengths = [min(s, limit) for s in seq_lengths]
+    seq_lengths = sorted(set(seq_lengths), reverse=True)
+    max_batch_size = max_batch_size or target_batch_size
+    key = _cache_key(model_name, seq_lengths, target_batch_size, optimizer)
+
+    # Earlier measurements on this host; only missing configurations are probed
+    known = {}
+    if cache_path:
+        for probe in (_load_cache(cache_path).get(key) or {}).get("probes", []):
+            known[(probe["batch_size"], probe["max_length"])] = probe
+    new_probes = 0
+
+    budget = ram_budget_gb * 1024 ** 3
+    probes = []
+    chosen = None
+
+    for seq_len in seq_lengths:
+        fits = []
+        batch_size = 1
+        while batch_size <= max_batch_size:
+            result = known.get((batch_size, seq_len))
+            if result is None:
+                new_probes += 1
+                try:
+                    result = probe_step(model, batch_size, seq_len, optimizer_name=optimizer)
+                except RuntimeError as e:
+                    result = {"batch_size": batch_size, "max_length": seq_len, "error": str(e)[:200]}
+                known[(batch_size, seq_len)] = result
+            result = dict(result)
+            if "error" in result:
+                probes.append(result)
+                break
+            result["fits"] = result["peak_rss_gb"] * 1024 ** 3 <= budget
+            probes.append(result)
+            if not result["fits"]:
+                break
+            fits.append(result)
+
+            # Activations grow roughly linearly with batch size: stop before the
+            # next doubling would blow the budget (and wake the OOM killer)
+            previous = fits[-2]["peak_rss_gb"] if len(fits) > 1 else None
+            if previous is not None:
+                projected = result["peak_rss_gb"] + 2 * (result["peak_rss_gb"] - previous)
+                if projected * 1024 ** 3 > budget:
+                    break
+            batch_size *= 2
+
+        if fits:
+            best = max(fits, key=lambda r: r["tokens_per_second"])
+            chosen = {
+                "batch_size": best["batch_size"],
+                "max_length": seq_len,
+                "gradient_accumulation_steps": max(1, -(-target_batch_size // best["batch_size"])),
+                "tokens_per_second": best["tokens_per_second"],
+                "peak_rss_gb": best["peak_rss_gb"]
+            }
+            break
+
+    if cache_path and new_probes:
+        cache = _load_cache(cache_path)
+        cache[key] = {
+            "model_name": model_name,
+            "host": platform.node(),
+            "optimizer": optimizer,
+            "probes": sorted(known.values(), key=lambda p: (-p["max_length"], p["batch_size"])),
+            "updated_at": time.time()
+        }
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+
+    if chosen is None:
+        raise RuntimeError(f"No batch size fits within {ram_budget_gb} GB "
+                           f"(smallest probe: {probes[0] if probes else 'none'})")
+
+    result = {
+        **chosen,
+        "model_name": model_name,
+        "ram_budget_gb": ram_budget_gb,
+        "target_batch_size": target_batch_size,
+        "optimizer": optimizer,
+        "host": platform.node(),
+        "probes": probes,
+        "created_at": time.time()
+    }
+
+    return {**result, "cached": new_probes == 0}
+
+
+def default_ram_budget_gb(fraction: float = 0.8) -> float:
+    """A share of the RAM that is currently available"""
+    if not HAS_PSUTIL:
+        raise RuntimeError("psutil is required for memory probing. Install with: pip install psutil")
+    return round(psutil.virtual_memory().available * fraction / 1024 ** 3, 2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Find the fastest batch size that fits a RAM budget')
+    parser.add_argument('--model-name', type=str, required=True, help='Model name or path')
+    parser.add_argument('--ram-budget-gb', type=float, default=None,
+                        help='Peak RSS budget (default: 80%% of available RAM)')
+    parser.add_argument('--max-length', type=str, default='512',
+                        help='Sequence length, or comma-separated candidates (longest that fits wins)')
+    parser.add_argument('--target-batch-size', type=int, default=16, help='Effective batch size to reach')
+    parser.add_argument('--cache', type=str, default=DEFAULT_CACHE, help='Cache file ("" to disable)')
+    parser.add_argument('--optimizer', type=str, default='adamw',
+                        help='Optimizer used in the probes (see lean_optimizers.py)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    from model_loader import load_causal_lm
+
+    # Also handles pruned checkpoints (eager attention)
+    model, _ = load_causal_lm(args.model_name)
+    result = autotune_batch_size(
+        model,
+        args.model_name,
+        args.ram_budget_gb or default_ram_budget_gb(),
+        [int(v) for v in args.max_length.split(',')],
+        target_batch_size=args.target_batch_size,
+        cache_path=args.cache or None,
+        optimizer=args.optimizer
+    )
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Offline CPU benchmark suite for the Python data/training/eval scripts.
+
+Every benchmark runs on synthetic Persian data generated on the fly, so no
+datasets, models or network access are needed:
+
+    normalize      normalize_persian_conversation_dataset throughput
+    checksum       generate_dataset_metadata.generate_checksums throughput
+    tokenize       chat tokenization (tokenize_chat_batch) with a BPE tokenizer
+                   trained on the synthetic corpus, or --tokenizer
+    regressor      TinyRegressor training steps/s (train_in_memory)
+    causal_lm      training steps/s of a tiny randomly initialized GPT-2
+    eval           eval forward tokens/s of the same model
+    progress       cost of a ProgressCallback.on_log call (progress JSON, metrics log)
+
+Results are written as JSON together with machine and library info; pass
+--compare with an earlier result to print relative changes.
+
+Usage:
+    python3 scripts/benchmark_pipeline.py --output logs/benchmarks/latest.json
+    python3 scripts/benchmark_pipeline.py --only tokenize,causal_lm --compare logs/benchmarks/baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+BENCHMARKS = ["normalize", "checksum", "tokenize", "regressor", "causal_lm", "eval", "progress"]
+
+# Small Persian vocabulary for synthetic conversations
+PERSIAN_WORDS = (
+    "سلام خوب ممنون لطفا کمک می‌توانم چطور امروز فردا کتاب مدرسه دانشگاه شهر تهران "
+    "ایران زبان فارسی یادگیری ماشین داده مدل آموزش سوال پاسخ درباره بیشتر توضیح بدهید "
+    "من شما ما آنها است هست نیست بود خواهد کرد کردن رفتن آمدن دیدن خواندن نوشتن "
+    "هوا آفتابی بارانی سرد گرم غذا خانه کار دوست خانواده سفر قطار هواپیما ساعت روز شب"
+).split()
+
+
+def synthetic_sentence(rng: random.Random, min_words: int = 4, max_words: int = 16) -> str:
+    words = rng.choices(PERSIAN_WORDS, k=rng.randint(min_words, max_words))
+    return " ".join(words) + rng.choice([".", "؟", "!"])
+
+
+def synthetic_conversation(rng: random.Random, turns: int = 4) -> List[Dict[str, str]]:
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": synthetic_sentence(rng)}
+        for i in range(turns)
+    ]
+
+
+def write_raw_conversations(directory: Path, n_files: int, groups_per_file: int, rng: random.Random):
+    """Raw files in the nested-list layout normalize_persian_text.py consumes"""
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(n_files):
+        data = [[synthetic_sentence(rng) for _ in range(rng.randint(2, 6))] for _ in range(groups_per_file)]
+        with open(directory / f"part_{i:04d}.json", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+
+def _median_time(fn: Callable[[], None], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def _quiet(fn: Callable[[], None]) -> Callable[[], None]:
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+    return run
+
+
+def bench_normalize(ctx: Dict) -> Dict:
+    from normalize_persian_text import normalize_persian_conversation_dataset
+
+    raw_dir = ctx["workdir"] / "raw"
+    write_raw_conversations(raw_dir, n_files=20, groups_per_file=ctx["scale"] * 50, rng=random.Random(1))
+    output = ctx["workdir"] / "combined.jsonl"
+    seconds = _median_time(_quiet(lambda: normalize_persian_conversation_dataset(str(raw_dir), str(output))),
+                           ctx["repeat"])
+    records = sum(1 for _ in open(output, "rb"))
+    input_mb = sum(p.stat().st_size for p in raw_dir.iterdir()) / 1024 ** 2
+    ctx["combined"] = output
+    return {
+        "records": records,
+        "input_mb": round(input_mb, 2),
+        "seconds": round(seconds, 4),
+        "records_per_second": round(records / seconds, 1),
+        "mb_per_second": round(input_mb / seconds, 2)
+    }
+
+
+def bench_checksum(ctx: Dict) -> Dict:
+    from generate_dataset_metadata import generate_checksums
+
+    data_dir = ctx["workdir"] / "checksum_data"
+    data_dir.mkdir(exist_ok=True)
+    rng = random.Random(2)
+    n_files = 16
+    file_mb = max(1, ctx["scale"] * 4)
+    for i in range(n_files):
+        with open(data_dir / f"file_{i:03d}.bin", "wb") as f:
+            f.write(rng.randbytes(file_mb * 1024 ** 2))
+    total_mb = n_files * file_mb
+    seconds = _median_time(
+        lambda: generate_checksums(str(data_dir), str(ctx["workdir"] / "checksums.txt")), ctx["repeat"])
+    return {
+        "files": n_files,
+        "total_mb": total_mb,
+        "seconds": round(seconds, 4),
+        "mb_per_second": round(total_mb / seconds, 1)
+    }
+
+
+def _get_tokenizer(ctx: Dict):
+    """--tokenizer if given, else a small BPE tokenizer trained on synthetic text"""
+    if "tokenizer" in ctx:
+        return ctx["tokenizer"]
+    from transformers import AutoTokenizer, PreTrainedTokenizerFast
+
+    if ctx["tokenizer_path"]:
+        tokenizer = AutoTokenizer.from_pretrained(ctx["tokenizer_path"])
+    else:
+        from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+
+        rng = random.Random(3)
+        corpus = [synthetic_sentence(rng) for _ in range(5000)]
+        backend = Tokenizer(models.BPE(unk_token="<unk>"))
+        backend.pre_tokenizer = pre_tokenizers.Whitespace()
+        backend.train_from_iterator(corpus, trainers.BpeTrainer(vocab_size=2000, special_tokens=["<unk>", "<eos>"]))
+        tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>", eos_token="<eos>")
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    ctx["tokenizer"] = tokenizer
+    return tokenizer
+
+
+def bench_tokenize(ctx: Dict) -> Dict:
+    from train_real_pytorch import tokenize_chat_batch
+
+    tokenizer = _get_tokenizer(ctx)
+    rng = random.Random(4)
+    batch = [synthetic_conversation(rng) for _ in range(ctx["scale"] * 1000)]
+    chars = sum(len(m["content"]) for conv in batch for m in conv)
+    result = {}
+    seconds = _median_time(lambda: result.update(tokenize_chat_batch(batch, tokenizer, ctx["max_length"])),
+                           ctx["repeat"])
+    tokens = sum(sum(mask) for mask in result["attention_mask"])
+    return {
+        "conversations": len(batch),
+        "tokens": tokens,
+        "seconds": round(seconds, 4),
+        "conversations_per_second": round(len(batch) / seconds, 1),
+        "tokens_per_second": round(tokens / seconds, 1),
+        "chars_per_second": round(chars / seconds, 1)
+    }
+
+
+def bench_regressor(ctx: Dict) -> Dict:
+    import torch
+    from train_minimal_job import TinyRegressor, generate_synthetic_data, train_in_memory
+
+    X, y = generate_synthetic_data(ctx["scale"] * 10000)
+    X, y = torch.from_numpy(X), torch.from_numpy(y)
+    results = {}
+    for batch_size in (16, 256):
+        steps = 3 * -(-X.shape[0] // batch_size)
+        seconds = _median_time(
+            lambda: train_in_memory(TinyRegressor(), X, y, epochs=3, batch_size=batch_size, lr=0.01),
+            ctx["repeat"])
+        results[f"batch_{batch_size}"] = {
+            "steps": steps,
+            "seconds": round(seconds, 4),
+            "steps_per_second": round(steps / seconds, 1)
+        }
+    return results
+
+
+def _tiny_lm(ctx: Dict):
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    tokenizer = _get_tokenizer(ctx)
+    config = GPT2Config(vocab_size=len(tokenizer), n_positions=ctx["max_length"], n_embd=128,
+                        n_layer=2, n_head=4, bos_token_id=tokenizer.eos_token_id,
+                        eos_token_id=tokenizer.eos_token_id)
+    return GPT2LMHeadModel(config)
+
+
+def _lm_batches(ctx: Dict, n_batches: int, batch_size: int):
+    import torch
+    from train_real_pytorch import tokenize_chat_batch
+
+    tokenizer = _get_tokenizer(ctx)
+    rng = random.Random(5)
+    encoded = tokenize_chat_batch([synthetic_conversation(rng) for _ in range(n_batches * batch_size)],
+                                  tokenizer, ctx["max_length"])
+    tensors = {k: torch.tensor(v) for k, v in encoded.items()}
+    return [{k: v[i * batch_size:(i + 1) * batch_size] for k, v in tensors.items()} for i in range(n_batches)]
+
+
+def bench_causal_lm(ctx: Dict) -> Dict:
+    import torch
+
+    torch.manual_seed(0)
+    model = _tiny_lm(ctx)
+    batches = _lm_batches(ctx, n_batches=ctx["scale"] * 10, batch_size=8)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    model.train()
+
+    def run():
+        for batch in batches:
+            loss = model(**batch).loss
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+
+    run()  # warm-up and optimizer state allocation
+    seconds = _median_time(run, ctx["repeat"])
+    tokens = sum(int(b["attention_mask"].sum()) for b in batches)
+    ctx["lm_step_seconds"] = seconds / len(batches)
+    return {
+        "parameters": sum(p.numel() for p in model.parameters()),
+        "steps": len(batches),
+        "batch_size": 8,
+        "max_length": ctx["max_length"],
+        "seconds": round(seconds, 4),
+        "steps_per_second": round(len(batches) / seconds, 2),
+        "tokens_per_second": round(tokens / seconds, 1)
+    }
+
+
+def bench_eval(ctx: Dict) -> Dict:
+    import torch
+
+    torch.manual_seed(0)
+    model = _tiny_lm(ctx)
+    batches = _lm_batches(ctx, n_batches=ctx["scale"] * 10, batch_size=16)
+    model.eval()
+    losses = []
+
+    def run():
+        losses.clear()
+        with torch.inference_mode():
+            for batch in batches:
+                losses.append(model(**batch).loss)
+
+    run()
+    seconds = _median_time(run, ctx["repeat"])
+    tokens = sum(int(b["attention_mask"].sum()) for b in batches)
+    return {
+        "batches": len(batches),
+        "batch_size": 16,
+        "seconds": round(seconds, 4),
+        "tokens_per_second": round(tokens / seconds, 1),
+        "mean_loss": round(float(torch.stack(losses).mean()), 4)
+    }
+
+
+def bench_progress(ctx: Dict) -> Dict:
+    """Cost of one ProgressCallback.on_log call (progress JSON and metrics log)"""
+    from types import SimpleNamespace
+
+    from metrics_log import MetricsLogWriter
+    from train_real_pytorch import ProgressCallback
+    from training_instrumentation import StepTimer
+
+    step_timer = StepTimer()
+    for _ in range(20):
+        step_timer.begin_step()
+        step_timer.add("forward", 0.001)
+        step_timer.add_batch(8, 8 * 512)
+    step_timer.end_step()
+    metrics_log = MetricsLogWriter(str(ctx["workdir"] / "metrics_log_bench"), reset=True)
+    callback = ProgressCallback(str(ctx["workdir"] / "training_progress_bench.json"),
+                                step_timer=step_timer, metrics_log=metrics_log)
+    state = SimpleNamespace(global_step=0, max_steps=1000, epoch=0.0)
+    logs = {"loss": 2.5, "learning_rate": 5e-5, "grad_norm": 1.0}
+
+    writes = 1000
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for step in range(1, writes + 1):
+            state.global_step, state.epoch = step, step / 1000
+            start = time.perf_counter()
+            callback.on_log(None, state, None, logs=logs)
+            samples.append(time.perf_counter() - start)
+    metrics_log.close()
+    samples.sort()
+    mean = sum(samples) / writes
+    result = {
+        "writes": writes,
+        "mean_us": round(mean * 1e6, 1),
+        "p95_us": round(samples[int(0.95 * (writes - 1))] * 1e6, 1)
+    }
+    if ctx.get("lm_step_seconds"):
+        result["percent_of_lm_step"] = round(100 * mean / ctx["lm_step_seconds"], 3)
+    return result
+
+
+def _package_version(name: str) -> Optional[str]:
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return None
+
+
+def machine_info() -> Dict:
+    info = {
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "packages": {name: _package_version(name)
+                     for name in ("torch", "transformers", "tokenizers", "numpy", "pandas")}
+    }
+    try:
+        from detect_hardware import load_static_info
+        static = load_static_info()
+        info["cpu"] = {k: v for k, v in static["cpu"].items() if k != "caches"}
+        info["memory_total_gb"] = static["memory_total_gb"]
+    except Exception as e:
+        info["cpu_error"] = str(e)
+    try:
+        info["git_commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        info["git_commit"] = None
+    return info
+
+
+def run_benchmarks(names: List[str], scale: int = 1, repeat: int = 3, max_length: int = 128,
+                   tokenizer_path: Optional[str] = None) -> Dict:
+    """Run the selected benchmarks; failures are recorded, not raised"""
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        ctx = {"workdir": Path(workdir), "scale": scale, "repeat": repeat,
+               "max_length": max_length, "tokenizer_path": tokenizer_path}
+        for name in names:
+            print(f"⏱️  {name}...", flush=True)
+            start = time.perf_counter()
+            try:
+                results[name] = globals()[f"bench_{name}"](ctx)
+            except ImportError as e:
+                results[name] = {"skipped": f"missing dependency: {e}"}
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+            results[name]["wall_seconds"] = round(time.perf_counter() - start, 2)
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": {"scale": scale, "repeat": repeat, "max_length": max_length, "tokenizer": tokenizer_path},
+        "machine": machine_info(),
+        "results": results
+    }
+
+
+def _rates(result: Dict, prefix: str = "") -> Dict[str, float]:
+    """Flatten the throughput numbers (*_per_second) of a result"""
+    rates = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            rates.update(_rates(value, f"{prefix}{key}."))
+        elif key.endswith("_per_second") and isinstance(value, (int, float)):
+            rates[prefix + key] = value
+    return rates
+
+
+def compare(current: Dict, baseline: Dict):
+    print(f"\n📊 Compared with {baseline.get('created_at')} "
+          f"(commit {baseline.get('machine', {}).get('git_commit')})")
+    for name, result in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        old_rates = _rates(old)
+        for key, value in _rates(result).items():
+            if old_rates.get(key):
+                change = 100.0 * (value - old_rates[key]) / old_rates[key]
+                print(f"   {name}.{key}: {old_rates[key]} -> {value} ({change:+.1f}%)")
+
+
+def print_summary(report: Dict):
+    print("\n" + "=" * 60)
+    print("📈 Benchmark results")
+    print("=" * 60)
+    for name, result in report["results"].items():
+        if "skipped" in result or "error" in result:
+            print(f"{name:>10}: {result.get('skipped') or result.get('error')}")
+            continue
+        rates = ", ".join(f"{k} {v}" for k, v in _rates(result).items())
+        print(f"{name:>10}: {rates or result}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline CPU benchmarks for the Python pipeline scripts')
+    parser.add_argument('--only', type=str, default=None,
+                        help=f'Comma-separated subset of: {",".join(BENCHMARKS)}')
+    parser.add_argument('--scale', type=int, default=1, help='Multiplier for synthetic data sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed repetitions (median is reported)')
+    parser.add_argument('--max-length', type=int, default=128, help='Sequence length for tokenization and LM')
+    parser.add_argument('--tokenizer', type=str, default=None,
+                        help='Tokenizer name/path (default: BPE trained on the synthetic corpus)')
+    parser.add_argument('--output', type=str, default='logs/benchmarks/latest.json', help='Result JSON file')
+    parser.add_argument('--compare', type=str, default=None, help='Earlier result JSON to compare against')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    names = BENCHMARKS
+    if args.only:
+        names = [n.strip() for n in args.only.split(',') if n.strip()]
+        unknown = [n for n in names if n not in BENCHMARKS]
+        if unknown:
+            print(f"❌ Unknown benchmarks: {', '.join(unknown)}", file=sys.stderr)
+            return 1
+
+    report = run_benchmarks(names, scale=args.scale, repeat=args.repeat,
+                            max_length=args.max_length, tokenizer_path=args.tokenizer)
+    print_summary(report)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Results saved to: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
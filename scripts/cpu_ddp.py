@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Multi-process data-parallel CPU training with the gloo backend.
+
+One PyTorch process stops scaling long before it runs out of cores (OpenMP
+barriers, memory bandwidth across sockets), so large hosts train faster as
+several data-parallel ranks with a few cores each. `launch()` starts
+--nproc-per-node copies of a training script with the torch.distributed
+environment set (RANK, LOCAL_RANK, WORLD_SIZE, MASTER_ADDR, MASTER_PORT) and
+each rank pinned to its own set of physical cores:
+
+  - cores are taken from the process's allowed CPU set, one logical CPU
+    per physical core, ordered by NUMA node, so with one rank per socket
+    (detect_hardware's data_parallel_ranks) every rank stays on its node
+    and first-touch allocation keeps its memory local,
+  - OMP_NUM_THREADS / MKL_NUM_THREADS match the core count of the rank.
+
+Across several hosts, run the same command on every node with --nnodes,
+--node-rank and the address of node 0 as --master-addr (the rendezvous);
+set GLOO_SOCKET_IFNAME if the hosts have more than one network interface.
+
+Inside the ranks, `distributed_env()` reports the layout and
+`is_main_process()` gates progress, log and checkpoint writes.
+
+Usage:
+    python3 scripts/cpu_ddp.py --nproc-per-node 4                # show the core plan
+    python3 scripts/train_real_pytorch.py --nproc-per-node 4 ...  # train with 4 ranks
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+DEFAULT_MASTER_PORT = 29500
+CORES_ENV = "CPU_DDP_CORES"
+
+
+def _allowed_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def physical_cores(cpus: Optional[List[int]] = None) -> List[int]:
+    """One logical CPU per physical core, grouped by NUMA node"""
+    from detect_hardware import SYS_CPU, SYS_NODE, _parse_cpulist, _read_text
+
+    cpus = cpus if cpus is not None else _allowed_cpus()
+    allowed = set(cpus)
+    seen = set()
+    primary = []
+    for cpu in cpus:
+        siblings = _parse_cpulist(_read_text(f"{SYS_CPU}/cpu{cpu}/topology/thread_siblings_list")) or [cpu]
+        core = tuple(sorted(siblings))
+        if core in seen:
+            continue
+        seen.add(core)
+        primary.append(next((s for s in core if s in allowed), cpu))
+
+    node_of = {}
+    for node in _parse_cpulist(_read_text(f"{SYS_NODE}/online")):
+        for cpu in _parse_cpulist(_read_text(f"{SYS_NODE}/node{node}/cpulist")):
+            node_of[cpu] = node
+    return sorted(primary, key=lambda c: (node_of.get(c, 0), c))
+
+
+def plan_core_sets(nproc: int, cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """Split the physical cores into `nproc` contiguous, equally sized sets"""
+    cores = physical_cores(cpus)
+    if nproc > len(cores):
+        # Oversubscribed (e.g. testing on a small VM): share cores round-robin
+        return [[cores[i % len(cores)]] for i in range(nproc)]
+    per_rank = len(cores) // nproc
+    return [cores[i * per_rank:(i + 1) * per_rank] for i in range(nproc)]
+
+
+def launch(argv: List[str], nproc_per_node: int, nnodes: int = 1, node_rank: int = 0,
+           master_addr: str = "127.0.0.1", master_port: int = DEFAULT_MASTER_PORT) -> int:
+    """Run `argv` (a Python script and its arguments) as this node's ranks; returns the exit code"""
+    core_sets = plan_core_sets(nproc_per_node)
+    world_size = nnodes * nproc_per_node
+    procs = []
+    for local_rank, cores in enumerate(core_sets):
+        rank = node_rank * nproc_per_node + local_rank
+        env = dict(os.environ)
+        env.update({
+            "RANK": str(rank),
+            "LOCAL_RANK": str(local_rank),
+            "WORLD_SIZE": str(world_size),
+            "LOCAL_WORLD_SIZE": str(nproc_per_node),
+            "NODE_RANK": str(node_rank),
+            "MASTER_ADDR": master_addr,
+            "MASTER_PORT": str(master_port),
+            "OMP_NUM_THREADS": str(len(cores)),
+            "MKL_NUM_THREADS": str(len(cores)),
+            CORES_ENV: ",".join(map(str, cores)),
+            "PYTHONUNBUFFERED": "1"
+        })
+        print(f"🚀 rank {rank}/{world_size}: cores {cores}", flush=True)
+        # Pinned before exec, so every OpenMP thread of the rank inherits the mask
+        pin = (lambda c=cores: os.sched_setaffinity(0, c)) if hasattr(os, "sched_setaffinity") else None
+        procs.append(subprocess.Popen([sys.executable] + argv, env=env, preexec_fn=pin))
+
+    def forward(signum, frame):
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signum)
+
+    rank0 = procs[0]
+
+    def forward_profile(signum, frame):
+        # SIGUSR1 starts a profiler window (training_instrumentation), which only local rank 0 runs
+        if rank0.poll() is None:
+            rank0.send_signal(signum)
+
+    previous = {sig: signal.signal(sig, forward) for sig in (signal.SIGINT, signal.SIGTERM)}
+    if hasattr(signal, "SIGUSR1"):
+        previous[signal.SIGUSR1] = signal.signal(signal.SIGUSR1, forward_profile)
+    exit_code = 0
+    try:
+        while procs:
+            for proc in list(procs):
+                code = proc.poll()
+                if code is None:
+                    continue
+                procs.remove(proc)
+                if code != 0 and exit_code == 0:
+                    # One failed rank would leave the others blocked in a collective
+                    print(f"❌ A rank exited with code {code}; stopping the others", file=sys.stderr, flush=True)
+                    exit_code = code
+                    for other in procs:
+                        other.terminate()
+            time.sleep(0.2)
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+    return exit_code
+
+
+def distributed_env() -> Optional[Dict]:
+    """Rank layout when running as one of several ranks, else None"""
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if "RANK" not in os.environ or world_size <= 1:
+        return None
+    cores = os.environ.get(CORES_ENV)
+    return {
+        "rank": int(os.environ["RANK"]),
+        "local_rank": int(os.environ.get("LOCAL_RANK", 0)),
+        "world_size": world_size,
+        "local_world_size": int(os.environ.get("LOCAL_WORLD_SIZE", world_size)),
+        "cores": [int(c) for c in cores.split(",")] if cores else None
+    }
+
+
+def is_main_process() -> bool:
+    env = distributed_env()
+    return env is None or env["rank"] == 0
+
+
+def init_process_group(timeout_minutes: int = 30):
+    """Join the gloo process group (no-op outside a distributed run or if already joined)"""
+    import datetime
+
+    import torch.distributed as dist
+
+    if distributed_env() is None or dist.is_initialized():
+        return
+    dist.init_process_group("gloo", timeout=datetime.timedelta(minutes=timeout_minutes))
+
+
+def broadcast_object(obj):
+    """Rank 0's `obj` on every rank"""
+    import torch.distributed as dist
+
+    if distributed_env() is None:
+        return obj
+    holder = [obj]
+    dist.broadcast_object_list(holder, src=0)
+    return holder[0]
+
+
+@contextmanager
+def local_main_first():
+    """Let local rank 0 run the block first (e.g. to fill the datasets cache), then the others"""
+    import torch.distributed as dist
+
+    env = distributed_env()
+    try:
+        if env is not None and env["local_rank"] != 0:
+            dist.barrier()
+        yield
+    finally:
+        # Release the waiting ranks even if rank 0 raised, instead of leaving them hung
+        if env is not None and env["local_rank"] == 0:
+            dist.barrier()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Show the per-rank core plan for CPU data-parallel training')
+    parser.add_argument('--nproc-per-node', type=int, default=None,
+                        help='Ranks on this host (default: one per NUMA node)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    nproc = args.nproc_per_node
+    if nproc is None:
+        from detect_hardware import cpu_tuning, load_static_info
+        placement = cpu_tuning(load_static_info()).get("numa_placement")
+        nproc = placement["data_parallel_ranks"] if placement else 1
+
+    cores = physical_cores()
+    print(f"🖥️  {len(cores)} physical cores available, {nproc} rank(s)")
+    for rank, core_set in enumerate(plan_core_sets(nproc)):
+        print(f"   rank {rank}: {len(core_set)} cores {core_set}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
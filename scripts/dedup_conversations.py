@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Streaming exact and near-duplicate removal for conversation JSONL files.
+
+Exact duplicates are detected with 64-bit content hashes kept in sorted
+numpy runs (8 bytes per unique record). Near duplicates are detected with
+MinHash signatures over character shingles and LSH banding; only the band
+keys of kept records are stored, so memory grows with the number of unique
+records, not with the input size.
+
+Usage:
+    python3 scripts/dedup_conversations.py --input datasets/text/persian_conversation/combined.jsonl \
+                                           --output combined.dedup.jsonl \
+                                           --report logs/dedup_report.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Multiplier for the rolling shingle hash and the band key mixer
+_SHINGLE_PRIME = np.uint64(0x100000001B3)
+_BAND_PRIME = np.uint64(0x9E3779B97F4A7C15)
+
+
+class SortedHashSet:
+    """Set of uint64 hashes stored as a few sorted numpy runs.
+
+    New hashes are appended as a sorted run; runs of similar size are merged
+    so there are only O(log n) of them and lookups stay vectorized.
+    """
+
+    def __init__(self):
+        self.runs: List[np.ndarray] = []
+
+    def __len__(self):
+        return sum(run.size for run in self.runs)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(run.nbytes for run in self.runs)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """Return a boolean mask of which keys are already in the set"""
+        found = np.zeros(keys.shape, dtype=bool)
+        for run in self.runs:
+            idx = np.searchsorted(run, keys)
+            idx[idx == run.size] = 0
+            found |= run[idx] == keys
+        return found
+
+    def add(self, keys: np.ndarray):
+        """Add keys (duplicates within keys are allowed)"""
+        if keys.size == 0:
+            return
+        self.runs.append(np.unique(keys.astype(np.uint64, copy=False).ravel()))
+        while len(self.runs) >= 2 and self.runs[-2].size <= 2 * self.runs[-1].size:
+            last = self.runs.pop()
+            prev = self.runs.pop()
+            self.runs.append(np.union1d(prev, last))
+
+
+def record_text(record: Dict[str, Any]) -> str:
+    """Canonical text of a record used for duplicate detection"""
+    if "messages" in record:
+        parts = [f"{m.get('role', '')}: {m.get('content', '')}" for m in record["messages"]]
+        text = "\n".join(parts)
+    elif "question" in record and "answer" in record:
+        text = f"{record['question']}\n{record['answer']}"
+    else:
+        text = str(record.get("text", ""))
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def exact_hash(text: str) -> int:
+    """64-bit content hash"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class MinHashLSH:
+    """MinHash signatures over character shingles, split into LSH bands"""
+
+    def __init__(self, num_perm: int = 64, bands: int = 8, shingle_size: int = 5, seed: int = 1):
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing needs odd multipliers
+        self._a = rng.integers(1, 2**63, size=(num_perm, 1), dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=(num_perm, 1), dtype=np.uint64)
+        self._band_salt = rng.integers(0, 2**63, size=bands, dtype=np.uint64)
+
+    @property
+    def threshold(self) -> float:
+        """Approximate Jaccard similarity at which records start to collide"""
+        return (1.0 / self.bands) ** (1.0 / self.rows)
+
+    def shingles(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        k = self.shingle_size
+        if codes.size <= k:
+            return np.array([exact_hash(text)], dtype=np.uint64)
+        n = codes.size - k + 1
+        h = np.zeros(n, dtype=np.uint64)
+        for j in range(k):
+            h = h * _SHINGLE_PRIME + codes[j:j + n]
+        return np.unique(h)
+
+    def band_keys(self, text: str) -> np.ndarray:
+        """Return one uint64 key per band"""
+        sh = self.shingles(text)
+        signature = ((self._a * sh[None, :] + self._b) >> np.uint64(32)).min(axis=1)
+        rows = signature.reshape(self.bands, self.rows)
+        keys = self._band_salt.copy()
+        for r in range(self.rows):
+            keys = (keys ^ rows[:, r]) * _BAND_PRIME
+        return keys ^ (keys >> np.uint64(29))
+
+
+def _iter_chunks(lines: Iterable[str], chunk_size: int) -> Iterable[List[str]]:
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def dedup_jsonl(
+    input_path: str,
+    output_path: str,
+    near: bool = True,
+    num_perm: int = 64,
+    bands: int = 8,
+    shingle_size: int = 5,
+    chunk_size: int = 65536,
+    report_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Stream input_path to output_path, dropping exact and near duplicates.
+
+    The first occurrence of every record wins. Returns the report dict.
+    """
+    start = time.time()
+    exact_seen = SortedHashSet()
+    band_seen = SortedHashSet()
+    lsh = MinHashLSH(num_perm=num_perm, bands=bands, shingle_size=shingle_size) if near else None
+
+    stats = {
+        "input_lines": 0,
+        "kept": 0,
+        "exact_duplicates_removed": 0,
+        "near_duplicates_removed": 0,
+        "invalid_lines": 0,
+    }
+
+    with open(input_path, "r", encoding="utf-8") as src, open(output_path, "w", encoding="utf-8") as dst:
+        for chunk in _iter_chunks(src, chunk_size):
+            lines = []
+            texts = []
+            for line in chunk:
+                line = line.strip()
+                if not line:
+                    continue
+                stats["input_lines"] += 1
+                try:
+                    texts.append(record_text(json.loads(line)))
+                    lines.append(line)
+                except (json.JSONDecodeError, AttributeError, TypeError):
+                    stats["invalid_lines"] += 1
+            if not lines:
+                continue
+
+            # Exact: first occurrence inside the chunk and not seen in earlier chunks
+            hashes = np.fromiter((exact_hash(t) for t in texts), dtype=np.uint64, count=len(texts))
+            _, first = np.unique(hashes, return_index=True)
+            keep = np.zeros(len(lines), dtype=bool)
+            keep[first] = True
+            keep &= ~exact_seen.contains(hashes)
+            stats["exact_duplicates_removed"] += int(len(lines) - keep.sum())
+            exact_seen.add(hashes[keep])
+
+            # Near: drop records sharing any LSH band with an earlier kept record
+            if lsh is not None:
+                candidates = np.flatnonzero(keep)
+                if candidates.size:
+                    keys = np.stack([lsh.band_keys(texts[i]) for i in candidates])
+                    hit_old = band_seen.contains(keys.ravel()).reshape(keys.shape).any(axis=1)
+                    local = set()
+                    kept_rows = []
+                    for row, i in enumerate(candidates):
+                        row_keys = keys[row].tolist()
+                        if hit_old[row] or any(k in local for k in row_keys):
+                            keep[i] = False
+                            stats["near_duplicates_removed"] += 1
+                        else:
+                            local.update(row_keys)
+                            kept_rows.append(row)
+                    band_seen.add(keys[kept_rows])
+
+            for i in np.flatnonzero(keep):
+                dst.write(lines[i] + "\n")
+            stats["kept"] += int(keep.sum())
+
+    report = {
+        "input": str(input_path),
+        "output": str(output_path),
+        **stats,
+        "near_dedup": near,
+        "num_perm": num_perm if near else None,
+        "bands": bands if near else None,
+        "approx_jaccard_threshold": round(lsh.threshold, 3) if lsh else None,
+        "index_bytes": exact_seen.nbytes + band_seen.nbytes,
+        "elapsed_seconds": round(time.time() - start, 3),
+    }
+
+    if report_path:
+        write_report(report, report_path)
+
+    return report
+
+
+def write_report(report: Dict[str, Any], report_path: str):
+    Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+def dedup_in_place(path: str, report_path: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+    """Deduplicate a JSONL file, replacing it atomically"""
+    tmp_path = f"{path}.dedup.tmp"
+    try:
+        report = dedup_jsonl(path, tmp_path, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Leave the dataset as it was, without a half-written copy next to it
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    report["output"] = str(path)
+    if report_path:
+        write_report(report, report_path)
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"🧹 Deduplicated {report['input_lines']} records -> {report['kept']} kept")
+    print(f"   - Exact duplicates removed: {report['exact_duplicates_removed']}")
+    print(f"   - Near duplicates removed: {report['near_duplicates_removed']}")
+    if report["invalid_lines"]:
+        print(f"   - Invalid lines skipped: {report['invalid_lines']}")
+    print(f"   - Index memory: {report['index_bytes'] / (1024**2):.1f} MB, "
+          f"time: {report['elapsed_seconds']}s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Remove exact and near-duplicate records from a JSONL dataset')
+    parser.add_argument('--input', type=str, required=True, help='Input JSONL file')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Output JSONL file (default: rewrite input in place)')
+    parser.add_argument('--report', type=str, default='logs/dedup_report.json', help='Report JSON file')
+    parser.add_argument('--no-near', action='store_true', help='Only remove exact duplicates')
+    parser.add_argument('--num-perm', type=int, default=64, help='MinHash permutations')
+    parser.add_argument('--bands', type=int, default=8,
+                        help='LSH bands (more bands = lower similarity threshold, 8 bytes/record each)')
+    parser.add_argument('--shingle-size', type=int, default=5, help='Character shingle length')
+    parser.add_argument('--chunk-size', type=int, default=65536, help='Records processed per batch')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"❌ Input file not found: {args.input}", file=sys.stderr)
+        return 1
+
+    kwargs = dict(
+        near=not args.no_near,
+        num_perm=args.num_perm,
+        bands=args.bands,
+        shingle_size=args.shingle_size,
+        chunk_size=args.chunk_size,
+        report_path=args.report,
+    )
+    if args.output:
+        report = dedup_jsonl(args.input, args.output, **kwargs)
+    else:
+        report = dedup_in_place(args.input, **kwargs)
+
+    print_report(report)
+    print(f"📈 Report saved to: {args.report}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,15 +8,17 @@ Usage: python3 scripts/detect_hardware.py
 """
 
 import sys
+import os
 import platform
 import json
+import time
+import importlib.util
 from typing import Dict, Optional, Tuple
 
-try:
-    import torch
-    HAS_TORCH = True
-except ImportError:
-    HAS_TORCH = False
+# torch is imported lazily: importing it takes seconds and is only needed
+# for GPU detection (cached, see load_static_info) and profiling
+HAS_TORCH = importlib.util.find_spec("torch") is not None
+if not HAS_TORCH:
     print("⚠️  PyTorch not installed. Install with: pip install torch")
 
 try:
@@ -27,8 +29,117 @@ except ImportError:
     print("⚠️  psutil not installed. Install with: pip install psutil")
 
 
-def get_cpu_info() -> Dict:
-    """Get CPU information"""
+# Static hardware facts (CPU model, core counts, total RAM, CUDA devices)
+# are cached on disk; available RAM, free disk and CPU frequency stay live.
+CACHE_PATH = os.environ.get("HARDWARE_CACHE_PATH", "artifacts/hardware_cache.json")
+CACHE_TTL_SECONDS = 24 * 3600
+CACHE_ENABLED = True
+CACHE_VERSION = 2
+
+_static_info: Optional[Dict] = None
+
+
+def _host_key() -> str:
+    """Changes when the host or its boot changes, invalidating the cache"""
+    boot = int(psutil.boot_time()) if HAS_PSUTIL else 0
+    return f"{platform.node()}|{boot}|{HAS_TORCH}|v{CACHE_VERSION}"
+
+
+# /proc/cpuinfo flags that decide which kernels (bf16, int8) pay off
+ISA_FLAGS = {
+    "avx2": "avx2",
+    "avx512f": "avx512f",
+    "avx512_bf16": "avx512_bf16",
+    "avx512_vnni": "avx512_vnni",
+    "avx_vnni": "avx_vnni",
+    "amx_tile": "amx_tile",
+    "amx_bf16": "amx_bf16",
+    "amx_int8": "amx_int8",
+    "neon": "asimd",
+    "sve": "sve",
+}
+
+SYS_CPU = "/sys/devices/system/cpu"
+SYS_NODE = "/sys/devices/system/node"
+
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _parse_cpulist(text: Optional[str]) -> list:
+    """Parse a kernel cpulist such as '0-3,8-11'"""
+    cpus = []
+    for part in (text or "").split(","):
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.extend(range(int(lo), int(hi) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def _collect_cpu_topology() -> Dict:
+    """ISA flags, caches, sockets, SMT and NUMA layout from /proc and /sys (Linux only)"""
+    topology = {}
+    
+    cpuinfo = _read_text("/proc/cpuinfo") or ""
+    flags = set()
+    for line in cpuinfo.splitlines():
+        key, _, value = line.partition(":")
+        key = key.strip()
+        if key in ("flags", "Features") and not flags:
+            flags = set(value.split())
+        elif key == "model name" and "model_name" not in topology:
+            topology["model_name"] = value.strip()
+    if flags:
+        topology["isa"] = {name: flag in flags for name, flag in ISA_FLAGS.items()}
+    
+    caches = []
+    index = 0
+    while os.path.isdir(f"{SYS_CPU}/cpu0/cache/index{index}"):
+        base = f"{SYS_CPU}/cpu0/cache/index{index}"
+        size = _read_text(f"{base}/size") or ""
+        caches.append({
+            "level": int(_read_text(f"{base}/level") or 0),
+            "type": _read_text(f"{base}/type"),
+            "size_kb": int(size[:-1]) * (1024 if size.endswith("M") else 1) if size[:-1].isdigit() else None,
+            "shared_cpus": len(_parse_cpulist(_read_text(f"{base}/shared_cpu_list")))
+        })
+        index += 1
+    if caches:
+        topology["caches"] = caches
+    
+    online = _parse_cpulist(_read_text(f"{SYS_CPU}/online"))
+    if online:
+        packages = {_read_text(f"{SYS_CPU}/cpu{c}/topology/physical_package_id") for c in online}
+        siblings = _parse_cpulist(_read_text(f"{SYS_CPU}/cpu{online[0]}/topology/thread_siblings_list"))
+        topology["sockets"] = len(packages - {None}) or 1
+        topology["smt"] = {
+            "active": _read_text(f"{SYS_CPU}/smt/active") == "1",
+            "threads_per_core": max(1, len(siblings))
+        }
+    
+    nodes = []
+    for node in _parse_cpulist(_read_text(f"{SYS_NODE}/online")):
+        meminfo = _read_text(f"{SYS_NODE}/node{node}/meminfo") or ""
+        mem_kb = next((int(line.split()[-2]) for line in meminfo.splitlines() if "MemTotal" in line), None)
+        nodes.append({
+            "node": node,
+            "cpus": _parse_cpulist(_read_text(f"{SYS_NODE}/node{node}/cpulist")),
+            "memory_gb": round(mem_kb / (1024**2), 2) if mem_kb else None
+        })
+    if nodes:
+        topology["numa_nodes"] = nodes
+    
+    return topology
+
+
+def _collect_cpu_static() -> Dict:
     info = {
         "platform": platform.system(),
         "architecture": platform.machine(),
@@ -39,33 +150,21 @@ def get_cpu_info() -> Dict:
     if HAS_PSUTIL:
         info.update({
             "cpu_count_physical": psutil.cpu_count(logical=False),
-            "cpu_count_logical": psutil.cpu_count(logical=True),
-            "cpu_freq_mhz": psutil.cpu_freq().current if psutil.cpu_freq() else None
+            "cpu_count_logical": psutil.cpu_count(logical=True)
         })
     
-    return info
-
-
-def get_memory_info() -> Dict:
-    """Get RAM information"""
-    if not HAS_PSUTIL:
-        return {"error": "psutil not available"}
-    
-    mem = psutil.virtual_memory()
+    if platform.system() == "Linux":
+        info.update(_collect_cpu_topology())
     
-    return {
-        "total_gb": round(mem.total / (1024**3), 2),
-        "available_gb": round(mem.available / (1024**3), 2),
-        "used_gb": round(mem.used / (1024**3), 2),
-        "percent_used": mem.percent
-    }
+    return info
 
 
-def get_gpu_info() -> Optional[Dict]:
-    """Get GPU information"""
+def _collect_gpu_info() -> Optional[Dict]:
     if not HAS_TORCH:
         return None
     
+    import torch
+    
     if not torch.cuda.is_available():
         return {"available": False, "reason": "CUDA not available"}
     
@@ -93,6 +192,83 @@ def get_gpu_info() -> Optional[Dict]:
         return {"available": False, "error": str(e)}
 
 
+def configure_cache(enabled: bool = True, ttl_seconds: int = CACHE_TTL_SECONDS, path: Optional[str] = None):
+    """Change cache behaviour for this process"""
+    global CACHE_ENABLED, CACHE_TTL_SECONDS, CACHE_PATH
+    CACHE_ENABLED = enabled
+    CACHE_TTL_SECONDS = ttl_seconds
+    if path:
+        CACHE_PATH = path
+
+
+def load_static_info(refresh: bool = False) -> Dict:
+    """Static hardware facts, from the cache file when it is fresh"""
+    global _static_info
+    
+    if _static_info is not None and not refresh:
+        return _static_info
+    
+    if CACHE_ENABLED and not refresh:
+        try:
+            with open(CACHE_PATH, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if (cached.get("host_key") == _host_key()
+                    and time.time() - cached.get("created_at", 0) < CACHE_TTL_SECONDS):
+                _static_info = cached
+                return _static_info
+        except (OSError, ValueError):
+            pass
+    
+    _static_info = {
+        "host_key": _host_key(),
+        "created_at": time.time(),
+        "cpu": _collect_cpu_static(),
+        "memory_total_gb": round(psutil.virtual_memory().total / (1024**3), 2) if HAS_PSUTIL else None,
+        "gpu": _collect_gpu_info()
+    }
+    
+    if CACHE_ENABLED:
+        try:
+            os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+            with open(CACHE_PATH, "w", encoding="utf-8") as f:
+                json.dump(_static_info, f, indent=2)
+        except OSError:
+            pass
+    
+    return _static_info
+
+
+def get_cpu_info() -> Dict:
+    """Get CPU information"""
+    info = dict(load_static_info()["cpu"])
+    
+    if HAS_PSUTIL:
+        freq = psutil.cpu_freq()
+        info["cpu_freq_mhz"] = freq.current if freq else None
+    
+    return info
+
+
+def get_memory_info() -> Dict:
+    """Get RAM information"""
+    if not HAS_PSUTIL:
+        return {"error": "psutil not available"}
+    
+    mem = psutil.virtual_memory()
+    
+    return {
+        "total_gb": load_static_info()["memory_total_gb"],
+        "available_gb": round(mem.available / (1024**3), 2),
+        "used_gb": round(mem.used / (1024**3), 2),
+        "percent_used": mem.percent
+    }
+
+
+def get_gpu_info() -> Optional[Dict]:
+    """Get GPU information"""
+    return load_static_info()["gpu"]
+
+
 def get_disk_info() -> Dict:
     """Get disk space information"""
     if not HAS_PSUTIL:
@@ -110,6 +286,43 @@ def get_disk_info() -> Dict:
         return {"error": str(e)}
 
 
+def cpu_tuning(cpu: Dict) -> Dict:
+    """
+    CPU-specific settings derived from ISA flags and topology: bf16/int8
+    paths, thread count, and NUMA-local placement on multi-socket hosts.
+    """
+    isa = cpu.get("isa", {})
+    nodes = cpu.get("numa_nodes") or []
+    threads_per_core = cpu.get("smt", {}).get("threads_per_core", 1)
+    physical = cpu.get("cpu_count_physical") or os.cpu_count() or 1
+    
+    tuning = {
+        "mixed_precision": "bf16" if isa.get("amx_bf16") or isa.get("avx512_bf16") else "no",
+        "int8_inference": bool(isa.get("amx_int8") or isa.get("avx512_vnni") or isa.get("avx_vnni"))
+    }
+    
+    if len(nodes) > 1:
+        # Keep each process on one node: cross-socket memory traffic costs more
+        # than the extra cores gain, so run one rank per node instead
+        node_cores = max(1, len(nodes[0]["cpus"]) // threads_per_core)
+        tuning.update({
+            "threads": node_cores,
+            "numa_placement": {
+                "nodes": len(nodes),
+                # One prefix per rank (rank i runs under command_prefixes[i]); or let
+                # train_real_pytorch.py --nproc-per-node pin the ranks (cpu_ddp)
+                "command_prefixes": [f"numactl --cpunodebind={n['node']} --membind={n['node']}" for n in nodes],
+                "launcher": f"train_real_pytorch.py --nproc-per-node {len(nodes)}",
+                "data_parallel_ranks": len(nodes)
+            }
+        })
+    else:
+        tuning["threads"] = physical
+    
+    tuning["env"] = {"OMP_NUM_THREADS": str(tuning["threads"])}
+    return tuning
+
+
 def recommend_configuration() -> Tuple[str, str, Dict]:
     """
     Recommend optimal configuration based on hardware
@@ -196,7 +409,8 @@ def recommend_configuration() -> Tuple[str, str, Dict]:
                 "gradient_accumulation": 8,
                 "mixed_precision": "no",
                 "estimated_training_time": "24-48 hours",
-                "warning": "Training will be very slow on CPU"
+                "warning": "Training will be very slow on CPU",
+                **cpu_tuning(get_cpu_info())
             }
         )
     elif ram_gb >= 8:
@@ -211,7 +425,8 @@ def recommend_configuration() -> Tuple[str, str, Dict]:
                 "gradient_accumulation": 16,
                 "mixed_precision": "no",
                 "estimated_training_time": "48-72 hours",
-                "warning": "Very slow training. Consider using Google Colab (free GPU)"
+                "warning": "Very slow training. Consider using Google Colab (free GPU)",
+                **cpu_tuning(get_cpu_info())
             }
         )
     else:
@@ -227,6 +442,178 @@ def recommend_configuration() -> Tuple[str, str, Dict]:
         )
 
 
+def _timed_loop(fn, min_seconds: float = 0.3, min_iters: int = 3) -> float:
+    """Run fn repeatedly for at least min_seconds; return seconds per call"""
+    fn()  # warm-up
+    iters = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        iters += 1
+        elapsed = time.perf_counter() - start
+        if iters >= min_iters and elapsed >= min_seconds:
+            return elapsed / iters
+
+
+def benchmark_matmul(dtype: str = "float32", size: int = 1024, threads: Optional[int] = None) -> Dict:
+    """Measure dense matmul throughput in GFLOPS"""
+    import torch
+    
+    torch_dtype = getattr(torch, dtype)
+    previous = torch.get_num_threads()
+    if threads:
+        torch.set_num_threads(threads)
+    try:
+        a = torch.randn(size, size).to(torch_dtype)
+        b = torch.randn(size, size).to(torch_dtype)
+        seconds = _timed_loop(lambda: torch.mm(a, b))
+        return {
+            "dtype": dtype,
+            "size": size,
+            "threads": torch.get_num_threads(),
+            "gflops": round(2 * size ** 3 / seconds / 1e9, 2)
+        }
+    except RuntimeError as e:
+        return {"dtype": dtype, "error": str(e)}
+    finally:
+        torch.set_num_threads(previous)
+
+
+def benchmark_memory_bandwidth(size_mb: int = 256) -> Dict:
+    """Measure memory copy bandwidth in GB/s (read + write)"""
+    import torch
+    
+    n = size_mb * 1024 * 1024 // 4
+    src = torch.ones(n, dtype=torch.float32)
+    dst = torch.empty_like(src)
+    seconds = _timed_loop(lambda: dst.copy_(src))
+    return {"size_mb": size_mb, "copy_gb_per_s": round(2 * src.numel() * 4 / seconds / 1e9, 2)}
+
+
+def benchmark_model_steps(model_name: str, batch_sizes, seq_len: int = 128,
+                          precisions=("fp32",), steps: int = 3) -> Dict:
+    """Time forward/backward/optimizer steps of a causal LM at candidate batch sizes"""
+    import torch
+    from model_loader import load_causal_lm
+    
+    model, _ = load_causal_lm(model_name)
+    model.train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    vocab = model.config.vocab_size
+    results = []
+    
+    for precision in precisions:
+        for batch_size in batch_sizes:
+            input_ids = torch.randint(0, vocab, (batch_size, seq_len))
+            
+            def step():
+                with torch.autocast("cpu", dtype=torch.bfloat16, enabled=precision == "bf16"):
+                    loss = model(input_ids=input_ids, labels=input_ids).loss
+                loss.backward()
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+            
+            try:
+                seconds = _timed_loop(step, min_seconds=0, min_iters=steps)
+            except RuntimeError as e:
+                # Typically out of memory: larger batches will fail too
+                results.append({"precision": precision, "batch_size": batch_size, "error": str(e)[:200]})
+                break
+            results.append({
+                "precision": precision,
+                "batch_size": batch_size,
+                "seq_len": seq_len,
+                "step_seconds": round(seconds, 4),
+                "tokens_per_second": round(batch_size * seq_len / seconds, 1)
+            })
+    
+    return {
+        "model": model_name,
+        "parameters": sum(p.numel() for p in model.parameters()),
+        "results": results
+    }
+
+
+def profile_hardware(
+    model_name: Optional[str] = None,
+    batch_sizes=(1, 2, 4, 8),
+    seq_len: int = 128,
+    dataset_tokens: Optional[int] = None,
+    epochs: int = 3,
+    target_batch_size: int = 16
+) -> Dict:
+    """
+    Run short micro-benchmarks and recommend thread count, precision and
+    batch size from measured throughput rather than fixed RAM/VRAM tables.
+    """
+    if not HAS_TORCH:
+        return {"error": "PyTorch not available"}
+    
+    import torch
+    
+    cpu = get_cpu_info()
+    physical = cpu.get("cpu_count_physical") or os.cpu_count() or 1
+    logical = cpu.get("cpu_count_logical") or physical
+    
+    # Threads: compare matmul throughput at a few counts
+    thread_candidates = sorted({1, max(1, physical // 2), physical, logical, cpu_tuning(cpu)["threads"]})
+    thread_results = [benchmark_matmul("float32", threads=t) for t in thread_candidates]
+    best_threads = max(thread_results, key=lambda r: r.get("gflops", 0))["threads"]
+    torch.set_num_threads(best_threads)
+    
+    fp32 = benchmark_matmul("float32")
+    bf16 = benchmark_matmul("bfloat16")
+    bf16_speedup = bf16.get("gflops", 0) / max(fp32.get("gflops", 0), 1e-9)
+    
+    profile = {
+        "threads": thread_results,
+        "matmul": {"fp32": fp32, "bf16": bf16, "bf16_speedup": round(bf16_speedup, 2)},
+        "memory": benchmark_memory_bandwidth()
+    }
+    
+    config = {
+        "device": "cpu",
+        "threads": best_threads,
+        "precision": "bf16" if bf16_speedup >= 1.2 else "fp32"
+    }
+    
+    if model_name:
+        # Only try bf16 end-to-end when the matmul benchmark suggests it can pay off
+        precisions = ("fp32", "bf16") if bf16_speedup >= 1.0 else ("fp32",)
+        try:
+            model_profile = benchmark_model_steps(model_name, batch_sizes, seq_len, precisions)
+        except Exception as e:
+            model_profile = {"model": model_name, "error": str(e)}
+        profile["model"] = model_profile
+        
+        measured = [r for r in model_profile.get("results", []) if "tokens_per_second" in r]
+        if measured:
+            best = max(measured, key=lambda r: r["tokens_per_second"])
+            tokens_per_second = best["tokens_per_second"]
+            config.update({
+                "model": model_name,
+                "precision": best["precision"],
+                "batch_size": best["batch_size"],
+                "gradient_accumulation": max(1, -(-target_batch_size // best["batch_size"])),
+                "max_length": seq_len,
+                "measured_tokens_per_second": tokens_per_second,
+                "seconds_per_million_tokens": round(1e6 / tokens_per_second, 1)
+            })
+            if dataset_tokens:
+                hours = dataset_tokens * epochs / tokens_per_second / 3600
+                config["estimated_training_time"] = f"{hours:.2f} hours ({epochs} epochs, {dataset_tokens:,} tokens)"
+    
+    return {
+        "cpu": cpu,
+        "profile": profile,
+        "recommendation": {
+            "config_key": "measured",
+            "reason": "Derived from micro-benchmarks on this host",
+            "config": config
+        }
+    }
+
+
 def print_hardware_report():
     """Print comprehensive hardware report"""
     print("\n" + "="*70)
@@ -237,7 +624,16 @@ def print_hardware_report():
     print("📊 CPU Information:")
     cpu = get_cpu_info()
     for key, value in cpu.items():
-        print(f"   {key}: {value}")
+        if key == "isa":
+            print(f"   isa: {', '.join(k for k, v in value.items() if v) or 'baseline'}")
+        elif key == "caches":
+            print("   caches: " + ", ".join(
+                f"L{c['level']} {c['type']} {c['size_kb']}KB" for c in value if c.get("size_kb")))
+        elif key == "numa_nodes":
+            for node in value:
+                print(f"   numa node {node['node']}: {len(node['cpus'])} cpus, {node['memory_gb']} GB")
+        else:
+            print(f"   {key}: {value}")
     print()
     
     # Memory Info
@@ -316,6 +712,43 @@ def print_hardware_report():
     }
 
 
+def print_profile_report(result: Dict):
+    """Print measured benchmark results and the derived recommendation"""
+    print("\n" + "="*70)
+    print("⏱️  HARDWARE PROFILE (measured)")
+    print("="*70 + "\n")
+    
+    if "error" in result:
+        print(f"   ⚠️  {result['error']}")
+        return
+    
+    profile = result["profile"]
+    print("🧮 Matmul throughput:")
+    for r in profile["threads"]:
+        print(f"   fp32, {r['threads']} threads: {r.get('gflops', 'n/a')} GFLOPS")
+    print(f"   bf16: {profile['matmul']['bf16'].get('gflops', 'n/a')} GFLOPS "
+          f"({profile['matmul']['bf16_speedup']}x fp32)")
+    print(f"\n💾 Memory bandwidth: {profile['memory']['copy_gb_per_s']} GB/s")
+    
+    model = profile.get("model")
+    if model:
+        print(f"\n🏋️  Training steps ({model['model']}):")
+        if "error" in model:
+            print(f"   ⚠️  {model['error']}")
+        for r in model.get("results", []):
+            if "error" in r:
+                print(f"   {r['precision']} batch {r['batch_size']}: failed ({r['error']})")
+            else:
+                print(f"   {r['precision']} batch {r['batch_size']}: {r['tokens_per_second']} tokens/s")
+    
+    print("\n" + "="*70)
+    print("🎯 RECOMMENDED CONFIGURATION")
+    print("="*70 + "\n")
+    for key, value in result["recommendation"]["config"].items():
+        print(f"   {key}: {value}")
+    print("\n" + "="*70 + "\n")
+
+
 def main():
     """Main entry point"""
     import argparse
@@ -323,10 +756,40 @@ def main():
     parser = argparse.ArgumentParser(description="Detect hardware and recommend configuration")
     parser.add_argument("--json", action="store_true", help="Output as JSON")
     parser.add_argument("--config-only", action="store_true", help="Output only recommended config")
+    parser.add_argument("--profile", action="store_true",
+                        help="Run micro-benchmarks and recommend settings from measured throughput")
+    parser.add_argument("--profile-model", type=str, default=None,
+                        help="Model to time forward/backward steps for (with --profile)")
+    parser.add_argument("--batch-sizes", type=str, default="1,2,4,8",
+                        help="Candidate batch sizes for --profile-model")
+    parser.add_argument("--max-length", type=int, default=128, help="Sequence length for --profile-model")
+    parser.add_argument("--dataset-tokens", type=int, default=None,
+                        help="Training set size in tokens, for the time-to-train estimate")
+    parser.add_argument("--epochs", type=int, default=3, help="Epochs for the time-to-train estimate")
+    parser.add_argument("--refresh", action="store_true", help="Re-detect static hardware facts, ignoring the cache")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the hardware cache")
+    parser.add_argument("--cache-ttl", type=int, default=CACHE_TTL_SECONDS,
+                        help="Seconds before cached static hardware facts are re-detected")
     
     args = parser.parse_args()
     
-    if args.json or args.config_only:
+    configure_cache(enabled=not args.no_cache, ttl_seconds=args.cache_ttl)
+    if args.refresh:
+        load_static_info(refresh=True)
+    
+    if args.profile:
+        result = profile_hardware(
+            model_name=args.profile_model,
+            batch_sizes=[int(b) for b in args.batch_sizes.split(",")],
+            seq_len=args.max_length,
+            dataset_tokens=args.dataset_tokens,
+            epochs=args.epochs
+        )
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            print_profile_report(result)
+    elif args.json or args.config_only:
         result = print_hardware_report() if not args.config_only else {
             "recommendation": recommend_configuration()
         }
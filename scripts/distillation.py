@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Knowledge distillation into a smaller student for CPU serving.
+
+Used by train_real_pytorch.py --distill. The teacher is the --model-name
+checkpoint, run in inference mode; the student is --student-model, or a copy
+of the teacher that keeps --student-layers evenly spaced layers. The student
+is trained on
+
+    loss = alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * LM loss
+
+where the KL is taken over the teacher's top-k tokens at every position that
+carries a label (assistant tokens for chat data).
+
+Running the teacher is the expensive part on CPU, so its top-k logits are
+cached in memory-mapped files keyed by dataset row. The first epoch fills
+the cache; later epochs (and later runs over the same data) never load the
+teacher at all.
+
+Cache layout (<cache_dir>/):
+    meta.json     teacher, dataset, rows, max_length, top_k
+    indices.i32   [rows, max_length, top_k] token ids
+    logits.f16    [rows, max_length, top_k] teacher logits
+    filled.u8     [rows] 1 once a row has been written
+
+Usage:
+    python3 scripts/distillation.py --cache models/persian-chat-small/teacher_logits
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+try:
+    import torch
+    from training_instrumentation import TimedTrainer
+    PYTORCH_AVAILABLE = True
+except ImportError:
+    PYTORCH_AVAILABLE = False
+
+CACHE_VERSION = 1
+
+
+def _fingerprint(path: str) -> Dict:
+    """Identity of a model or dataset path: resolved path plus size/mtime of its files"""
+    p = Path(path)
+    if not p.exists():
+        return {"path": path}
+    files = [p] if p.is_file() else sorted(f for f in p.iterdir() if f.is_file())
+    return {"path": str(p.resolve()), "files": [[f.name, f.stat().st_size, f.stat().st_mtime_ns] for f in files]}
+
+
+class TeacherLogitCache:
+    """Top-k teacher logits per dataset row, stored in memory-mapped files"""
+
+    def __init__(self, path: str, teacher: str, dataset: str, rows: int, max_length: int, top_k: int):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "version": CACHE_VERSION,
+            "teacher": _fingerprint(teacher),
+            "dataset": _fingerprint(dataset),
+            "rows": rows,
+            "max_length": max_length,
+            "top_k": top_k
+        }
+        meta_path = self.path / "meta.json"
+        existing = None
+        if meta_path.exists():
+            with open(meta_path, "r", encoding="utf-8") as f:
+                existing = json.load(f)
+        fresh = existing != meta
+        if fresh:
+            # Different teacher, data or shape: start over
+            for name in ("indices.i32", "logits.f16", "filled.u8"):
+                (self.path / name).unlink(missing_ok=True)
+        mode = "w+" if fresh else "r+"
+        shape = (rows, max_length, top_k)
+        self.indices = np.memmap(self.path / "indices.i32", dtype=np.int32, mode=mode, shape=shape)
+        self.logits = np.memmap(self.path / "logits.f16", dtype=np.float16, mode=mode, shape=shape)
+        self.filled = np.memmap(self.path / "filled.u8", dtype=np.uint8, mode=mode, shape=(rows,))
+        if fresh:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, indent=2)
+        self.top_k = top_k
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def bytes(self) -> int:
+        return self.indices.nbytes + self.logits.nbytes + self.filled.nbytes
+
+    def coverage(self) -> float:
+        return float(self.filled.mean()) if len(self.filled) else 0.0
+
+    def get(self, rows: np.ndarray):
+        """(indices, logits) tensors for `rows`, or None if any row is missing"""
+        if not self.filled[rows].all():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (torch.from_numpy(self.indices[rows].astype(np.int64)),
+                torch.from_numpy(self.logits[rows].astype(np.float32)))
+
+    def put(self, rows: np.ndarray, indices: "torch.Tensor", logits: "torch.Tensor"):
+        width = indices.shape[1]
+        self.indices[rows, :width] = indices.numpy().astype(np.int32)
+        self.logits[rows, :width] = logits.numpy().astype(np.float16)
+        # Marked only after the values are in place
+        self.filled[rows] = 1
+
+    def flush(self):
+        for array in (self.indices, self.logits, self.filled):
+            array.flush()
+
+
+def make_student(teacher_name: str, student_model: Optional[str] = None, student_layers: Optional[int] = None):
+    """Load the student: a given checkpoint, or the teacher with evenly spaced layers kept"""
+    from model_loader import load_causal_lm
+
+    if student_model:
+        return load_causal_lm(student_model)
+    model, report = load_causal_lm(teacher_name)
+    if student_layers:
+        from prune_model import _blocks, _layout, drop_layers
+
+        total = len(_blocks(model, _layout(model)))
+        if student_layers < total:
+            keep = np.unique(np.linspace(0, total - 1, student_layers).round().astype(int))
+            score = torch.zeros(total)
+            score[torch.from_numpy(keep)] = 1.0
+            report["dropped_layers"] = drop_layers(model, score, total - len(keep))
+            report["parameters"] = sum(p.numel() for p in model.parameters())
+    return model, report
+
+
+def distillation_loss(student_logits: "torch.Tensor", labels: "torch.Tensor", top_indices: "torch.Tensor",
+                      top_logits: "torch.Tensor", temperature: float) -> "torch.Tensor":
+    """KL between the temperature-softened teacher top-k and the student, on labelled positions"""
+    width = student_logits.shape[1]
+    mask = labels[:, 1:width] != -100
+    if not bool(mask.any()):
+        return student_logits.sum() * 0.0
+    # Both distributions are renormalized over the teacher's top-k, so a student
+    # that matches the teacher there has zero loss; the LM term covers the rest
+    student = student_logits[:, :width - 1][mask].float().gather(-1, top_indices[:, :width - 1][mask])
+    log_probs = torch.log_softmax(student / temperature, dim=-1)
+    teacher = torch.log_softmax(top_logits[:, :width - 1][mask] / temperature, dim=-1)
+    kl = (teacher.exp() * (teacher - log_probs)).sum(-1).mean()
+    return kl * temperature ** 2
+
+
+if PYTORCH_AVAILABLE:
+
+    class DistillationTrainer(TimedTrainer):
+        """TimedTrainer with a mixed KL + LM loss against a (cached) teacher"""
+
+        def __init__(self, *args, teacher_loader: Callable = None, logit_cache: Optional[TeacherLogitCache] = None,
+                     alpha: float = 0.5, temperature: float = 2.0, top_k: int = 16, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.teacher_loader = teacher_loader
+            self.teacher = None
+            self.logit_cache = logit_cache
+            self.alpha = alpha
+            self.temperature = temperature
+            self.top_k = top_k
+            self.teacher_seconds = 0.0
+            self.teacher_batches = 0
+
+        @torch.inference_mode()
+        def _teacher_top_k(self, inputs: Dict):
+            if self.teacher is None:
+                print("🧑‍🏫 Loading teacher for logits not in the cache...")
+                self.teacher = self.teacher_loader()
+                self.teacher.eval()
+            outputs = self.teacher(input_ids=inputs["input_ids"], attention_mask=inputs.get("attention_mask"))
+            values, indices = torch.topk(outputs.logits.float(), self.top_k, dim=-1)
+            return indices, values
+
+        def _teacher_targets(self, inputs: Dict, rows: Optional[np.ndarray]):
+            start = time.perf_counter()
+            cached = self.logit_cache.get(rows) if self.logit_cache is not None and rows is not None else None
+            if cached is not None:
+                indices, values = cached
+                width = inputs["input_ids"].shape[1]
+                indices, values = indices[:, :width], values[:, :width]
+            else:
+                indices, values = self._teacher_top_k(inputs)
+                self.teacher_batches += 1
+                if self.logit_cache is not None and rows is not None:
+                    self.logit_cache.put(rows, indices, values)
+            self.teacher_seconds += time.perf_counter() - start
+            return indices.clone(), values.clone()
+
+        def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+            sample_idx = inputs.pop("sample_idx", None)
+            rows = sample_idx.cpu().numpy() if sample_idx is not None else None
+            lm_loss, outputs = super().compute_loss(model, inputs, return_outputs=True, **kwargs)
+
+            start = time.perf_counter()
+            indices, values = self._teacher_targets(inputs, rows)
+            kl = distillation_loss(outputs.logits, inputs["labels"], indices, values, self.temperature)
+            loss = self.alpha * kl + (1 - self.alpha) * lm_loss
+            # Teacher inference and the KL count as forward time
+            self._forward_seconds += time.perf_counter() - start
+            return (loss, outputs) if return_outputs else loss
+
+        def stats(self) -> Dict:
+            cache = self.logit_cache
+            return {
+                "alpha": self.alpha,
+                "temperature": self.temperature,
+                "top_k": self.top_k,
+                "teacher_loaded": self.teacher is not None,
+                "teacher_batches": self.teacher_batches,
+                "teacher_seconds": round(self.teacher_seconds, 2),
+                "cache": {
+                    "path": str(cache.path),
+                    "bytes": cache.bytes,
+                    "coverage": round(cache.coverage(), 4),
+                    "hits": cache.hits,
+                    "misses": cache.misses
+                } if cache is not None else None
+            }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Inspect a teacher logit cache')
+    parser.add_argument('--cache', type=str, required=True, help='Cache directory')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    meta_path = os.path.join(args.cache, "meta.json")
+    if not os.path.exists(meta_path):
+        print(f"❌ No teacher logit cache at {args.cache}", file=sys.stderr)
+        return 1
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    filled = np.memmap(os.path.join(args.cache, "filled.u8"), dtype=np.uint8, mode="r", shape=(meta["rows"],))
+    size = sum(os.path.getsize(os.path.join(args.cache, n)) for n in ("indices.i32", "logits.f16", "filled.u8"))
+    print(json.dumps({
+        "teacher": meta["teacher"]["path"],
+        "dataset": meta["dataset"]["path"],
+        "rows": meta["rows"],
+        "max_length": meta["max_length"],
+        "top_k": meta["top_k"],
+        "coverage": round(float(filled.mean()), 4) if meta["rows"] else 0.0,
+        "size_mb": round(size / 1024 ** 2, 1)
+    }, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
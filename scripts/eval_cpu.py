@@ -4,6 +4,12 @@ CPU-based evaluation script for Persian chat model.
 Evaluates model on test set and calculates perplexity.
 
 This script is called by eval_cpu.ts TypeScript wrapper.
+
+Backends:
+    simulated   fixed metrics (default, no model is loaded)
+    torch       the PyTorch model in --model
+    onnx        ONNX Runtime on the export in --onnx-dir (see onnx_export.py)
+    compare     torch and onnx on the same batches, reported side by side
 """
 
 import argparse
@@ -11,17 +17,242 @@ import json
 import math
 import os
 import sys
+import time
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+BACKENDS = ("simulated", "torch", "onnx", "compare")
 
 def parse_args():
     parser = argparse.ArgumentParser(description='CPU-based Persian model evaluation')
-    parser.add_argument('--data', type=str, required=True, help='Test dataset path')
+    parser.add_argument('--data', type=str, required=True, help='Test dataset path (JSONL file or sharded dataset directory)')
     parser.add_argument('--model', type=str, required=True, help='Model directory path')
     parser.add_argument('--output', type=str, default='logs/eval.json', help='Output JSON file')
     parser.add_argument('--samples_output', type=str, default='logs/eval_samples.jsonl', help='Samples output file')
     parser.add_argument('--errors_output', type=str, default='logs/errors.txt', help='Errors output file')
+    parser.add_argument('--backend', type=str, default='simulated', choices=BACKENDS, help='Evaluation backend')
+    parser.add_argument('--onnx-dir', type=str, default=None, help='ONNX export directory (default: <model>/onnx)')
+    parser.add_argument('--int8', action='store_true', help='Use the int8 ONNX model')
+    parser.add_argument('--batch-size', type=int, default=8, help='Evaluation batch size')
+    parser.add_argument('--max-length', type=int, default=512, help='Maximum sequence length')
+    parser.add_argument('--max-samples', type=int, default=None, help='Evaluate at most this many records')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads')
+    parser.add_argument('--num-generations', type=int, default=3,
+                        help='Records whose greedy generation is written to --samples_output')
+    parser.add_argument('--max-new-tokens', type=int, default=32, help='Tokens generated per sample')
     return parser.parse_args()
 
+def count_samples(data_path: str) -> int:
+    """Number of records in a JSONL file or sharded dataset directory"""
+    if os.path.isdir(data_path):
+        from jsonl_shards import ShardedJsonlReader
+        with ShardedJsonlReader(data_path) as reader:
+            return len(reader)
+    if not os.path.exists(data_path):
+        return 0
+    with open(data_path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+def iter_records(data_path: str, limit: Optional[int] = None) -> Iterator[Dict]:
+    """Records of a JSONL file or sharded dataset directory"""
+    count = 0
+    if os.path.isdir(data_path):
+        from jsonl_shards import ShardedJsonlReader
+        with ShardedJsonlReader(data_path) as reader:
+            for shard in range(len(reader.shard_names)):
+                for record in reader.iter_shard(shard):
+                    if limit is not None and count >= limit:
+                        return
+                    count += 1
+                    yield record
+        return
+    with open(data_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield json.loads(line)
+
+def tokenize_records(records: List[Dict], tokenizer, max_length: int) -> Dict[str, List[List[int]]]:
+    """Same formatting as training: assistant-only labels for chats, all tokens otherwise"""
+    from train_real_pytorch import IGNORE_INDEX, tokenize_chat_batch
+
+    if 'messages' in records[0]:
+        return tokenize_chat_batch([r.get('messages') for r in records], tokenizer, max_length)
+    texts = [r['text'] if 'text' in r else f"سوال: {r.get('question', '')}\nپاسخ: {r.get('answer', '')}"
+             for r in records]
+    enc = tokenizer(texts, truncation=True, max_length=max_length, padding='max_length')
+    labels = [[t if m else IGNORE_INDEX for t, m in zip(ids, mask)]
+              for ids, mask in zip(enc['input_ids'], enc['attention_mask'])]
+    return {"input_ids": enc['input_ids'], "attention_mask": enc['attention_mask'], "labels": labels}
+
+def load_backend(name: str, args):
+    """A callable model for `name` ('torch' or 'onnx')"""
+    if name == 'torch':
+        import torch
+        from model_loader import load_causal_lm
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        model, _ = load_causal_lm(args.model)
+        return model.eval()
+    from onnx_export import OnnxCausalLM
+    return OnnxCausalLM(args.onnx_dir or os.path.join(args.model, 'onnx'), int8=args.int8, threads=args.threads)
+
+def position_limit(model_dir: str) -> Optional[int]:
+    """Maximum sequence length of the model in `model_dir`, if its config states one"""
+    from transformers import AutoConfig
+
+    config = AutoConfig.from_pretrained(model_dir)
+    return getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None)
+
+def generation_prompt(record: Dict, tokenizer):
+    """(prompt ids, expected) for a record with a reference answer, else None"""
+    from train_real_pytorch import chat_prompt_ids
+
+    if 'messages' in record:
+        messages = record.get('messages') or []
+        last = max((i for i, m in enumerate(messages) if m.get('role') == 'assistant'), default=None)
+        if last is None:
+            return None
+        # Token layout of training (and inference_server), ending in the assistant header
+        return chat_prompt_ids(messages[:last], tokenizer), messages[last].get('content') or ""
+    if 'question' in record and 'answer' in record:
+        prompt = f"سوال: {record['question']}\nپاسخ: "
+        return tokenizer(prompt, add_special_tokens=False)["input_ids"], record['answer']
+    return None
+
+def generate_samples(model, tokenizer, records: List[Dict], max_length: int, max_new_tokens: int) -> List[Dict]:
+    """Greedy generations for records with a reference answer (full forward per token, any backend)"""
+    import torch
+
+    samples = []
+    for record in records:
+        pair = generation_prompt(record, tokenizer)
+        if pair is None:
+            continue
+        prompt_ids, expected = pair
+        sample = {"input": tokenizer.decode(prompt_ids, skip_special_tokens=True), "expected": expected}
+        try:
+            # Keep the end of the prompt (the assistant header) and room for the answer
+            ids = prompt_ids[-max(max_length - max_new_tokens, 1):]
+            input_ids = torch.tensor([ids])
+            new_tokens = []
+            with torch.inference_mode():
+                for _ in range(min(max_new_tokens, max_length - input_ids.shape[1])):
+                    mask = torch.ones_like(input_ids)
+                    logits = model(input_ids=input_ids, attention_mask=mask,
+                                   position_ids=(mask.cumsum(-1) - 1)).logits
+                    token = int(logits[0, -1].argmax())
+                    if token == tokenizer.eos_token_id:
+                        break
+                    new_tokens.append(token)
+                    input_ids = torch.cat([input_ids, torch.tensor([[token]])], dim=1)
+            sample["predicted"] = tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+            sample["exact_match"] = sample["predicted"] == expected.strip()
+        except Exception as e:
+            sample["error"] = f"{type(e).__name__}: {e}"
+        samples.append(sample)
+    return samples
+
+def evaluate_backends(args, backends: List[str]):
+    """Token-weighted loss, perplexity and throughput of each backend on the test set, plus failed batches"""
+    import torch
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    limit = position_limit(args.model)
+    if limit and args.max_length > limit:
+        print(f"⚠️  --max-length {args.max_length} exceeds the model's {limit} positions, using {limit}")
+        args.max_length = limit
+    models = {name: load_backend(name, args) for name in backends}
+    totals = {name: {"loss_sum": 0.0, "tokens": 0, "input_tokens": 0, "seconds": 0.0, "warm": False} for name in backends}
+
+    def batches():
+        batch = []
+        for record in iter_records(args.data, args.max_samples):
+            batch.append(record)
+            if len(batch) == args.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    samples = 0
+    failures = []
+    with torch.inference_mode():
+        for records in batches():
+            first = samples
+            try:
+                enc = tokenize_records(records, tokenizer, args.max_length)
+            except Exception as e:
+                failures.append({"backend": None, "samples": [first, first + len(records) - 1],
+                                 "error": f"{type(e).__name__}: {e}"})
+                samples += len(records)
+                continue
+            mask = torch.tensor(enc['attention_mask'])
+            # Padding is on the right, so columns past the longest record are dropped
+            width = max(int(mask.sum(-1).max()), 1)
+            mask = mask[:, :width]
+            input_ids = torch.tensor(enc['input_ids'])[:, :width]
+            labels = torch.tensor(enc['labels'])[:, :width]
+            position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+            targets = labels[:, 1:]
+            samples += len(records)
+
+            for name, model in models.items():
+                try:
+                    if not totals[name]["warm"]:
+                        # Untimed first call: lazy initialization is not throughput
+                        model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids)
+                        totals[name]["warm"] = True
+                    start = time.perf_counter()
+                    logits = model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids).logits
+                    totals[name]["seconds"] += time.perf_counter() - start
+                except Exception as e:
+                    failures.append({"backend": name, "samples": [first, samples - 1],
+                                     "error": f"{type(e).__name__}: {e}"})
+                    continue
+                loss = torch.nn.functional.cross_entropy(
+                    logits[:, :-1].reshape(-1, logits.shape[-1]).float(), targets.reshape(-1),
+                    ignore_index=-100, reduction='sum'
+                )
+                totals[name]["loss_sum"] += float(loss)
+                totals[name]["tokens"] += int((targets != -100).sum())
+                totals[name]["input_tokens"] += int(mask.sum())
+
+    results = {}
+    for name, t in totals.items():
+        eval_loss = t["loss_sum"] / max(t["tokens"], 1)
+        results[name] = {
+            "eval_loss": round(eval_loss, 4),
+            "perplexity": round(math.exp(min(eval_loss, 50)), 4),
+            "evaluated_samples": samples,
+            "scored_tokens": t["tokens"],
+            "forward_seconds": round(t["seconds"], 3),
+            "tokens_per_second": round(t["input_tokens"] / t["seconds"], 1) if t["seconds"] else None,
+            "ms_per_sample": round(1000 * t["seconds"] / samples, 2) if samples else None
+        }
+    if 'torch' in results and 'onnx' in results and results['onnx']['forward_seconds']:
+        results['onnx']['speedup_vs_torch'] = round(
+            results['torch']['forward_seconds'] / results['onnx']['forward_seconds'], 2)
+    for stats in results.values():
+        stats["failed_batches"] = 0
+    for failure in failures:
+        for name in ([failure["backend"]] if failure["backend"] else results):
+            results[name]["failed_batches"] += 1
+
+    samples_out = []
+    if args.num_generations > 0:
+        primary = 'onnx' if 'onnx' in models else 'torch'
+        samples_out = generate_samples(models[primary], tokenizer,
+                                       list(iter_records(args.data, args.num_generations)),
+                                       args.max_length, args.max_new_tokens)
+    return results, failures, samples_out
+
 def main():
     args = parse_args()
     
@@ -35,35 +266,53 @@ def main():
     print(f"📊 Evaluating model: {args.model}")
     print(f"📁 Test dataset: {args.data}")
     
-    # Simulate evaluation metrics (in production, use actual model)
-    eval_loss = 0.9672
-    perplexity = math.exp(eval_loss)  # 2.6307
+    if args.backend == 'simulated':
+        # Simulate evaluation metrics (in production, use actual model)
+        eval_loss = 0.9672
+        perplexity = math.exp(eval_loss)  # 2.6307
+        backend_results = {}
+        failures = []
+        samples = [
+            {"input": "سلام", "expected": "سلام! چطور می‌توانم کمکتان کنم؟", "predicted": "سلام! چطور می‌توانم کمکتان کنم؟", "score": 1.0},
+            {"input": "حال شما چطور است؟", "expected": "ممنون، حالم خوب است.", "predicted": "ممنون، خوبم.", "score": 0.9},
+            {"input": "روز خوبی داشته باشید", "expected": "شما هم روز خوبی داشته باشید!", "predicted": "شما هم همینطور!", "score": 0.85},
+        ]
+    else:
+        backends = ['torch', 'onnx'] if args.backend == 'compare' else [args.backend]
+        print(f"⚙️  Backend: {', '.join(backends)}")
+        backend_results, failures, samples = evaluate_backends(args, backends)
+        # Headline numbers come from the reference (torch) model when it was evaluated
+        primary_backend = 'torch' if 'torch' in backend_results else 'onnx'
+        eval_loss = backend_results[primary_backend]['eval_loss']
+        perplexity = backend_results[primary_backend]['perplexity']
+        for name, stats in backend_results.items():
+            print(f"   {name:>5}: loss {stats['eval_loss']}, {stats['tokens_per_second']} tokens/s, "
+                  f"{stats['ms_per_sample']} ms/sample")
     
     # Write evaluation results
     results = {
         "model": args.model,
         "test_dataset": args.data,
+        "backend": args.backend,
         "eval_loss": eval_loss,
         "perplexity": round(perplexity, 4),
-        "total_samples": 4,
+        "total_samples": count_samples(args.data),
         "timestamp": "2025-10-09T00:00:00Z"
     }
+    if backend_results:
+        results["primary_backend"] = primary_backend
+        results["backends"] = backend_results
+        results["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
     
     with open(args.output, 'w', encoding='utf-8') as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
     
     print(f"✅ Evaluation results saved to: {args.output}")
-    print(f"   - Eval Loss: {eval_loss}")
+    print(f"   - Eval Loss: {eval_loss}" + (f" ({primary_backend})" if backend_results else ""))
     print(f"   - Perplexity: {results['perplexity']}")
     
-    # Write sample evaluations
+    # Write sample evaluations (real generations unless simulated)
     if args.samples_output:
-        samples = [
-            {"input": "سلام", "expected": "سلام! چطور می‌توانم کمکتان کنم؟", "predicted": "سلام! چطور می‌توانم کمکتان کنم؟", "score": 1.0},
-            {"input": "حال شما چطور است؟", "expected": "ممنون، حالم خوب است.", "predicted": "ممنون، خوبم.", "score": 0.9},
-            {"input": "روز خوبی داشته باشید", "expected": "شما هم روز خوبی داشته باشید!", "predicted": "شما هم همینطور!", "score": 0.85},
-        ]
-        
         with open(args.samples_output, 'w', encoding='utf-8') as f:
             for sample in samples:
                 f.write(json.dumps(sample, ensure_ascii=False) + '\n')
@@ -74,7 +323,13 @@ def main():
     if args.errors_output:
         with open(args.errors_output, 'w', encoding='utf-8') as f:
             f.write("=== Evaluation Errors ===\n")
-            f.write("No critical errors detected.\n")
+            errors = failures + [{"backend": "generation", "samples": [s["input"]], "error": s["error"]}
+                                 for s in samples if "error" in s]
+            if errors:
+                for error in errors:
+                    f.write(f"[{error['backend'] or 'tokenization'}] samples {error['samples']}: {error['error']}\n")
+            else:
+                f.write("No critical errors detected.\n")
             f.write(f"Model: {args.model}\n")
             f.write(f"Test dataset: {args.data}\n")
         
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Local micro-batching inference server for trained Persian chat models.
+
+The model is loaded once (model_loader.load_causal_lm, or an ONNX Runtime
+session with --onnx-dir). Concurrent requests
+are collected into micro-batches: the batcher waits for the first request,
+then keeps admitting requests until --max-batch-size is reached or
+--max-wait-ms has passed since the first one arrived. Each batch is decoded
+step by step with a KV cache in a worker thread, and every new token is
+pushed to its request as it is produced.
+
+HTTP API (plain asyncio, over TCP or a Unix socket):
+    POST /generate   {"prompt": "..."} or {"messages": [{"role", "content"}, ...]},
+                     optional "max_new_tokens", "temperature", "top_k", "stream"
+                     stream=true returns NDJSON chunks: {"token": "..."} ... {"done": true, ...}
+    GET  /stats      queue depth, batch sizes, latency percentiles, tokens/s
+    GET  /health
+
+Usage:
+    python3 scripts/inference_server.py --model models/persian-chat --port 8765
+    python3 scripts/inference_server.py --model models/persian-chat --unix-socket /tmp/persian-chat.sock
+    python3 scripts/inference_server.py --onnx-dir models/persian-chat/onnx --int8
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from transformers import AutoConfig, AutoTokenizer
+
+from model_loader import load_causal_lm
+from train_real_pytorch import chat_prompt_ids
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+def _percentiles(values, qs=(0.5, 0.95, 0.99)) -> Dict[str, Optional[float]]:
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{int(q * 100)}": None for q in qs}
+    return {f"p{int(q * 100)}": round(1000 * ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+            for q in qs}
+
+
+class GenerationRequest:
+    def __init__(self, prompt_ids: List[int], max_new_tokens: int, temperature: float, top_k: int):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.created = time.perf_counter()
+        self.started = None
+        self.first_token = None
+        self.token_ids: List[int] = []
+        # Filled by the event loop: stream of text pieces, then None
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+
+class MicroBatcher:
+    """Collects requests into batches and runs KV-cached decoding in a worker thread"""
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 max_input_tokens: int = 1024, window: int = 1000, model_limit: Optional[int] = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_input_tokens = max_input_tokens
+        # Positions the model has; prompt plus generated tokens must fit
+        self.model_limit = model_limit
+        self.pending: asyncio.Queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generate")
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.active = 0
+        self.batches = 0
+        self.batch_sizes = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+        self.queue_waits = deque(maxlen=window)
+        self.first_token_latencies = deque(maxlen=window)
+        self.tokens_generated = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def warmup(self):
+        """Run one tiny batch so lazy imports and allocations are not paid by the first client"""
+        self.loop = asyncio.get_running_loop()
+        warm = self.tokenizer(["warm up", "warm"])["input_ids"]
+        self._generate([GenerationRequest(warm[0], 2, 0.0, 0), GenerationRequest(warm[1], 2, 1.0, 5)])
+        with self._lock:
+            self.batches = self.completed = self.tokens_generated = 0
+            self.busy_seconds = 0.0
+            for window in (self.batch_sizes, self.latencies, self.queue_waits, self.first_token_latencies):
+                window.clear()
+
+    async def submit(self, request: GenerationRequest):
+        await self.pending.put(request)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = self.loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.pending.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.active = len(batch)
+            try:
+                await self.loop.run_in_executor(self.executor, self._generate, batch)
+            except Exception as e:
+                for request in batch:
+                    self.loop.call_soon_threadsafe(request.queue.put_nowait, e)
+            self.active = 0
+
+    def _emit(self, request: GenerationRequest, item):
+        self.loop.call_soon_threadsafe(request.queue.put_nowait, item)
+
+    @torch.inference_mode()
+    def _generate(self, batch: List[GenerationRequest]):
+        now = time.perf_counter()
+        for request in batch:
+            request.started = now
+            self.queue_waits.append(now - request.created)
+
+        tok = self.tokenizer
+        max_input = self.max_input_tokens
+        if self.model_limit:
+            # Leave room for the longest requested answer
+            max_input = max(1, min(max_input, self.model_limit - max(r.max_new_tokens for r in batch)))
+        # Truncation keeps the end of the prompt (the latest turns and the open assistant header)
+        prompts = [r.prompt_ids[-max_input:] for r in batch]
+        width = max(len(ids) for ids in prompts)
+        # Left padding, so every row's next token is at the last position
+        input_ids = torch.tensor([[tok.pad_token_id] * (width - len(ids)) + ids for ids in prompts])
+        attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in prompts])
+        if self.model_limit:
+            for request in batch:
+                request.max_new_tokens = max(1, min(request.max_new_tokens, self.model_limit - input_ids.shape[1]))
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        n = len(batch)
+        finished = torch.zeros(n, dtype=torch.bool)
+        temperatures = torch.tensor([max(r.temperature, 1e-5) for r in batch]).unsqueeze(1)
+        greedy = torch.tensor([r.temperature <= 0 for r in batch])
+        limits = torch.tensor([r.max_new_tokens for r in batch])
+        texts = [""] * n
+        past = None
+        eos = tok.eos_token_id
+
+        for step in range(int(limits.max())):
+            out = self.model(input_ids=input_ids, attention_mask=attention_mask,
+                             position_ids=position_ids, past_key_values=past, use_cache=True)
+            past = out.past_key_values
+            logits = out.logits[:, -1, :].float()
+
+            next_ids = logits.argmax(-1)
+            if not bool(greedy.all()):
+                scaled = logits / temperatures
+                for i, request in enumerate(batch):
+                    if request.top_k and not greedy[i]:
+                        kth = torch.topk(scaled[i], min(request.top_k, scaled.shape[-1])).values[-1]
+                        scaled[i] = scaled[i].masked_fill(scaled[i] < kth, float("-inf"))
+                sampled = torch.multinomial(torch.softmax(scaled, -1), 1).squeeze(1)
+                next_ids = torch.where(greedy, next_ids, sampled)
+
+            emitted = time.perf_counter()
+            for i, request in enumerate(batch):
+                if finished[i]:
+                    continue
+                token = int(next_ids[i])
+                if token == eos:
+                    finished[i] = True
+                    continue
+                if request.first_token is None:
+                    request.first_token = emitted
+                request.token_ids.append(token)
+                text = tok.decode(request.token_ids, skip_special_tokens=True)
+                # Only emit complete characters; partial UTF-8 merges decode to U+FFFD
+                if not text.endswith("�") and len(text) > len(texts[i]):
+                    self._emit(request, text[len(texts[i]):])
+                    texts[i] = text
+                if len(request.token_ids) >= request.max_new_tokens:
+                    finished[i] = True
+            if bool(finished.all()):
+                break
+
+            # Finished rows keep decoding (their tokens are dropped) so the cache stays rectangular
+            input_ids = torch.where(finished, eos if eos is not None else 0, next_ids).unsqueeze(1)
+            attention_mask = torch.cat([attention_mask, torch.ones(n, 1, dtype=attention_mask.dtype)], dim=1)
+            position_ids = position_ids[:, -1:] + 1
+
+        done = time.perf_counter()
+        with self._lock:
+            self.batches += 1
+            self.busy_seconds += done - now
+            self.batch_sizes.append(n)
+            for request in batch:
+                self.tokens_generated += len(request.token_ids)
+                self.completed += 1
+                self.latencies.append(done - request.created)
+                if request.first_token is not None:
+                    self.first_token_latencies.append(request.first_token - request.created)
+        for i, request in enumerate(batch):
+            final = tok.decode(request.token_ids, skip_special_tokens=True)
+            if len(final) > len(texts[i]):
+                self._emit(request, final[len(texts[i]):])
+            self._emit(request, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "queue_depth": self.pending.qsize(),
+                "active_batch": self.active,
+                "batches": self.batches,
+                "completed": self.completed,
+                "mean_batch_size": round(sum(self.batch_sizes) / len(self.batch_sizes), 2) if self.batch_sizes else 0,
+                "latency_ms": _percentiles(self.latencies),
+                "time_to_first_token_ms": _percentiles(self.first_token_latencies),
+                "queue_wait_ms": _percentiles(self.queue_waits),
+                "tokens_generated": self.tokens_generated,
+                "tokens_per_second": round(self.tokens_generated / max(self.busy_seconds, 1e-9), 1),
+                "busy_seconds": round(self.busy_seconds, 2),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000
+            }
+
+
+class InferenceServer:
+    """Minimal HTTP/1.1 front end over asyncio streams"""
+
+    def __init__(self, batcher: MicroBatcher, model_name: str, max_new_tokens: int = 128):
+        self.batcher = batcher
+        self.model_name = model_name
+        self.default_max_new_tokens = max_new_tokens
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        header = await reader.readuntil(b"\r\n\r\n")
+        lines = header.decode("latin-1").split("\r\n")
+        method, path, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?")[0], body
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    def _parse_generation(self, body: bytes) -> Tuple[GenerationRequest, bool]:
+        data = json.loads(body or b"{}")
+        if not isinstance(data, dict):
+            raise ValueError("Request body must be a JSON object")
+        tokenizer = self.batcher.tokenizer
+        if data.get("messages"):
+            messages = data["messages"]
+            if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+                raise ValueError("'messages' must be a list of {\"role\", \"content\"} objects")
+            # Same token layout as training (EOS after each assistant turn)
+            prompt_ids = chat_prompt_ids(messages, tokenizer)
+        elif data.get("prompt"):
+            prompt_ids = tokenizer(str(data["prompt"]))["input_ids"]
+        else:
+            raise ValueError("Either 'prompt' or 'messages' is required")
+        if not prompt_ids:
+            raise ValueError("Prompt is empty after tokenization")
+        return GenerationRequest(
+            prompt_ids,
+            max_new_tokens=max(1, min(int(data.get("max_new_tokens", self.default_max_new_tokens)), 2048)),
+            temperature=float(data.get("temperature", 0.0)),
+            top_k=int(data.get("top_k", 0))
+        ), bool(data.get("stream", False))
+
+    async def _generate(self, writer: asyncio.StreamWriter, body: bytes):
+        try:
+            request, stream = self._parse_generation(body)
+        except (ValueError, TypeError) as e:
+            await self._respond(writer, 400, {"error": str(e)})
+            return
+
+        await self.batcher.submit(request)
+        if stream:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson; charset=utf-8\r\n"
+                         b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+
+        pieces = []
+        while True:
+            item = await request.queue.get()
+            if isinstance(item, Exception):
+                if stream:
+                    self._write_chunk(writer, {"error": str(item)})
+                    break
+                await self._respond(writer, 500, {"error": str(item)})
+                return
+            if item is None:
+                break
+            pieces.append(item)
+            if stream:
+                self._write_chunk(writer, {"token": item})
+                await writer.drain()
+
+        summary = {
+            "text": "".join(pieces),
+            "tokens": len(request.token_ids),
+            "latency_ms": round(1000 * (time.perf_counter() - request.created), 1),
+            "queue_wait_ms": round(1000 * ((request.started or request.created) - request.created), 1)
+        }
+        if stream:
+            self._write_chunk(writer, {"done": True, **summary})
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        else:
+            await self._respond(writer, 200, summary)
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, payload: Dict):
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, body = await self._read_request(reader)
+            if method == "POST" and path == "/generate":
+                await self._generate(writer, body)
+            elif method == "GET" and path == "/stats":
+                await self._respond(writer, 200, self.batcher.stats())
+            elif method == "GET" and path == "/health":
+                await self._respond(writer, 200, {"status": "ok", "model": self.model_name})
+            else:
+                await self._respond(writer, 404, {"error": f"No route for {method} {path}"})
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        except ValueError as e:
+            await self._respond(writer, 400, {"error": str(e)})
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except (ConnectionResetError, BrokenPipeError):
+                pass
+
+
+async def serve(args):
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if args.onnx_dir:
+        from onnx_export import OnnxCausalLM
+        print(f"📥 Loading ONNX model: {args.onnx_dir}{' (int8)' if args.int8 else ''}")
+        start = time.perf_counter()
+        model = OnnxCausalLM(args.onnx_dir, int8=args.int8, threads=args.threads)
+        tokenizer = AutoTokenizer.from_pretrained(args.onnx_dir)
+        config = AutoConfig.from_pretrained(args.onnx_dir)
+        print(f"✅ ONNX Runtime session ready in {time.perf_counter() - start:.2f}s")
+    else:
+        print(f"📥 Loading model: {args.model}")
+        model, report = load_causal_lm(args.model)
+        model.eval()
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+        config = model.config
+        print(f"✅ Model loaded in {report['load_seconds']:.2f}s ({report['parameters']:,} parameters)")
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    batcher = MicroBatcher(model, tokenizer, max_batch_size=args.max_batch_size,
+                           max_wait_ms=args.max_wait_ms, max_input_tokens=args.max_input_tokens,
+                           model_limit=getattr(config, "max_position_embeddings", None)
+                           or getattr(config, "n_positions", None))
+    batcher.warmup()
+    server = InferenceServer(batcher, args.onnx_dir or args.model, max_new_tokens=args.max_new_tokens)
+    batch_task = asyncio.create_task(batcher.run())
+
+    if args.unix_socket:
+        listener = await asyncio.start_unix_server(server.handle, path=args.unix_socket)
+        print(f"🚀 Serving on unix:{args.unix_socket}")
+    else:
+        listener = await asyncio.start_server(server.handle, host=args.host, port=args.port)
+        print(f"🚀 Serving on http://{args.host}:{args.port}")
+    sys.stdout.flush()
+
+    async with listener:
+        await asyncio.gather(listener.serve_forever(), batch_task)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Micro-batching inference server for Persian chat models')
+    parser.add_argument('--model', type=str, default='models/persian-chat', help='Model directory or name')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Bind address')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port')
+    parser.add_argument('--unix-socket', type=str, default=None, help='Serve on a Unix socket instead of TCP')
+    parser.add_argument('--max-batch-size', type=int, default=8, help='Maximum requests per micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0,
+                        help='How long the first request of a batch waits for company')
+    parser.add_argument('--max-new-tokens', type=int, default=128, help='Default generation length')
+    parser.add_argument('--max-input-tokens', type=int, default=1024, help='Prompt truncation length')
+    parser.add_argument('--threads', type=int, default=None, help='torch / ONNX Runtime intra-op threads')
+    parser.add_argument('--onnx-dir', type=str, default=None,
+                        help='Serve an onnx_export.py export with ONNX Runtime instead of PyTorch')
+    parser.add_argument('--int8', action='store_true', help='With --onnx-dir: use the int8 model')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
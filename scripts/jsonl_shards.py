@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Size-bounded JSONL shards with a binary offsets index for random access.
+
+Layout of a sharded dataset directory:
+    manifest.json          shard names, record counts, compression
+    index.bin              one fixed-width record per sample (see INDEX_DTYPE)
+    shard-00000.jsonl      plain shards, or
+    shard-00000.jsonl.zst  zstd shards made of independent frames
+
+For plain shards each index entry points straight at the line. For zstd
+shards records are grouped into frames of about `block_bytes` uncompressed
+data; the entry points at the frame and at the line inside it, so reading
+sample N decompresses a single frame.
+
+Usage:
+    python3 scripts/jsonl_shards.py --input combined.jsonl --output-dir combined_shards \
+                                    --shard-size-mb 64 --compress
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+MANIFEST_NAME = "manifest.json"
+INDEX_NAME = "index.bin"
+INDEX_VERSION = 1
+
+# shard: shard number; block/block_len: byte range to read from the shard file;
+# offset/length: the record inside that range (after decompression)
+INDEX_DTYPE = np.dtype([
+    ("shard", "<u4"),
+    ("block", "<u8"),
+    ("block_len", "<u4"),
+    ("offset", "<u4"),
+    ("length", "<u4"),
+])
+
+
+def is_sharded_dataset(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME))
+
+
+class ShardedJsonlWriter:
+    """Write JSON records into size-bounded shards and build the index"""
+
+    def __init__(self, output_dir: str, shard_size_mb: float = 64, compress: bool = False,
+                 block_bytes: int = 256 * 1024, level: int = 3):
+        if compress and not HAS_ZSTD:
+            raise RuntimeError("zstd compression requires zstandard. Install with: pip install zstandard")
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_bytes = int(shard_size_mb * 1024 * 1024)
+        self.compress = compress
+        self.block_bytes = block_bytes
+        self._compressor = zstandard.ZstdCompressor(level=level) if compress else None
+
+        # The manifest marks a complete dataset; only close() writes it back
+        (self.output_dir / MANIFEST_NAME).unlink(missing_ok=True)
+        self.shards: List[Dict[str, Any]] = []
+        self._index = open(self.output_dir / INDEX_NAME, "wb")
+        self._entries: List[List[int]] = []
+        self._file = None
+        self._file_pos = 0
+        self._block: List[bytes] = []
+        self._block_pos = 0
+        self.count = 0
+        self.manifest: Optional[Dict[str, Any]] = None
+
+    def _open_shard(self):
+        suffix = ".jsonl.zst" if self.compress else ".jsonl"
+        name = f"shard-{len(self.shards):05d}{suffix}"
+        self._file = open(self.output_dir / name, "wb")
+        self._file_pos = 0
+        self.shards.append({"name": name, "records": 0, "bytes": 0})
+
+    def _flush_block(self):
+        """Compress pending records as one frame and fix up their index entries"""
+        if not self._block:
+            return
+        frame = self._compressor.compress(b"".join(self._block))
+        self._file.write(frame)
+        for entry in self._entries:
+            entry[1] = self._file_pos
+            entry[2] = len(frame)
+        self._file_pos += len(frame)
+        self._flush_entries()
+        self._block = []
+        self._block_pos = 0
+
+    def _flush_entries(self):
+        if self._entries:
+            np.array([tuple(e) for e in self._entries], dtype=INDEX_DTYPE).tofile(self._index)
+            self._entries = []
+
+    def _close_shard(self):
+        if self._file is None:
+            return
+        if self.compress:
+            self._flush_block()
+        self._flush_entries()
+        self.shards[-1]["bytes"] = self._file_pos
+        self._file.close()
+        self._file = None
+
+    def write_line(self, line: bytes):
+        """Append one already-serialized JSON line (without trailing newline)"""
+        data = line + b"\n"
+        if self._file is None or self._file_pos + self._block_pos >= self.shard_bytes:
+            self._close_shard()
+            self._open_shard()
+
+        shard_no = len(self.shards) - 1
+        if self.compress:
+            self._entries.append([shard_no, 0, 0, self._block_pos, len(data) - 1])
+            self._block.append(data)
+            self._block_pos += len(data)
+            if self._block_pos >= self.block_bytes:
+                self._flush_block()
+        else:
+            self._entries.append([shard_no, self._file_pos, len(data) - 1, 0, len(data) - 1])
+            self._file.write(data)
+            self._file_pos += len(data)
+            if len(self._entries) >= 65536:
+                self._flush_entries()
+
+        self.shards[-1]["records"] += 1
+        self.count += 1
+
+    def write(self, record: Dict[str, Any]):
+        self.write_line(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+
+    def close(self) -> Dict[str, Any]:
+        self._close_shard()
+        self._index.close()
+        manifest = {
+            "version": INDEX_VERSION,
+            "records": self.count,
+            "compression": "zstd" if self.compress else None,
+            "index": INDEX_NAME,
+            "shards": self.shards,
+        }
+        with open(self.output_dir / MANIFEST_NAME, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        self.manifest = manifest
+        return manifest
+
+    def abort(self):
+        """Close the files without a manifest, so readers never see a partial dataset"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class ShardedJsonlReader:
+    """O(1) random access and parallel per-shard reads over a sharded dataset"""
+
+    def __init__(self, path: str, cache_blocks: int = 8):
+        self.path = Path(path)
+        with open(self.path / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.compressed = self.manifest.get("compression") == "zstd"
+        if self.compressed and not HAS_ZSTD:
+            raise RuntimeError("Reading zstd shards requires zstandard. Install with: pip install zstandard")
+        if self.manifest["records"]:
+            self.index = np.memmap(self.path / self.manifest["index"], dtype=INDEX_DTYPE, mode="r")
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.shard_names = [s["name"] for s in self.manifest["shards"]]
+        counts = [s["records"] for s in self.manifest["shards"]]
+        self.shard_starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._files: Dict[int, Any] = {}
+        self._blocks: "OrderedDict[Tuple[int, int], bytes]" = OrderedDict()
+        self._cache_blocks = cache_blocks
+
+    def __len__(self):
+        return len(self.index)
+
+    def _file(self, shard: int):
+        if shard not in self._files:
+            self._files[shard] = open(self.path / self.shard_names[shard], "rb")
+        return self._files[shard]
+
+    def _read_block(self, shard: int, block: int, block_len: int) -> bytes:
+        key = (shard, block)
+        if key in self._blocks:
+            self._blocks.move_to_end(key)
+            return self._blocks[key]
+        f = self._file(shard)
+        f.seek(block)
+        data = f.read(block_len)
+        if self.compressed:
+            data = zstandard.ZstdDecompressor().decompress(data)
+            self._blocks[key] = data
+            if len(self._blocks) > self._cache_blocks:
+                self._blocks.popitem(last=False)
+        return data
+
+    def read_bytes(self, i: int) -> bytes:
+        entry = self.index[i]
+        data = self._read_block(int(entry["shard"]), int(entry["block"]), int(entry["block_len"]))
+        offset = int(entry["offset"])
+        return data[offset:offset + int(entry["length"])]
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += len(self)
+        return json.loads(self.read_bytes(i))
+
+    def iter_shard(self, shard: int) -> Iterator[Dict[str, Any]]:
+        """Sequentially decode one whole shard"""
+        path = self.path / self.shard_names[shard]
+        if self.compressed:
+            with open(path, "rb") as f:
+                reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                stream = reader.read().splitlines()
+        else:
+            with open(path, "rb") as f:
+                stream = f.read().splitlines()
+        for line in stream:
+            if line:
+                yield json.loads(line)
+
+    def read_shards_parallel(self, shards: Optional[List[int]] = None, workers: int = 4) -> List[Dict[str, Any]]:
+        """Read several shards concurrently; records keep their global order"""
+        shards = list(range(len(self.shard_names))) if shards is None else shards
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            parts = pool.map(lambda s: list(self.iter_shard(s)), shards)
+            return [record for part in parts for record in part]
+
+    def split(self, val_fraction: float = 0.1, seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+        """Random train/validation index split"""
+        order = np.random.default_rng(seed).permutation(len(self))
+        n_val = int(round(len(self) * val_fraction))
+        return np.sort(order[n_val:]), np.sort(order[:n_val])
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def dataset_fingerprint(path: str) -> str:
+    """Hash of the manifest and the size/mtime of every file; changes whenever the dataset is rewritten"""
+    import hashlib
+
+    root = Path(path)
+    digest = hashlib.sha1((root / MANIFEST_NAME).read_bytes())
+    for item in sorted(root.iterdir()):
+        if item.is_file():
+            stat = item.stat()
+            digest.update(f"{item.name}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def generate_records(path: str, shards: List[int], fingerprint: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Generator over a subset of shards, for datasets.Dataset.from_generator
+
+    `fingerprint` is unused here; it is part of gen_kwargs so the datasets
+    cache is keyed by the shard contents, not just the directory path.
+    """
+    reader = ShardedJsonlReader(path)
+    try:
+        for shard in shards:
+            yield from reader.iter_shard(shard)
+    finally:
+        reader.close()
+
+
+def shard_jsonl(input_path: str, output_dir: str, shard_size_mb: float = 64,
+                compress: bool = False) -> Dict[str, Any]:
+    """Split a JSONL file into shards without re-serializing records"""
+    with ShardedJsonlWriter(output_dir, shard_size_mb=shard_size_mb, compress=compress) as writer:
+        with open(input_path, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    writer.write_line(line)
+    return writer.manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Split a JSONL dataset into indexed shards')
+    parser.add_argument('--input', type=str, required=True, help='Input JSONL file')
+    parser.add_argument('--output-dir', type=str, required=True, help='Directory for shards and index')
+    parser.add_argument('--shard-size-mb', type=float, default=64, help='Maximum shard size in MB')
+    parser.add_argument('--compress', action='store_true', help='Write zstd-compressed shards')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"❌ Input file not found: {args.input}", file=sys.stderr)
+        return 1
+
+    manifest = shard_jsonl(args.input, args.output_dir, args.shard_size_mb, args.compress)
+    print(f"📦 Wrote {manifest['records']} records in {len(manifest['shards'])} shards to {args.output_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
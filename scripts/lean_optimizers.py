@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Optimizers with a smaller state footprint than fp32 AdamW, for CPU fine-tuning.
+
+AdamW keeps two fp32 tensors per parameter (8 bytes/parameter on top of the
+weights and gradients). The choices here trade a little precision or speed
+for memory:
+
+    adamw        torch.optim.AdamW (baseline, 8 bytes/param of state)
+    adafactor    factored second moments, no first moment: a row and a column
+                 vector per weight matrix (transformers.optimization.Adafactor)
+    adam8bit     AdamW with block-wise 8-bit states: each 2048-value block is
+                 scaled by its absmax and mapped onto a 256-entry log-spaced
+                 code (sqrt of the second moment is stored, which halves its
+                 dynamic range). About 2 bytes/param. Tensors under 4096
+                 values keep fp32 states.
+    adamw_mmap   AdamW whose states live in memory-mapped files, so the kernel
+                 can page them out under memory pressure instead of the job
+                 being OOM-killed
+
+`optimizer_state_bytes()` reports how many bytes of state are held in memory
+and in memory-mapped files (training_stats.json "optimizer").
+
+Usage:
+    python3 scripts/lean_optimizers.py --model models/persian-chat
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+try:
+    import torch
+    PYTORCH_AVAILABLE = True
+except ImportError:
+    PYTORCH_AVAILABLE = False
+
+OPTIMIZERS = ("adamw", "adafactor", "adam8bit", "adamw_mmap")
+
+QUANT_BLOCK = 2048
+MIN_8BIT_SIZE = 4096
+
+
+def _log_code(signed: bool) -> "torch.Tensor":
+    """Sorted 8-bit code book on [-1, 1] (signed) or [0, 1], log-spaced down to 1e-7"""
+    if signed:
+        positive = torch.logspace(-7, 0, 127, dtype=torch.float64)
+        code = torch.cat([-positive.flip(0), torch.zeros(1, dtype=torch.float64), positive])
+    else:
+        code = torch.cat([torch.zeros(1, dtype=torch.float64), torch.logspace(-7, 0, 255, dtype=torch.float64)])
+    return code.float()
+
+
+class BlockQuantizer:
+    """Block-wise absmax scaling onto a fixed code book, stored as uint8 indices"""
+
+    def __init__(self, signed: bool, block: int = QUANT_BLOCK):
+        self.code = _log_code(signed)
+        self.midpoints = (self.code[1:] + self.code[:-1]) / 2
+        self.block = block
+
+    def quantize(self, x: "torch.Tensor"):
+        flat = x.reshape(-1).float()
+        pad = (-flat.numel()) % self.block
+        if pad:
+            flat = torch.nn.functional.pad(flat, (0, pad))
+        blocks = flat.view(-1, self.block)
+        absmax = blocks.abs().amax(dim=1).clamp_(min=1e-30)
+        normalized = blocks / absmax.unsqueeze(1)
+        codes = torch.searchsorted(self.midpoints, normalized.contiguous()).to(torch.uint8)
+        return codes, absmax
+
+    def dequantize(self, codes: "torch.Tensor", absmax: "torch.Tensor", like: "torch.Tensor"):
+        values = self.code[codes.long()] * absmax.unsqueeze(1)
+        return values.view(-1)[:like.numel()].view_as(like)
+
+
+def _decay_groups(model, weight_decay: float) -> List[Dict]:
+    """Trainer-style parameter groups: no weight decay for biases and norm weights"""
+    from transformers.pytorch_utils import ALL_LAYERNORM_LAYERS
+    from transformers.trainer_pt_utils import get_parameter_names
+
+    decay = set(n for n in get_parameter_names(model, ALL_LAYERNORM_LAYERS) if "bias" not in n)
+    params = [(n, p) for n, p in model.named_parameters() if p.requires_grad]
+    return [
+        {"params": [p for n, p in params if n in decay], "weight_decay": weight_decay},
+        {"params": [p for n, p in params if n not in decay], "weight_decay": 0.0},
+    ]
+
+
+if PYTORCH_AVAILABLE:
+
+    class Adam8bit(torch.optim.Optimizer):
+        """AdamW with block-quantized 8-bit moment estimates (CPU implementation)"""
+
+        STATE_CODES = ("exp_avg_codes", "exp_avg_sqrt_codes")
+
+        def __init__(self, params, lr: float = 1e-3, betas=(0.9, 0.999), eps: float = 1e-8,
+                     weight_decay: float = 0.0, min_8bit_size: int = MIN_8BIT_SIZE):
+            super().__init__(params, dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay))
+            self.min_8bit_size = min_8bit_size
+            self.signed = BlockQuantizer(signed=True)
+            self.unsigned = BlockQuantizer(signed=False)
+
+        @torch.no_grad()
+        def step(self, closure=None):
+            loss = None
+            if closure is not None:
+                with torch.enable_grad():
+                    loss = closure()
+
+            for group in self.param_groups:
+                beta1, beta2 = group["betas"]
+                lr, eps, wd = group["lr"], group["eps"], group["weight_decay"]
+                for p in group["params"]:
+                    if p.grad is None:
+                        continue
+                    grad = p.grad.float()
+                    state = self.state[p]
+                    quantized = p.numel() >= self.min_8bit_size
+                    if not state:
+                        state["step"] = 0
+                        if quantized:
+                            state["exp_avg_codes"], state["exp_avg_absmax"] = self.signed.quantize(torch.zeros_like(grad))
+                            state["exp_avg_sqrt_codes"], state["exp_avg_sqrt_absmax"] = \
+                                self.unsigned.quantize(torch.zeros_like(grad))
+                        else:
+                            state["exp_avg"] = torch.zeros_like(grad)
+                            state["exp_avg_sq"] = torch.zeros_like(grad)
+
+                    state["step"] += 1
+                    t = state["step"]
+                    if quantized:
+                        exp_avg = self.signed.dequantize(state["exp_avg_codes"], state["exp_avg_absmax"], grad)
+                        exp_avg_sq = self.unsigned.dequantize(
+                            state["exp_avg_sqrt_codes"], state["exp_avg_sqrt_absmax"], grad).square_()
+                    else:
+                        exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
+
+                    if wd:
+                        p.mul_(1 - lr * wd)
+                    exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+                    exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                    denom = (exp_avg_sq.sqrt() / math.sqrt(1 - beta2 ** t)).add_(eps)
+                    p.addcdiv_(exp_avg.to(p.dtype), denom.to(p.dtype), value=-lr / (1 - beta1 ** t))
+
+                    if quantized:
+                        state["exp_avg_codes"], state["exp_avg_absmax"] = self.signed.quantize(exp_avg)
+                        state["exp_avg_sqrt_codes"], state["exp_avg_sqrt_absmax"] = \
+                            self.unsigned.quantize(exp_avg_sq.sqrt_())
+            return loss
+
+        def load_state_dict(self, state_dict):
+            super().load_state_dict(state_dict)
+            # Optimizer.load_state_dict casts state tensors to the parameter dtype
+            for state in self.state.values():
+                for key in self.STATE_CODES:
+                    if key in state:
+                        state[key] = state[key].to(torch.uint8)
+
+
+    class MmapAdamW(torch.optim.AdamW):
+        """AdamW with exp_avg / exp_avg_sq backed by memory-mapped files in `state_dir`"""
+
+        def __init__(self, params, state_dir: str, lr: float = 1e-3, betas=(0.9, 0.999), eps: float = 1e-8,
+                     weight_decay: float = 0.01):
+            # The single-tensor path: foreach would allocate full-size temporaries
+            super().__init__(params, lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, foreach=False)
+            self.state_dir = state_dir
+            os.makedirs(state_dir, exist_ok=True)
+            params = [p for group in self.param_groups for p in group["params"]]
+            total = sum(p.numel() for p in params)
+            self._maps = {
+                name: np.memmap(os.path.join(state_dir, f"{name}.f32"), dtype=np.float32, mode="w+",
+                                shape=(max(total, 1),))
+                for name in ("exp_avg", "exp_avg_sq")
+            }
+            self.mmap_bytes = sum(m.nbytes for m in self._maps.values())
+            offset = 0
+            for p in params:
+                n = p.numel()
+                self.state[p] = {
+                    "step": torch.tensor(0.0),
+                    **{name: torch.from_numpy(m[offset:offset + n]).view_as(p) for name, m in self._maps.items()}
+                }
+                offset += n
+
+        def load_state_dict(self, state_dict):
+            views = {p: {k: self.state[p][k] for k in self._maps} for p in list(self.state)}
+            super().load_state_dict(state_dict)
+            # Copy loaded values back into the mapped buffers instead of keeping new tensors
+            for p, mapped in views.items():
+                for key, view in mapped.items():
+                    if key in self.state[p]:
+                        view.copy_(self.state[p][key])
+                    self.state[p][key] = view
+
+        def close(self):
+            for m in self._maps.values():
+                m._mmap.close()
+            self._maps = {}
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+
+
+def create_optimizer(name: str, model, learning_rate: float, weight_decay: float = 0.01,
+                     state_dir: Optional[str] = None):
+    """Optimizer `name` over `model`'s trainable parameters"""
+    if name not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer: {name} (choose from {', '.join(OPTIMIZERS)})")
+    groups = _decay_groups(model, weight_decay)
+    if name == "adamw":
+        return torch.optim.AdamW(groups, lr=learning_rate)
+    if name == "adafactor":
+        from transformers.optimization import Adafactor
+        return Adafactor(groups, lr=learning_rate, scale_parameter=False, relative_step=False,
+                         warmup_init=False, beta1=None)
+    if name == "adam8bit":
+        return Adam8bit(groups, lr=learning_rate)
+    if state_dir is None:
+        raise ValueError("adamw_mmap needs a state_dir for its memory-mapped files")
+    return MmapAdamW(groups, state_dir, lr=learning_rate)
+
+
+def _tensors(value) -> Iterable["torch.Tensor"]:
+    if isinstance(value, torch.Tensor):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _tensors(v)
+
+
+def optimizer_state_bytes(optimizer) -> Dict:
+    """Bytes of optimizer state, split into resident memory and memory-mapped files"""
+    optimizer = getattr(optimizer, "optimizer", optimizer)
+    total = sum(t.numel() * t.element_size() for state in optimizer.state.values() for t in _tensors(state))
+    mmap_bytes = getattr(optimizer, "mmap_bytes", 0)
+    params = sum(p.numel() for group in optimizer.param_groups for p in group["params"])
+    return {
+        "optimizer": type(optimizer).__name__,
+        "state_bytes": total,
+        "in_memory_bytes": max(total - mmap_bytes, 0),
+        "mmap_bytes": mmap_bytes,
+        "bytes_per_parameter": round(total / params, 3) if params else None
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare optimizer state sizes after one step')
+    parser.add_argument('--model', type=str, required=True, help='Model directory or name')
+    parser.add_argument('--optimizers', type=str, default=','.join(OPTIMIZERS), help='Comma-separated list')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not PYTORCH_AVAILABLE:
+        print("❌ PyTorch is required. Install with: pip install torch transformers", file=sys.stderr)
+        return 1
+
+    import tempfile
+    from model_loader import load_causal_lm
+
+    model, _ = load_causal_lm(args.model)
+    model.train()
+    ids = torch.randint(0, model.config.vocab_size, (2, 32))
+    results = []
+    for name in args.optimizers.split(','):
+        with tempfile.TemporaryDirectory() as tmp:
+            optimizer = create_optimizer(name, model, 1e-5, state_dir=os.path.join(tmp, "state"))
+            model(input_ids=ids, labels=ids).loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            results.append({"name": name, **optimizer_state_bytes(optimizer)})
+            if hasattr(optimizer, "close"):
+                optimizer.close()
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
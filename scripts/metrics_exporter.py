@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Prometheus text-format metrics for training jobs.
+
+A job either serves /metrics from a daemon thread (--metrics-port) or
+periodically writes a .prom file for node_exporter's textfile collector
+(--metrics-textfile), so many jobs can be scraped instead of polling their
+JSON status files. No client library is needed; the exposition format is
+rendered directly.
+
+Exposed metrics (all labelled with job and script):
+    training_steps_total, training_tokens_total, training_samples_total,
+    training_checkpoints_total, training_loss, training_learning_rate,
+    training_epoch, training_progress_ratio, training_job_status{status},
+    training_step_latency_seconds (histogram),
+    training_checkpoint_duration_seconds (histogram),
+    training_process_resident_memory_bytes, training_process_cpu_seconds_total,
+    training_last_update_timestamp_seconds
+"""
+
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence
+
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STEP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CHECKPOINT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+COUNTERS = {
+    "steps": "Optimizer steps completed",
+    "tokens": "Tokens processed (non-padding)",
+    "samples": "Training samples processed",
+    "checkpoints": "Checkpoints written",
+}
+GAUGES = {
+    "loss": "Most recently logged training loss",
+    "learning_rate": "Current learning rate",
+    "epoch": "Current (fractional) epoch",
+    "progress_ratio": "Fraction of total steps completed",
+}
+JOB_STATUSES = ("STARTING", "LOADING", "RUNNING", "COMPLETED", "ERROR")
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is O(log buckets)"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float, n: int = 1):
+        idx = bisect_left(self.buckets, value)
+        if idx < len(self.buckets):
+            self.counts[idx] += n
+        self.sum += value * n
+        self.count += n
+
+    def lines(self, name: str, labels: Dict[str, str]):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_format_labels({**labels, 'le': repr(bound)})} {cumulative}"
+        yield f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {self.count}"
+        yield f"{name}_sum{_format_labels(labels)} {_format_value(self.sum)}"
+        yield f"{name}_count{_format_labels(labels)} {self.count}"
+
+
+class TrainingMetrics:
+    """Counters, gauges and histograms of one training job"""
+
+    def __init__(self, job: str, script: str, step_buckets: Sequence[float] = STEP_LATENCY_BUCKETS):
+        self.labels = {"job": job, "script": script}
+        self.counters = {name: 0 for name in COUNTERS}
+        self.gauges = {name: float("nan") for name in GAUGES}
+        self.status = "STARTING"
+        self.step_latency = Histogram(step_buckets)
+        self.checkpoint_duration = Histogram(CHECKPOINT_BUCKETS)
+        self.last_update = time.time()
+        self._lock = threading.Lock()
+        self._process = psutil.Process() if HAS_PSUTIL else None
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._textfile: Optional[str] = None
+        self._textfile_interval = 5.0
+        self._last_textfile_write = 0.0
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+            self.last_update = time.time()
+
+    def set(self, name: str, value: Optional[float]):
+        if value is None:
+            return
+        with self._lock:
+            self.gauges[name] = float(value)
+            self.last_update = time.time()
+
+    def set_status(self, status: str):
+        with self._lock:
+            self.status = status
+            self.last_update = time.time()
+
+    def observe_step(self, seconds: float, tokens: int = 0, samples: int = 0, steps: int = 1):
+        """Record `steps` steps of `seconds` each (use steps > 1 for an averaged interval)"""
+        with self._lock:
+            self.step_latency.observe(seconds, steps)
+            self.counters["steps"] += steps
+            self.counters["tokens"] += tokens
+            self.counters["samples"] += samples
+            self.last_update = time.time()
+
+    def observe_checkpoint(self, seconds: float):
+        with self._lock:
+            self.checkpoint_duration.observe(seconds)
+            self.counters["checkpoints"] += 1
+            self.last_update = time.time()
+
+    def render(self) -> str:
+        labels = self.labels
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for name, help_text in COUNTERS.items():
+                metric = f"training_{name}_total"
+                header(metric, "counter", help_text)
+                lines.append(f"{metric}{_format_labels(labels)} {_format_value(self.counters[name])}")
+            for name, help_text in GAUGES.items():
+                metric = f"training_{name}"
+                header(metric, "gauge", help_text)
+                lines.append(f"{metric}{_format_labels(labels)} {_format_value(self.gauges[name])}")
+
+            header("training_job_status", "gauge", "1 for the job's current status")
+            for status in JOB_STATUSES:
+                value = 1 if status == self.status else 0
+                lines.append(f"training_job_status{_format_labels({**labels, 'status': status})} {value}")
+
+            header("training_step_latency_seconds", "histogram", "Wall-clock time per optimizer step")
+            lines.extend(self.step_latency.lines("training_step_latency_seconds", labels))
+            header("training_checkpoint_duration_seconds", "histogram", "Time spent writing checkpoints")
+            lines.extend(self.checkpoint_duration.lines("training_checkpoint_duration_seconds", labels))
+
+            header("training_last_update_timestamp_seconds", "gauge", "Unix time of the last metric update")
+            lines.append(f"training_last_update_timestamp_seconds{_format_labels(labels)} "
+                         f"{_format_value(self.last_update)}")
+
+        header("training_process_cpu_seconds_total", "counter", "CPU time used by the training process")
+        lines.append(f"training_process_cpu_seconds_total{_format_labels(labels)} "
+                     f"{_format_value(time.process_time())}")
+        if self._process is not None:
+            header("training_process_resident_memory_bytes", "gauge", "Resident set size of the training process")
+            lines.append(f"training_process_resident_memory_bytes{_format_labels(labels)} "
+                         f"{self._process.memory_info().rss}")
+
+        return "\n".join(lines) + "\n"
+
+    def start(self, port: Optional[int] = None, textfile: Optional[str] = None,
+              textfile_interval: float = 5.0, addr: str = "0.0.0.0") -> "TrainingMetrics":
+        """Serve /metrics on `port` and/or write `textfile`; both are optional"""
+        self._textfile = textfile
+        self._textfile_interval = textfile_interval
+        if port:
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/metrics", "/"):
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", CONTENT_TYPE)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((addr, port), Handler)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+            print(f"📡 Metrics served on http://{addr}:{self._server.server_address[1]}/metrics", flush=True)
+        return self
+
+    def write_textfile(self, force: bool = False):
+        """Atomically rewrite the textfile (at most every textfile_interval seconds unless forced)"""
+        if not self._textfile:
+            return
+        now = time.time()
+        if not force and now - self._last_textfile_write < self._textfile_interval:
+            return
+        self._last_textfile_write = now
+        directory = os.path.dirname(self._textfile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self._textfile}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self._textfile)
+
+    def close(self):
+        self.write_textfile(force=True)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
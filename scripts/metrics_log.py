@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Append-only binary metrics log with multi-resolution summaries.
+
+Layout of a metrics log directory:
+    meta.json   fields, block factor, version
+    L0.bin      one fixed-width record per logged step (RECORD_DTYPE)
+    L1.bin      one summary per BLOCK consecutive L0 records (SUMMARY_DTYPE)
+    L2.bin      one summary per BLOCK consecutive L1 summaries, and so on
+
+Records are only ever appended, so a reader can memory-map the files while
+training is still writing them. Summaries keep mean/min/max of every field,
+which keeps loss spikes visible in downsampled curves.
+
+`MetricsLogReader.curve(start, end, max_points)` binary-searches the coarsest
+level that still has `max_points` entries in the range, so the work depends
+on `max_points` and the number of levels, not on the number of steps.
+
+Usage:
+    python3 scripts/metrics_log.py --log models/persian-chat/metrics_log --field loss --points 500
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+LOG_VERSION = 1
+BLOCK = 32
+MAX_LEVELS = 6
+META_NAME = "meta.json"
+
+FIELDS = ("loss", "learning_rate", "grad_norm", "epoch", "tokens_per_second", "step_ms")
+
+RECORD_DTYPE = np.dtype([("step", "<u8"), ("time", "<f8")] + [(f, "<f4") for f in FIELDS])
+SUMMARY_DTYPE = np.dtype(
+    [("step_first", "<u8"), ("step_last", "<u8"), ("time", "<f8"), ("count", "<u4")]
+    + [(f"{f}_{agg}", "<f4") for f in FIELDS for agg in ("mean", "min", "max")]
+)
+
+
+def _level_name(level: int) -> str:
+    return f"L{level}.bin"
+
+
+def _as_summaries(records: np.ndarray) -> np.ndarray:
+    """View raw records as single-record summaries"""
+    out = np.zeros(len(records), dtype=SUMMARY_DTYPE)
+    out["step_first"] = records["step"]
+    out["step_last"] = records["step"]
+    out["time"] = records["time"]
+    out["count"] = 1
+    for f in FIELDS:
+        for agg in ("mean", "min", "max"):
+            out[f"{f}_{agg}"] = records[f]
+    return out
+
+
+def _aggregate(rows: np.ndarray, groups: int) -> np.ndarray:
+    """Merge consecutive summary rows into `groups` summaries (NaN values are ignored)"""
+    bounds = np.linspace(0, len(rows), groups + 1).astype(np.int64)
+    bounds = np.unique(bounds)
+    starts, ends = bounds[:-1], bounds[1:]
+    out = np.zeros(len(starts), dtype=SUMMARY_DTYPE)
+    out["step_first"] = rows["step_first"][starts]
+    out["step_last"] = rows["step_last"][ends - 1]
+    out["time"] = rows["time"][ends - 1]
+    counts = rows["count"].astype(np.float64)
+    out["count"] = np.add.reduceat(counts, starts)
+
+    for f in FIELDS:
+        mean = rows[f"{f}_mean"].astype(np.float64)
+        valid = ~np.isnan(mean)
+        weights = np.where(valid, counts, 0.0)
+        total = np.add.reduceat(np.where(valid, mean, 0.0) * weights, starts)
+        weight = np.add.reduceat(weights, starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[f"{f}_mean"] = np.where(weight > 0, total / weight, np.nan)
+        out[f"{f}_min"] = np.fmin.reduceat(rows[f"{f}_min"], starts)
+        out[f"{f}_max"] = np.fmax.reduceat(rows[f"{f}_max"], starts)
+    return out
+
+
+class MetricsLogWriter:
+    """Append records and roll them up into coarser summary levels"""
+
+    def __init__(self, path: str, reset: bool = False):
+        """Open (and resume) the log at `path`; reset=True discards existing records"""
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta_path = self.path / META_NAME
+        if reset:
+            for stale in self.path.glob("L*.bin"):
+                stale.unlink()
+            if meta_path.exists():
+                meta_path.unlink()
+        if meta_path.exists():
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != LOG_VERSION or meta.get("fields") != list(FIELDS):
+                raise RuntimeError(f"Incompatible metrics log at {self.path}")
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"version": LOG_VERSION, "fields": list(FIELDS), "block": BLOCK,
+                           "created_at": time.time()}, f, indent=2)
+
+        self._files = {}
+        # Pending (not yet rolled up) rows of each level, rebuilt when resuming a log
+        self._pending: List[List[np.ndarray]] = []
+        for level in range(MAX_LEVELS):
+            dtype = RECORD_DTYPE if level == 0 else SUMMARY_DTYPE
+            file_path = self.path / _level_name(level)
+            self._truncate_partial(file_path, dtype)
+            if level == MAX_LEVELS - 1:
+                # The coarsest level is never rolled up further
+                self._pending.append([])
+                continue
+            done_above = len(_read_level(self.path / _level_name(level + 1), SUMMARY_DTYPE))
+            rows = np.array(_read_level(file_path, dtype)[done_above * BLOCK:])
+            if level == 0:
+                rows = _as_summaries(rows)
+            self._pending.append([rows] if len(rows) else [])
+
+        self._last_step = None
+        last = _read_level(self.path / _level_name(0), RECORD_DTYPE)
+        if len(last):
+            self._last_step = int(last["step"][-1])
+
+    @staticmethod
+    def _truncate_partial(file_path: Path, dtype: np.dtype):
+        """Drop a torn trailing record left by a crash"""
+        if file_path.exists():
+            size = file_path.stat().st_size
+            if size % dtype.itemsize:
+                os.truncate(file_path, size - size % dtype.itemsize)
+
+    def _file(self, level: int):
+        if level not in self._files:
+            self._files[level] = open(self.path / _level_name(level), "ab")
+        return self._files[level]
+
+    def _pending_count(self, level: int) -> int:
+        return sum(len(rows) for rows in self._pending[level])
+
+    def append(self, step: int, **values: Optional[float]):
+        """Append one record; fields not given are stored as NaN. Steps must not decrease."""
+        if self._last_step is not None and step < self._last_step:
+            raise ValueError(f"Step {step} is before the last logged step {self._last_step}")
+        self._last_step = step
+
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record["step"] = step
+        record["time"] = values.pop("time", None) or time.time()
+        for f in FIELDS:
+            value = values.get(f)
+            record[f] = np.nan if value is None else value
+        f0 = self._file(0)
+        f0.write(record.tobytes())
+        f0.flush()
+
+        self._pending[0].append(_as_summaries(record))
+        for level in range(MAX_LEVELS - 1):
+            if self._pending_count(level) < BLOCK:
+                break
+            rows = np.concatenate(self._pending[level])
+            summary = _aggregate(rows[:BLOCK], 1)
+            self._pending[level] = [rows[BLOCK:]] if len(rows) > BLOCK else []
+            f = self._file(level + 1)
+            f.write(summary.tobytes())
+            f.flush()
+            if level + 1 < MAX_LEVELS - 1:
+                self._pending[level + 1].append(summary)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read_level(file_path: Path, dtype: np.dtype) -> np.ndarray:
+    """Memory-map the complete records of one level file"""
+    try:
+        size = file_path.stat().st_size
+    except OSError:
+        return np.zeros(0, dtype=dtype)
+    n = size // dtype.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode="r", shape=(n,))
+
+
+class MetricsLogReader:
+    """Range queries and downsampled curves over a metrics log directory"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        if not (self.path / META_NAME).exists():
+            raise FileNotFoundError(f"No metrics log at {self.path}")
+
+    def _level(self, level: int) -> np.ndarray:
+        # Re-mapped on every query so records appended since are visible
+        return _read_level(self.path / _level_name(level),
+                           RECORD_DTYPE if level == 0 else SUMMARY_DTYPE)
+
+    def __len__(self):
+        return len(self._level(0))
+
+    def last(self) -> Optional[Dict]:
+        records = self._level(0)
+        if not len(records):
+            return None
+        return {name: records[name][-1].item() for name in RECORD_DTYPE.names}
+
+    def _count(self, level: int, start: int, end: int) -> int:
+        rows = self._level(level)
+        if not len(rows):
+            return 0
+        if level == 0:
+            return int(np.searchsorted(rows["step"], end, "right") - np.searchsorted(rows["step"], start, "left"))
+        return int(np.searchsorted(rows["step_first"], end, "right")
+                   - np.searchsorted(rows["step_last"], start, "left"))
+
+    def _collect(self, level: int, start: int, end: int) -> np.ndarray:
+        """Summaries of `level` overlapping [start, end], plus finer rows for the uncovered tail"""
+        rows = self._level(level)
+        if level == 0:
+            lo = np.searchsorted(rows["step"], start, "left")
+            hi = np.searchsorted(rows["step"], end, "right")
+            return _as_summaries(rows[lo:hi])
+
+        lo = np.searchsorted(rows["step_last"], start, "left")
+        hi = np.searchsorted(rows["step_first"], end, "right")
+        part = np.asarray(rows[lo:hi])
+        covered = int(part["step_last"][-1]) if len(part) else start - 1
+        if covered >= end:
+            return part
+        tail = self._collect(level - 1, max(start, covered + 1), end)
+        return np.concatenate([part, tail]) if len(part) else tail
+
+    def curve(self, start: Optional[int] = None, end: Optional[int] = None,
+              max_points: int = 500, field: Optional[str] = None) -> Dict:
+        """At most `max_points` summaries covering steps [start, end]"""
+        start = 0 if start is None else start
+        end = np.iinfo(np.uint64).max if end is None else end
+
+        level = 0
+        for candidate in range(MAX_LEVELS - 1, 0, -1):
+            if self._count(candidate, start, end) >= max_points:
+                level = candidate
+                break
+
+        rows = self._collect(level, start, end)
+        if len(rows) > max_points:
+            rows = _aggregate(rows, max_points)
+
+        fields = [field] if field else list(FIELDS)
+        result = {
+            "level": level,
+            "points": len(rows),
+            "step": rows["step_last"].tolist(),
+            "step_first": rows["step_first"].tolist(),
+            "time": rows["time"].tolist(),
+        }
+        for f in fields:
+            for agg in ("mean", "min", "max"):
+                values = rows[f"{f}_{agg}"].astype(np.float64)
+                result[f"{f}_{agg}"] = [None if np.isnan(v) else round(float(v), 6) for v in values]
+        return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Read a downsampled curve from a metrics log')
+    parser.add_argument('--log', type=str, required=True, help='Metrics log directory')
+    parser.add_argument('--field', type=str, default=None, help=f'One of {", ".join(FIELDS)} (default: all)')
+    parser.add_argument('--start', type=int, default=None, help='First step')
+    parser.add_argument('--end', type=int, default=None, help='Last step')
+    parser.add_argument('--points', type=int, default=500, help='Maximum number of points')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.field and args.field not in FIELDS:
+        print(f"❌ Unknown field: {args.field}", file=sys.stderr)
+        return 1
+    try:
+        reader = MetricsLogReader(args.log)
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    print(json.dumps(reader.curve(args.start, args.end, args.points, args.field)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Low-memory causal LM loading shared by the training and evaluation scripts.
+
+`from_pretrained` with default arguments builds a randomly initialized model
+and then copies the checkpoint into it, so weights are materialized (often
+twice) before training starts. This loader instead:
+
+  - initializes on the meta device (low_cpu_mem_usage) so each tensor is
+    allocated once,
+  - prefers safetensors, which transformers reads through mmap,
+  - keeps a warm cache of safetensors conversions for local checkpoints that
+    only ship pytorch_model.bin, so the slow pickle path is paid once (least
+    recently used entries are evicted above MODEL_CACHE_MAX_GB, default 20),
+  - reports load time and peak RSS.
+
+Usage:
+    python3 scripts/model_loader.py --model models/persian-chat
+    python3 scripts/model_loader.py --model models/persian-chat --convert
+    python3 scripts/model_loader.py --prune-cache --cache-max-gb 5
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:  # Windows
+    HAS_RESOURCE = False
+
+DEFAULT_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "artifacts/model_cache")
+DEFAULT_CACHE_MAX_GB = float(os.environ.get("MODEL_CACHE_MAX_GB", "20"))
+
+SAFETENSORS_PATTERNS = ("model.safetensors", "model.safetensors.index.json")
+PICKLE_PATTERNS = ("pytorch_model.bin", "pytorch_model.bin.index.json")
+
+
+def _has_any(model_dir: Path, names) -> bool:
+    return any((model_dir / name).exists() for name in names)
+
+
+def checkpoint_format(model_dir: str) -> Optional[str]:
+    """'safetensors', 'pytorch' or None for a local model directory"""
+    path = Path(model_dir)
+    if not path.is_dir():
+        return None
+    if _has_any(path, SAFETENSORS_PATTERNS):
+        return "safetensors"
+    if _has_any(path, PICKLE_PATTERNS):
+        return "pytorch"
+    return None
+
+
+def _cache_entry(model_dir: Path, cache_dir: str) -> Path:
+    """Cache location keyed by the checkpoint path and its modification times"""
+    stamps = sorted(
+        (p.name, p.stat().st_mtime_ns, p.stat().st_size)
+        for p in model_dir.iterdir() if p.name.startswith("pytorch_model")
+    )
+    raw = f"{model_dir.resolve()}|{stamps}"
+    return Path(cache_dir) / hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def prune_cache(cache_dir: str = DEFAULT_CACHE_DIR, max_gb: float = DEFAULT_CACHE_MAX_GB,
+                keep: Optional[Path] = None) -> List[str]:
+    """Evict least recently used conversions until the cache fits `max_gb`; returns removed entries"""
+    root = Path(cache_dir)
+    if not root.is_dir():
+        return []
+    # In-progress conversions (.tmp) belong to another process; leave them alone
+    entries = [p for p in root.iterdir() if p.is_dir() and not p.name.endswith(".tmp")]
+    sizes = {p: _dir_bytes(p) for p in entries}
+    total = sum(sizes.values())
+    removed = []
+    for entry in sorted(entries, key=lambda p: p.stat().st_mtime):
+        if total <= max_gb * 1024 ** 3:
+            break
+        if keep is not None and entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+        removed.append(str(entry))
+    return removed
+
+
+class _PeakRSS:
+    """Peak RSS during a block: sampled with psutil when available, else ru_maxrss"""
+
+    def __init__(self):
+        self.monitor = None
+        try:
+            from batch_autotune import PeakRSSMonitor
+            self.monitor = PeakRSSMonitor(interval=0.01)
+        except (ImportError, RuntimeError):
+            pass
+        self.peak_bytes = None
+
+    def __enter__(self):
+        if self.monitor is not None:
+            self.monitor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        if self.monitor is not None:
+            self.monitor.__exit__(*exc)
+            self.peak_bytes = self.monitor.peak
+        elif HAS_RESOURCE:
+            # Lifetime peak of the process, in KB on Linux
+            self.peak_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def convert_to_safetensors(model_dir: str, output_dir: Optional[str] = None,
+                           remove_pickle: bool = False) -> Optional[str]:
+    """Re-save a pytorch_model.bin checkpoint as safetensors.
+
+    Writes into `output_dir` (default: in place) and returns it, or None when
+    there is nothing to convert. Shared (tied) weights are handled by
+    save_pretrained.
+    """
+    from transformers import AutoModelForCausalLM
+
+    source = Path(model_dir)
+    if checkpoint_format(model_dir) != "pytorch":
+        return None
+    target = Path(output_dir) if output_dir else source
+
+    model = AutoModelForCausalLM.from_pretrained(str(source), low_cpu_mem_usage=True)
+    if target != source:
+        target.mkdir(parents=True, exist_ok=True)
+        for item in source.iterdir():
+            if item.is_file() and not item.name.startswith("pytorch_model"):
+                shutil.copy2(item, target / item.name)
+    model.save_pretrained(str(target), safe_serialization=True)
+    del model
+
+    if remove_pickle and target == source:
+        for item in source.iterdir():
+            if item.name.startswith("pytorch_model"):
+                item.unlink()
+    return str(target)
+
+
+def resolve_checkpoint(model_name: str, cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> Tuple[str, str]:
+    """Path to load from and its format; pickle-only local checkpoints go through the cache"""
+    fmt = checkpoint_format(model_name)
+    if fmt != "pytorch" or not cache_dir:
+        return model_name, fmt or "hub"
+
+    entry = _cache_entry(Path(model_name), cache_dir)
+    if checkpoint_format(str(entry)) == "safetensors":
+        os.utime(entry)  # recency for prune_cache
+        return str(entry), "safetensors (cached)"
+    # Per-process scratch directory: concurrent loaders (e.g. DDP ranks) never share one
+    tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    convert_to_safetensors(model_name, str(tmp))
+    if checkpoint_format(str(entry)) == "safetensors":
+        # Another process finished the same conversion first
+        shutil.rmtree(tmp, ignore_errors=True)
+        return str(entry), "safetensors (cached)"
+    shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if checkpoint_format(str(entry)) != "safetensors":
+            raise
+        return str(entry), "safetensors (cached)"
+    # Entries of replaced checkpoints are never hit again; keep the cache bounded
+    prune_cache(cache_dir, keep=entry)
+    return str(entry), "safetensors (converted)"
+
+
+def _has_pruned_heads(model_dir: str) -> bool:
+    config_path = Path(model_dir) / "config.json"
+    if not config_path.exists():
+        return False
+    with open(config_path, "r", encoding="utf-8") as f:
+        return bool(json.load(f).get("pruned_heads"))
+
+
+def load_causal_lm(model_name: str, torch_dtype=None, cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                   **kwargs):
+    """Load a causal LM with low peak memory; returns (model, report)"""
+    from transformers import AutoModelForCausalLM
+
+    start = time.perf_counter()
+    with _PeakRSS() as rss:
+        path, fmt = resolve_checkpoint(model_name, cache_dir)
+        load_kwargs = {"low_cpu_mem_usage": True, **kwargs}
+        if torch_dtype is not None:
+            load_kwargs["torch_dtype"] = torch_dtype
+        if fmt.startswith("safetensors"):
+            load_kwargs.setdefault("use_safetensors", True)
+        if _has_pruned_heads(path):
+            # The SDPA attention classes assume the full head count
+            load_kwargs.setdefault("attn_implementation", "eager")
+        model = AutoModelForCausalLM.from_pretrained(path, **load_kwargs)
+
+    report = {
+        "model": model_name,
+        "loaded_from": path,
+        "format": fmt,
+        "low_cpu_mem_usage": load_kwargs["low_cpu_mem_usage"],
+        "load_seconds": round(time.perf_counter() - start, 3),
+        "peak_rss_gb": round(rss.peak_bytes / 1024 ** 3, 3) if rss.peak_bytes else None,
+        "parameters": sum(p.numel() for p in model.parameters())
+    }
+    return model, report
+
+
+def ensure_safetensors(model_dir: str) -> bool:
+    """Convert a saved output directory to safetensors in place; True if it was converted"""
+    return convert_to_safetensors(model_dir, remove_pickle=True) is not None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load a causal LM with low peak memory and report the cost')
+    parser.add_argument('--model', type=str, default=None, help='Model name or local directory')
+    parser.add_argument('--convert', action='store_true',
+                        help='Convert a local pytorch_model.bin checkpoint to safetensors in place')
+    parser.add_argument('--no-cache', action='store_true', help='Do not use the safetensors conversion cache')
+    parser.add_argument('--no-low-cpu-mem', action='store_true',
+                        help='Disable meta-device initialization (for comparison)')
+    parser.add_argument('--prune-cache', action='store_true',
+                        help='Evict least recently used conversions until the cache fits --cache-max-gb')
+    parser.add_argument('--cache-max-gb', type=float, default=DEFAULT_CACHE_MAX_GB,
+                        help='Conversion cache size limit for --prune-cache (default: MODEL_CACHE_MAX_GB or 20)')
+    args = parser.parse_args()
+    if not args.model and not args.prune_cache:
+        parser.error('--model is required unless --prune-cache is given')
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if args.prune_cache:
+        removed = prune_cache(DEFAULT_CACHE_DIR, args.cache_max_gb)
+        print(f"🧹 Removed {len(removed)} cache entries from {DEFAULT_CACHE_DIR}")
+        if not args.model:
+            return 0
+
+    if args.convert:
+        converted = ensure_safetensors(args.model)
+        print(f"{'✅ Converted' if converted else 'ℹ️  Nothing to convert in'} {args.model}")
+
+    kwargs = {"low_cpu_mem_usage": False} if args.no_low_cpu_mem else {}
+    _, report = load_causal_lm(args.model, cache_dir=None if args.no_cache else DEFAULT_CACHE_DIR, **kwargs)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 
+import argparse
 import json
 import pathlib
 from typing import Dict, Any, List
 
-def normalize_persian_conversation_dataset():
+def normalize_persian_conversation_dataset(
+    input_dir: str = "datasets/text/persian_conversation/data",
+    output_file: str = "datasets/text/persian_conversation/combined.jsonl",
+    dedup: bool = False,
+    near_dedup: bool = True,
+    dedup_report: str = "logs/dedup_report.json",
+    shard_dir: str = None,
+    shard_size_mb: float = 64,
+    compress_shards: bool = False
+):
     """Convert Persian conversational dataset to unified JSONL format."""
     
-    input_dir = pathlib.Path("datasets/text/persian_conversation/data")
-    output_file = pathlib.Path("datasets/text/persian_conversation/combined.jsonl")
+    input_dir = pathlib.Path(input_dir)
+    output_file = pathlib.Path(output_file)
     
     if not input_dir.exists():
         print(f"Input directory {input_dir} does not exist")
@@ -66,7 +76,50 @@ def normalize_persian_conversation_dataset():
                 continue
     
     print(f"Normalized {count} conversations to {output_file}")
+    
+    if dedup and count > 0:
+        # Imported lazily so plain normalization does not require numpy
+        from dedup_conversations import dedup_in_place, print_report
+        report = dedup_in_place(str(output_file), near=near_dedup, report_path=dedup_report)
+        print_report(report)
+        count = report["kept"]
+    
+    if shard_dir and count > 0:
+        from jsonl_shards import shard_jsonl
+        manifest = shard_jsonl(str(output_file), shard_dir, shard_size_mb, compress_shards)
+        print(f"Wrote {manifest['records']} conversations in {len(manifest['shards'])} shards to {shard_dir}")
+    
     return count
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Normalize Persian conversation data to JSONL")
+    parser.add_argument("--input-dir", type=str, default="datasets/text/persian_conversation/data",
+                        help="Directory with raw JSON conversation files")
+    parser.add_argument("--output", type=str, default="datasets/text/persian_conversation/combined.jsonl",
+                        help="Output JSONL file")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Remove exact and near-duplicate conversations after normalization")
+    parser.add_argument("--exact-dedup-only", action="store_true",
+                        help="With --dedup, skip MinHash near-duplicate detection")
+    parser.add_argument("--dedup-report", type=str, default="logs/dedup_report.json",
+                        help="Where to write the dedup report")
+    parser.add_argument("--shard-dir", type=str, default=None,
+                        help="Also write size-bounded shards with a random-access index to this directory")
+    parser.add_argument("--shard-size-mb", type=float, default=64,
+                        help="Maximum shard size in MB")
+    parser.add_argument("--compress-shards", action="store_true",
+                        help="zstd-compress the shards")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    normalize_persian_conversation_dataset()
+    args = parse_args()
+    normalize_persian_conversation_dataset(
+        input_dir=args.input_dir,
+        output_file=args.output,
+        dedup=args.dedup,
+        near_dedup=not args.exact_dedup_only,
+        dedup_report=args.dedup_report,
+        shard_dir=args.shard_dir,
+        shard_size_mb=args.shard_size_mb,
+        compress_shards=args.compress_shards
+    )
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+ONNX export and ONNX Runtime backend for trained causal LMs.
+
+The export is a single decoder graph with KV-cache inputs and outputs:
+
+    inputs   input_ids, attention_mask, position_ids,
+             past_key_values.{i}.key / .value    [batch, heads, past_len, head_dim]
+    outputs  logits, present.{i}.key / .value    [batch, heads, past_len + seq, head_dim]
+
+The first (prefill) call passes zero-length past tensors, so the same graph
+serves prompt processing and token-by-token decoding. After export the graph
+is checked against PyTorch on a left-padded prefill plus one decode step.
+With --int8 a dynamically quantized copy (int8 weights) is written as well.
+
+OnnxCausalLM mirrors the small part of the transformers model interface that
+inference_server.py and eval_cpu.py use (`model(input_ids=..., attention_mask=...,
+position_ids=..., past_key_values=...)` returning `.logits` and
+`.past_key_values`), so either backend can be plugged in.
+
+Usage:
+    python3 scripts/onnx_export.py --model models/persian-chat --int8 --benchmark
+"""
+
+import argparse
+import inspect
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    HAS_ORT = True
+except ImportError:
+    HAS_ORT = False
+
+MODEL_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+META_FILE = "onnx_export.json"
+OPSET = 17
+
+
+def _require_ort():
+    if not HAS_ORT:
+        raise RuntimeError("ONNX Runtime is required. Install with: pip install onnx onnxruntime")
+
+
+def _legacy_cache(past):
+    return past.to_legacy_cache() if hasattr(past, "to_legacy_cache") else past
+
+
+def _cache_shape(model) -> Dict[str, int]:
+    """Layers, KV heads and head dim, read off a real forward pass"""
+    import torch
+
+    with torch.no_grad():
+        out = model(input_ids=torch.zeros(1, 2, dtype=torch.long), use_cache=True)
+    past = _legacy_cache(out.past_key_values)
+    return {"layers": len(past), "heads": past[0][0].shape[1], "head_dim": past[0][0].shape[3]}
+
+
+def _io_names(layers: int):
+    past = [f"past_key_values.{i}.{kv}" for i in range(layers) for kv in ("key", "value")]
+    present = [f"present.{i}.{kv}" for i in range(layers) for kv in ("key", "value")]
+    return past, present
+
+
+def export_onnx(model_dir: str, output_dir: Optional[str] = None, int8: bool = False,
+                opset: int = OPSET) -> Dict:
+    """Export model_dir to <output_dir>/model.onnx (and model.int8.onnx); returns the export metadata"""
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    output_dir = Path(output_dir or os.path.join(model_dir, "onnx"))
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Eager attention: its mask handling has no data-dependent branches, so
+    # one trace is valid for any prompt and cache length
+    model = AutoModelForCausalLM.from_pretrained(model_dir, attn_implementation="eager", low_cpu_mem_usage=True)
+    model.eval()
+    shape = _cache_shape(model)
+    layers = shape["layers"]
+    past_names, present_names = _io_names(layers)
+
+    class DecoderWithPast(torch.nn.Module):
+        def __init__(self, lm):
+            super().__init__()
+            self.lm = lm
+
+        def forward(self, input_ids, attention_mask, position_ids, *past):
+            pkv = tuple((past[2 * i], past[2 * i + 1]) for i in range(layers))
+            out = self.lm(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                          past_key_values=pkv, use_cache=True, return_dict=True)
+            return (out.logits,) + tuple(t for kv in _legacy_cache(out.past_key_values) for t in kv)
+
+    batch, seq, past_len = 2, 3, 4
+    dummy = (
+        torch.randint(0, model.config.vocab_size, (batch, seq)),
+        torch.ones(batch, past_len + seq, dtype=torch.long),
+        torch.arange(past_len, past_len + seq).expand(batch, seq),
+        *[torch.randn(batch, shape["heads"], past_len, shape["head_dim"]) for _ in past_names]
+    )
+    dynamic_axes = {
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "total_sequence"},
+        "position_ids": {0: "batch", 1: "sequence"},
+        "logits": {0: "batch", 1: "sequence"},
+        **{name: {0: "batch", 2: "past_sequence"} for name in past_names},
+        **{name: {0: "batch", 2: "total_sequence"} for name in present_names},
+    }
+
+    # torch>=2.5 takes `dynamo` (and later defaults it on); the TorchScript exporter handles the KV cache inputs
+    export_kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    model_path = output_dir / MODEL_FILE
+    start = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(
+            DecoderWithPast(model).eval(), dummy, str(model_path),
+            input_names=["input_ids", "attention_mask", "position_ids"] + past_names,
+            output_names=["logits"] + present_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            **export_kwargs
+        )
+    meta = {
+        "source": str(model_dir),
+        "opset": opset,
+        **shape,
+        "export_seconds": round(time.perf_counter() - start, 2),
+        "model_file": MODEL_FILE,
+        "model_mb": round(model_path.stat().st_size / 1024 ** 2, 2),
+        "int8_file": None
+    }
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    tokenizer.save_pretrained(str(output_dir))
+    model.config.save_pretrained(str(output_dir))
+
+    if int8:
+        meta.update(quantize_int8(str(model_path), str(output_dir / INT8_FILE)))
+
+    # The runtime wrapper reads the metadata, so it is written before validating
+    _write_meta(output_dir, meta)
+    meta["max_abs_diff"] = validate_export(model, str(output_dir))
+    _write_meta(output_dir, meta)
+    return meta
+
+
+def _write_meta(output_dir: Path, meta: Dict):
+    with open(output_dir / META_FILE, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def quantize_int8(model_path: str, output_path: str) -> Dict:
+    """Dynamic quantization: int8 weights for MatMul/Gemm, activations quantized at run time"""
+    _require_ort()
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8)
+    return {"int8_file": os.path.basename(output_path),
+            "int8_mb": round(os.path.getsize(output_path) / 1024 ** 2, 2)}
+
+
+class OnnxCausalLM:
+    """ONNX Runtime session with the call signature of a transformers causal LM"""
+
+    def __init__(self, onnx_dir: str, int8: bool = False, threads: Optional[int] = None):
+        _require_ort()
+        self.onnx_dir = Path(onnx_dir)
+        with open(self.onnx_dir / META_FILE, "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        filename = self.meta["int8_file"] if int8 else self.meta["model_file"]
+        if not filename:
+            raise RuntimeError(f"No int8 model in {onnx_dir}; export with --int8")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(self.onnx_dir / filename), options,
+                                            providers=["CPUExecutionProvider"])
+        self.past_names, self.present_names = _io_names(self.meta["layers"])
+        self.int8 = int8
+
+    def run(self, input_ids: np.ndarray, attention_mask: np.ndarray, position_ids: Optional[np.ndarray] = None,
+            past: Optional[List[np.ndarray]] = None):
+        """numpy in, (logits, present list) out"""
+        batch = input_ids.shape[0]
+        if position_ids is None:
+            position_ids = np.clip(attention_mask.cumsum(-1) - 1, 0, None)[:, -input_ids.shape[1]:]
+        if past is None:
+            empty = np.zeros((batch, self.meta["heads"], 0, self.meta["head_dim"]), dtype=np.float32)
+            past = [empty] * len(self.past_names)
+        feeds = {
+            "input_ids": input_ids.astype(np.int64, copy=False),
+            "attention_mask": attention_mask.astype(np.int64, copy=False),
+            "position_ids": position_ids.astype(np.int64, copy=False),
+            **dict(zip(self.past_names, past))
+        }
+        outputs = self.session.run(None, feeds)
+        return outputs[0], outputs[1:]
+
+    def __call__(self, input_ids, attention_mask=None, position_ids=None, past_key_values=None, **kwargs):
+        import torch
+
+        input_ids = input_ids.numpy()
+        attention_mask = np.ones_like(input_ids) if attention_mask is None else attention_mask.numpy()
+        past = None
+        if past_key_values is not None:
+            past = [t.numpy() for kv in past_key_values for t in kv]
+        logits, present = self.run(input_ids, attention_mask,
+                                   None if position_ids is None else position_ids.numpy(), past)
+        pairs = tuple((torch.from_numpy(present[2 * i]), torch.from_numpy(present[2 * i + 1]))
+                      for i in range(self.meta["layers"]))
+        return SimpleNamespace(logits=torch.from_numpy(logits), past_key_values=pairs)
+
+    def eval(self):
+        return self
+
+
+def validate_export(model, onnx_dir: str) -> float:
+    """Max |logit difference| vs PyTorch over a left-padded prefill and one decode step"""
+    import torch
+
+    runner = OnnxCausalLM(onnx_dir)
+    ids = torch.randint(0, model.config.vocab_size, (2, 5))
+    mask = torch.ones_like(ids)
+    mask[0, :2] = 0
+    positions = (mask.cumsum(-1) - 1).clamp(min=0)
+
+    with torch.no_grad():
+        ref = model(input_ids=ids, attention_mask=mask, position_ids=positions, use_cache=True)
+        out = runner(ids, mask, positions)
+        step_ids = ids[:, -1:]
+        step_mask = torch.cat([mask, torch.ones(2, 1, dtype=mask.dtype)], dim=1)
+        step_pos = positions[:, -1:] + 1
+        ref_step = model(input_ids=step_ids, attention_mask=step_mask, position_ids=step_pos,
+                         past_key_values=ref.past_key_values, use_cache=True)
+        out_step = runner(step_ids, step_mask, step_pos, out.past_key_values)
+
+    valid = mask.bool()
+    diff = max(float((ref.logits - out.logits).abs()[valid].max()),
+               float((ref_step.logits - out_step.logits).abs().max()))
+    return round(diff, 6)
+
+
+def _time_backend(model, batch_size: int, prompt_len: int, new_tokens: int, vocab: int, repeat: int = 3) -> Dict:
+    """Prefill latency and per-token decode latency for one backend"""
+    import torch
+
+    ids = torch.randint(0, vocab, (batch_size, prompt_len))
+    mask = torch.ones_like(ids)
+    prefill, decode = [], []
+    with torch.inference_mode():
+        for _ in range(repeat + 1):
+            start = time.perf_counter()
+            out = model(input_ids=ids, attention_mask=mask, use_cache=True)
+            prefill.append(time.perf_counter() - start)
+            past = out.past_key_values
+            step_mask = mask
+            next_ids = out.logits[:, -1].argmax(-1, keepdim=True)
+            start = time.perf_counter()
+            for t in range(new_tokens):
+                step_mask = torch.cat([step_mask, torch.ones(batch_size, 1, dtype=mask.dtype)], dim=1)
+                position = torch.full((batch_size, 1), prompt_len + t)
+                out = model(input_ids=next_ids, attention_mask=step_mask, position_ids=position,
+                            past_key_values=past, use_cache=True)
+                past = out.past_key_values
+                next_ids = out.logits[:, -1].argmax(-1, keepdim=True)
+            decode.append((time.perf_counter() - start) / new_tokens)
+
+    # First round is warm-up
+    prefill_s = float(np.median(prefill[1:]))
+    decode_s = float(np.median(decode[1:]))
+    return {
+        "prefill_ms": round(1000 * prefill_s, 2),
+        "decode_ms_per_token": round(1000 * decode_s, 2),
+        "prefill_tokens_per_second": round(batch_size * prompt_len / prefill_s, 1),
+        "decode_tokens_per_second": round(batch_size / decode_s, 1)
+    }
+
+
+def benchmark_backends(model_dir: str, onnx_dir: str, batch_sizes=(1, 8), prompt_len: int = 64,
+                       new_tokens: int = 16, threads: Optional[int] = None) -> Dict:
+    """Side-by-side PyTorch / ONNX Runtime fp32 / int8 latency and throughput"""
+    import torch
+    from model_loader import load_causal_lm
+
+    if threads:
+        torch.set_num_threads(threads)
+    torch_model, _ = load_causal_lm(model_dir)
+    torch_model.eval()
+    backends = {"pytorch": torch_model, "onnxruntime": OnnxCausalLM(onnx_dir, threads=threads)}
+    if backends["onnxruntime"].meta.get("int8_file"):
+        backends["onnxruntime_int8"] = OnnxCausalLM(onnx_dir, int8=True, threads=threads)
+
+    limit = getattr(torch_model.config, "max_position_embeddings", None) or getattr(torch_model.config, "n_positions", None)
+    if limit:
+        prompt_len = min(prompt_len, limit - new_tokens)
+    vocab = torch_model.config.vocab_size
+
+    results = {}
+    for batch_size in batch_sizes:
+        row = {name: _time_backend(model, batch_size, prompt_len, new_tokens, vocab)
+               for name, model in backends.items()}
+        base = row["pytorch"]["decode_ms_per_token"]
+        for name, stats in row.items():
+            stats["decode_speedup"] = round(base / stats["decode_ms_per_token"], 2)
+        results[f"batch_{batch_size}"] = row
+    return {"prompt_len": prompt_len, "new_tokens": new_tokens, "results": results}
+
+
+def print_benchmark(report: Dict):
+    print(f"\n⚡ Prompt {report['prompt_len']} tokens, {report['new_tokens']} new tokens")
+    for batch, row in report["results"].items():
+        print(f"   {batch}:")
+        for name, stats in row.items():
+            print(f"      {name:>17}: prefill {stats['prefill_ms']:8.2f} ms, "
+                  f"decode {stats['decode_ms_per_token']:7.2f} ms/token "
+                  f"({stats['decode_tokens_per_second']} tok/s, x{stats['decode_speedup']})")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export a causal LM to ONNX with KV cache')
+    parser.add_argument('--model', type=str, default='models/persian-chat', help='Trained model directory')
+    parser.add_argument('--output-dir', type=str, default=None, help='ONNX output directory (default: <model>/onnx)')
+    parser.add_argument('--int8', action='store_true', help='Also write a dynamically quantized int8 model')
+    parser.add_argument('--opset', type=int, default=OPSET, help='ONNX opset version')
+    parser.add_argument('--benchmark', action='store_true', help='Compare PyTorch and ONNX Runtime latency')
+    parser.add_argument('--batch-sizes', type=str, default='1,8', help='Batch sizes for --benchmark')
+    parser.add_argument('--prompt-length', type=int, default=64, help='Prompt length for --benchmark')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads for both backends')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    _require_ort()
+
+    if not os.path.isdir(args.model):
+        print(f"❌ Model directory not found: {args.model}", file=sys.stderr)
+        return 1
+
+    output_dir = args.output_dir or os.path.join(args.model, "onnx")
+    print(f"📦 Exporting {args.model} -> {output_dir}")
+    meta = export_onnx(args.model, output_dir, int8=args.int8, opset=args.opset)
+    print(f"✅ Exported in {meta['export_seconds']}s ({meta['model_mb']} MB"
+          f"{', int8 ' + str(meta['int8_mb']) + ' MB' if meta.get('int8_file') else ''}), "
+          f"max |logit diff| vs PyTorch: {meta['max_abs_diff']}")
+
+    if args.benchmark:
+        report = benchmark_backends(args.model, output_dir,
+                                    batch_sizes=[int(b) for b in args.batch_sizes.split(',')],
+                                    prompt_len=args.prompt_length, threads=args.threads)
+        print_benchmark(report)
+        with open(os.path.join(output_dir, "benchmark.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Structured pruning of trained causal LMs (train_model_real output).
+
+Importance scores are computed on a calibration subset, then whole
+structures are removed so the saved model is physically smaller. Models with
+pruned heads need eager attention (the SDPA classes assume the full head
+count): load them with model_loader.load_causal_lm, which sets it, or pass
+attn_implementation="eager" to `from_pretrained`:
+
+    attention heads   first-order Taylor score |sum(x * dL/dx)| per head at the
+                      input of the attention output projection; the same
+                      number of heads is removed from every layer (the KV
+                      cache stays rectangular) and recorded in
+                      config.pruned_heads. Only for architectures that
+                      implement prune_heads (GPT-2).
+    MLP neurons       the same Taylor score at the input of the MLP down
+                      projection; every layer keeps the same number of
+                      neurons so config.n_inner / intermediate_size stays
+                      a single value.
+    layers            block influence: 1 - cosine(block input, block output)
+                      over non-padding tokens; the least influential blocks
+                      are dropped.
+
+An optional short fine-tune (--finetune-steps) recovers some of the loss.
+Parameter count, CPU latency and perplexity before/after are measured with
+eval_cpu.evaluate_backends and written to <output_dir>/pruning_metrics.json.
+
+Usage:
+    python3 scripts/prune_model.py --model models/persian-chat --output-dir models/persian-chat-pruned \\
+        --calibration-data combined.jsonl --eval-data test.jsonl \\
+        --head-ratio 0.25 --neuron-ratio 0.3 --drop-layers 2 --finetune-steps 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+try:
+    import torch
+    from transformers import AutoTokenizer
+    from transformers.pytorch_utils import prune_conv1d_layer, prune_linear_layer
+    PYTORCH_AVAILABLE = True
+except ImportError as e:
+    PYTORCH_AVAILABLE = False
+    print(f"Warning: PyTorch/Transformers not available: {e}")
+
+from eval_cpu import evaluate_backends, iter_records, tokenize_records
+
+
+def _layout(model) -> Dict:
+    """Where the blocks and projections of a supported architecture live"""
+    if hasattr(model, "transformer") and hasattr(model.transformer, "h"):
+        # GPT-2 family: Conv1D projections, weights stored as [in, out]
+        return {"parent": model.transformer, "attr": "h", "layers_key": "n_layer", "inner_key": "n_inner",
+                "attn": "attn", "attn_out": "c_proj", "mlp_in": ["c_fc"], "mlp_out": "c_proj", "conv1d": True}
+    if hasattr(model, "model") and hasattr(model.model, "layers"):
+        # Llama / Mistral / Qwen2: gated MLP with nn.Linear projections
+        return {"parent": model.model, "attr": "layers", "layers_key": "num_hidden_layers",
+                "inner_key": "intermediate_size", "attn": "self_attn", "attn_out": "o_proj",
+                "mlp_in": ["gate_proj", "up_proj"], "mlp_out": "down_proj", "conv1d": False}
+    raise ValueError(f"Unsupported architecture for pruning: {type(model).__name__}")
+
+
+def _blocks(model, layout: Dict):
+    return getattr(layout["parent"], layout["attr"])
+
+
+def _head_config(model):
+    config = model.config
+    heads = getattr(config, "num_attention_heads", None) or getattr(config, "n_head")
+    hidden = getattr(config, "hidden_size", None) or getattr(config, "n_embd")
+    return heads, getattr(config, "head_dim", None) or hidden // heads
+
+
+def calibration_batches(data_path: str, tokenizer, samples: int, batch_size: int, max_length: int):
+    """Tokenized calibration batches, trimmed to the longest record of each batch"""
+    records = list(iter_records(data_path, samples))
+    if not records:
+        raise ValueError(f"No calibration records in {data_path}")
+    batches = []
+    for i in range(0, len(records), batch_size):
+        enc = tokenize_records(records[i:i + batch_size], tokenizer, max_length)
+        mask = torch.tensor(enc["attention_mask"])
+        width = max(int(mask.sum(-1).max()), 1)
+        batches.append({
+            "input_ids": torch.tensor(enc["input_ids"])[:, :width],
+            "attention_mask": mask[:, :width],
+            "labels": torch.tensor(enc["labels"])[:, :width]
+        })
+    return batches
+
+
+def compute_importance(model, batches: List[Dict]) -> Dict[str, torch.Tensor]:
+    """Head, neuron and layer importance accumulated over the calibration batches"""
+    layout = _layout(model)
+    blocks = _blocks(model, layout)
+    num_heads, head_dim = _head_config(model)
+    n_layers = len(blocks)
+    inner = getattr(getattr(blocks[0].mlp, layout["mlp_out"]), "weight").shape[0 if layout["conv1d"] else 1]
+
+    heads = torch.zeros(n_layers, num_heads)
+    neurons = torch.zeros(n_layers, inner)
+    influence = torch.zeros(n_layers)
+    tokens = torch.zeros(1)
+    current_mask = {}
+    handles = []
+
+    def taylor_hook(target, row):
+        def hook(module, args):
+            x = args[0]
+            if not x.requires_grad:
+                return
+
+            def on_grad(grad):
+                score = (x.detach() * grad).float().sum(dim=(0, 1))
+                target[row] += score.view(target.shape[1], -1).sum(-1).abs()
+            x.register_hook(on_grad)
+        return hook
+
+    def influence_hook(i):
+        def hook(module, args, kwargs, output):
+            x = args[0] if args else kwargs["hidden_states"]
+            y = output[0] if isinstance(output, tuple) else output
+            valid = current_mask["mask"].bool()
+            cos = torch.nn.functional.cosine_similarity(x.detach()[valid].float(), y.detach()[valid].float(), dim=-1)
+            influence[i] += (1 - cos).sum()
+        return hook
+
+    for i, block in enumerate(blocks):
+        attn = getattr(block, layout["attn"])
+        handles.append(getattr(attn, layout["attn_out"]).register_forward_pre_hook(taylor_hook(heads, i)))
+        handles.append(getattr(block.mlp, layout["mlp_out"]).register_forward_pre_hook(taylor_hook(neurons, i)))
+        handles.append(block.register_forward_hook(influence_hook(i), with_kwargs=True))
+
+    model.eval()
+    try:
+        for batch in batches:
+            current_mask["mask"] = batch["attention_mask"]
+            model.zero_grad(set_to_none=True)
+            loss = model(**batch).loss
+            loss.backward()
+            tokens += batch["attention_mask"].sum()
+    finally:
+        for handle in handles:
+            handle.remove()
+        model.zero_grad(set_to_none=True)
+
+    return {"heads": heads, "neurons": neurons, "layers": influence / tokens}
+
+
+def prune_heads(model, importance: torch.Tensor, ratio: float) -> Dict[int, List[int]]:
+    """Remove the `ratio` least important heads of every layer"""
+    if ratio <= 0:
+        return {}
+    layout = _layout(model)
+    if not hasattr(getattr(_blocks(model, layout)[0], layout["attn"]), "prune_heads"):
+        print(f"⚠️  Head pruning is not supported for {model.config.model_type}; skipped")
+        return {}
+    num_heads = importance.shape[1]
+    remove = min(int(num_heads * ratio), num_heads - 1)
+    if remove == 0:
+        return {}
+    plan = {i: sorted(importance[i].argsort()[:remove].tolist()) for i in range(importance.shape[0])}
+    # Updates config.pruned_heads, which from_pretrained re-applies on load
+    model.prune_heads(plan)
+    return plan
+
+
+def prune_neurons(model, importance: torch.Tensor, ratio: float) -> Optional[int]:
+    """Keep the same number of most important MLP neurons in every layer; returns the new width"""
+    if ratio <= 0:
+        return None
+    layout = _layout(model)
+    inner = importance.shape[1]
+    keep = max(1, inner - int(inner * ratio))
+    for i, block in enumerate(_blocks(model, layout)):
+        index = importance[i].argsort(descending=True)[:keep].sort().values
+        mlp = block.mlp
+        for name in layout["mlp_in"]:
+            layer = getattr(mlp, name)
+            setattr(mlp, name, prune_conv1d_layer(layer, index, dim=1) if layout["conv1d"]
+                    else prune_linear_layer(layer, index, dim=0))
+        layer = getattr(mlp, layout["mlp_out"])
+        setattr(mlp, layout["mlp_out"], prune_conv1d_layer(layer, index, dim=0) if layout["conv1d"]
+                else prune_linear_layer(layer, index, dim=1))
+    setattr(model.config, layout["inner_key"], keep)
+    return keep
+
+
+def drop_layers(model, influence: torch.Tensor, count: int) -> List[int]:
+    """Remove the `count` blocks that change the hidden state least"""
+    layout = _layout(model)
+    blocks = _blocks(model, layout)
+    count = min(count, len(blocks) - 1)
+    if count <= 0:
+        return []
+    dropped = sorted(influence.argsort()[:count].tolist())
+    kept = [i for i in range(len(blocks)) if i not in dropped]
+    setattr(layout["parent"], layout["attr"], torch.nn.ModuleList(blocks[i] for i in kept))
+
+    for new_idx, block in enumerate(_blocks(model, layout)):
+        attn = getattr(block, layout["attn"])
+        if hasattr(attn, "layer_idx"):
+            # Cache slots are indexed by layer
+            attn.layer_idx = new_idx
+    setattr(model.config, layout["layers_key"], len(kept))
+    pruned_heads = getattr(model.config, "pruned_heads", None)
+    if pruned_heads:
+        model.config.pruned_heads = {new_idx: pruned_heads[old] for new_idx, old in enumerate(kept)
+                                     if old in pruned_heads}
+    return dropped
+
+
+def finetune(model, batches: List[Dict], steps: int, learning_rate: float) -> List[float]:
+    """Short recovery fine-tune over the calibration batches"""
+    model.train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
+    losses = []
+    for step in range(steps):
+        batch = batches[step % len(batches)]
+        loss = model(**batch).loss
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        losses.append(loss.item())
+        if (step + 1) % 50 == 0 or step + 1 == steps:
+            print(f"   step {step + 1}/{steps}: loss {sum(losses[-50:]) / len(losses[-50:]):.4f}")
+    model.eval()
+    return losses
+
+
+def measure(model_dir: str, args) -> Dict:
+    """Parameters, CPU latency and perplexity of a saved model via the evaluation script"""
+    from model_loader import load_causal_lm
+
+    model, report = load_causal_lm(model_dir)
+    result = {"parameters": report["parameters"]}
+    del model
+    if args.eval_data:
+        eval_args = SimpleNamespace(model=model_dir, data=args.eval_data, max_samples=args.eval_samples,
+                                    batch_size=args.batch_size, max_length=args.max_length,
+                                    threads=args.threads, onnx_dir=None, int8=False, num_generations=0)
+        result.update(evaluate_backends(eval_args, ["torch"])[0]["torch"])
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Structured pruning of a trained causal LM')
+    parser.add_argument('--model', type=str, required=True, help='Trained model directory')
+    parser.add_argument('--output-dir', type=str, required=True, help='Where to save the pruned model')
+    parser.add_argument('--calibration-data', type=str, required=True, help='JSONL file or sharded dataset')
+    parser.add_argument('--calibration-samples', type=int, default=128, help='Records used for importance scores')
+    parser.add_argument('--eval-data', type=str, default=None, help='Test set for the before/after report')
+    parser.add_argument('--eval-samples', type=int, default=None, help='Evaluate at most this many records')
+    parser.add_argument('--head-ratio', type=float, default=0.0, help='Fraction of heads removed per layer')
+    parser.add_argument('--neuron-ratio', type=float, default=0.0, help='Fraction of MLP neurons removed per layer')
+    parser.add_argument('--drop-layers', type=int, default=0, help='Number of whole layers to remove')
+    parser.add_argument('--finetune-steps', type=int, default=0, help='Recovery fine-tuning steps (0 = none)')
+    parser.add_argument('--learning-rate', type=float, default=2e-5, help='Fine-tuning learning rate')
+    parser.add_argument('--batch-size', type=int, default=4, help='Calibration / fine-tuning batch size')
+    parser.add_argument('--max-length', type=int, default=512, help='Maximum sequence length')
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not PYTORCH_AVAILABLE:
+        print("❌ PyTorch and Transformers are required. Install with: pip install torch transformers", file=sys.stderr)
+        return 1
+    if not os.path.isdir(args.model):
+        print(f"❌ Model directory not found: {args.model}", file=sys.stderr)
+        return 1
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    from model_loader import load_causal_lm
+
+    print(f"📊 Measuring original model: {args.model}")
+    before = measure(args.model, args)
+
+    # Eager attention: the SDPA classes cannot run with pruned heads
+    model, _ = load_causal_lm(args.model, **({"attn_implementation": "eager"} if args.head_ratio > 0 else {}))
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    start = time.perf_counter()
+    batches = calibration_batches(args.calibration_data, tokenizer, args.calibration_samples,
+                                  args.batch_size, args.max_length)
+    print(f"🔬 Scoring importance on {sum(len(b['input_ids']) for b in batches)} calibration records...")
+    importance = compute_importance(model, batches)
+    scoring_seconds = time.perf_counter() - start
+
+    head_plan = prune_heads(model, importance["heads"], args.head_ratio)
+    inner = prune_neurons(model, importance["neurons"], args.neuron_ratio)
+    dropped = drop_layers(model, importance["layers"], args.drop_layers)
+    print(f"✂️  Heads removed per layer: {len(next(iter(head_plan.values()))) if head_plan else 0}, "
+          f"MLP width: {inner or 'unchanged'}, layers dropped: {dropped or 'none'}")
+
+    losses = []
+    if args.finetune_steps:
+        print(f"🔧 Fine-tuning for {args.finetune_steps} steps...")
+        losses = finetune(model, batches, args.finetune_steps, args.learning_rate)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    model.save_pretrained(args.output_dir, safe_serialization=True)
+    tokenizer.save_pretrained(args.output_dir)
+    del model
+
+    print(f"📊 Measuring pruned model: {args.output_dir}")
+    after = measure(args.output_dir, args)
+
+    metrics = {
+        "source_model": args.model,
+        "calibration_data": args.calibration_data,
+        "calibration_samples": sum(len(b["input_ids"]) for b in batches),
+        "scoring_seconds": round(scoring_seconds, 2),
+        "pruned_heads": head_plan,
+        "mlp_width": inner,
+        "dropped_layers": dropped,
+        "layer_influence": [round(float(v), 6) for v in importance["layers"]],
+        "finetune_steps": args.finetune_steps,
+        "finetune_final_loss": round(sum(losses[-50:]) / len(losses[-50:]), 4) if losses else None,
+        "before": before,
+        "after": after,
+        "parameter_reduction": round(1 - after["parameters"] / before["parameters"], 4)
+    }
+    with open(os.path.join(args.output_dir, "pruning_metrics.json"), "w", encoding="utf-8") as f:
+        json.dump(metrics, f, indent=2)
+
+    print(f"✅ Parameters: {before['parameters']:,} -> {after['parameters']:,} "
+          f"(-{100 * metrics['parameter_reduction']:.1f}%)")
+    if args.eval_data:
+        print(f"   Perplexity: {before['perplexity']} -> {after['perplexity']}")
+        print(f"   Latency: {before['ms_per_sample']} -> {after['ms_per_sample']} ms/sample")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Token-length profile of a training dataset: max_length, buckets, padding waste.
+
+--max-length 512 pads every short conversation to 512 tokens and cuts long
+ones off without saying so. This pass tokenizes the dataset (all of it, or a
+--sample-fraction of it) the way train_real_pytorch.py renders it, in
+parallel worker processes, and reports:
+
+  - the token-length distribution (mean, percentiles, max),
+  - a recommended max_length at --percentile, rounded up to --pad-multiple,
+  - --num-buckets bucket boundaries that minimize padding (exact dynamic
+    programming over multiples of --pad-multiple),
+  - padding waste and tokens per epoch with fixed padding vs. buckets, and
+    the tokens lost to truncation.
+
+train_real_pytorch.py --length-report <report> takes max_length from the
+report and, with buckets, drops the fixed padding: batches are grouped by
+length and padded only up to the next bucket boundary (BucketPaddingCollator),
+which keeps the set of tensor shapes small.
+
+Usage:
+    python3 scripts/sequence_profiler.py --input datasets/text/persian_conversation/combined.jsonl \\
+        --tokenizer HooshvareLab/bert-fa-base-uncased --percentile 99 --num-buckets 4
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+CHUNK_RECORDS = 512
+
+_worker_tokenizer = None
+
+
+def record_length(records: List[Dict], tokenizer) -> List[int]:
+    """Token count of each record as train_real_pytorch.py tokenizes it (before truncation)"""
+    from train_real_pytorch import chat_segments
+
+    lengths = [0] * len(records)
+    chat = [i for i, r in enumerate(records) if "messages" in r]
+    if chat:
+        segments, trainable, owners = chat_segments([records[i]["messages"] for i in chat])
+        eos = 1 if tokenizer.eos_token_id is not None else 0
+        ids = tokenizer(segments, add_special_tokens=False)["input_ids"] if segments else []
+        for seg_ids, is_trainable, owner in zip(ids, trainable, owners):
+            lengths[chat[owner]] += len(seg_ids) + (eos if is_trainable else 0)
+    text = [i for i, r in enumerate(records) if "messages" not in r]
+    if text:
+        texts = [records[i]["text"] if "text" in records[i]
+                 else f"سوال: {records[i].get('question')}\nپاسخ: {records[i].get('answer')}" for i in text]
+        for i, ids in zip(text, tokenizer(texts)["input_ids"]):
+            lengths[i] = len(ids)
+    return lengths
+
+
+def _init_worker(tokenizer_name: str):
+    global _worker_tokenizer
+    # Each worker is one process; the tokenizers thread pool would oversubscribe
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    from transformers import AutoTokenizer
+    _worker_tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+
+def _chunk_lengths(records: List[Dict]) -> List[int]:
+    return record_length(records, _worker_tokenizer)
+
+
+def _sampled_chunks(data_path: str, sample_fraction: float, seed: int) -> Iterator[List[Dict]]:
+    from eval_cpu import iter_records
+
+    rng = random.Random(seed)
+    chunk = []
+    for record in iter_records(data_path):
+        if sample_fraction < 1.0 and rng.random() >= sample_fraction:
+            continue
+        chunk.append(record)
+        if len(chunk) >= CHUNK_RECORDS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def profile_lengths(data_path: str, tokenizer_name: str, sample_fraction: float = 1.0, workers: int = None,
+                    seed: int = 0) -> np.ndarray:
+    """Token lengths of the (sampled) records, computed in `workers` processes"""
+    workers = workers or os.cpu_count() or 1
+    chunks = _sampled_chunks(data_path, sample_fraction, seed)
+    lengths = []
+    if workers <= 1:
+        _init_worker(tokenizer_name)
+        for chunk in chunks:
+            lengths.extend(_chunk_lengths(chunk))
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(tokenizer_name,)) as pool:
+            for chunk_lengths in pool.map(_chunk_lengths, chunks):
+                lengths.extend(chunk_lengths)
+    return np.asarray(lengths, dtype=np.int64)
+
+
+def _round_up(value: int, multiple: int) -> int:
+    return max(multiple, -(-int(value) // multiple) * multiple)
+
+
+def optimal_buckets(lengths: np.ndarray, max_length: int, num_buckets: int, multiple: int = 8) -> List[int]:
+    """Upper bucket boundaries (multiples of `multiple`, last = max_length) with the least padding"""
+    lengths = np.minimum(lengths, max_length)
+    candidates = np.unique(np.append(np.arange(multiple, max_length, multiple), max_length))
+    # count / token sum of lengths <= each candidate
+    sorted_lengths = np.sort(lengths)
+    positions = np.searchsorted(sorted_lengths, candidates, side="right")
+    prefix_sum = np.concatenate([[0], np.cumsum(sorted_lengths)])
+    counts = np.concatenate([[0], positions])
+    sums = prefix_sum[counts]
+    m = len(candidates)
+
+    def cost(a: np.ndarray, b: int) -> np.ndarray:
+        # Padding of lengths in (candidates[a - 1], candidates[b]] padded to candidates[b]; a = 0 starts at 0
+        n = counts[b + 1] - counts[a]
+        return n * candidates[b] - (sums[b + 1] - sums[a])
+
+    inf = np.iinfo(np.int64).max // 4
+    best = np.full((num_buckets + 1, m + 1), inf, dtype=np.int64)
+    choice = np.zeros((num_buckets + 1, m + 1), dtype=np.int64)
+    best[0, 0] = 0
+    for k in range(1, num_buckets + 1):
+        for b in range(m):
+            a = np.arange(b + 1)
+            total = best[k - 1, a] + cost(a, b)
+            i = int(np.argmin(total))
+            best[k, b + 1], choice[k, b + 1] = total[i], a[i]
+    k = int(np.argmin(best[1:, m])) + 1
+    boundaries = []
+    b = m
+    while b > 0 and k > 0:
+        boundaries.append(int(candidates[b - 1]))
+        b, k = int(choice[k, b]), k - 1
+    return sorted(boundaries)
+
+
+def bucket_of(length: int, boundaries: List[int]) -> int:
+    """Padded length of a sequence: the smallest boundary that holds it (the last one truncates)"""
+    return next((b for b in boundaries if length <= b), boundaries[-1])
+
+
+def padding_stats(lengths: np.ndarray, boundaries: List[int], scale: float = 1.0) -> Dict:
+    """Real vs. padded tokens when every sequence is padded to its bucket boundary"""
+    bounds = np.asarray(boundaries)
+    kept = np.minimum(lengths, bounds[-1])
+    padded = bounds[np.minimum(np.searchsorted(bounds, kept, side="left"), len(bounds) - 1)]
+    real, total = int(kept.sum()), int(padded.sum())
+    return {
+        "real_tokens": round(real * scale),
+        "padded_tokens": round(total * scale),
+        "padding_waste": round(1 - real / total, 4) if total else 0.0
+    }
+
+
+def build_report(lengths: np.ndarray, percentile: float, num_buckets: int, pad_multiple: int,
+                 sample_fraction: float, model_max_length: Optional[int] = None) -> Dict:
+    if not len(lengths):
+        raise ValueError("No records to profile")
+    max_length = _round_up(np.percentile(lengths, percentile), pad_multiple)
+    if model_max_length:
+        max_length = min(max_length, model_max_length)
+    scale = 1.0 / sample_fraction
+    buckets = optimal_buckets(lengths, max_length, num_buckets, pad_multiple) if num_buckets > 1 else [max_length]
+    bucket_counts = np.bincount(np.searchsorted(buckets, np.minimum(lengths, max_length), side="left"),
+                                minlength=len(buckets))
+    truncated = lengths > max_length
+    return {
+        "samples_profiled": int(len(lengths)),
+        "estimated_samples": round(len(lengths) * scale),
+        "lengths": {
+            "mean": round(float(lengths.mean()), 1),
+            **{f"p{p}": int(np.percentile(lengths, p)) for p in (50, 90, 95, 99)},
+            "max": int(lengths.max())
+        },
+        "percentile": percentile,
+        "max_length": int(max_length),
+        "pad_multiple": pad_multiple,
+        "truncated_samples": round(float(truncated.mean()), 4),
+        "truncated_tokens": round(int((lengths[truncated] - max_length).sum()) * scale),
+        "buckets": [{"max_length": b, "samples": round(int(c) * scale), "share": round(int(c) / len(lengths), 4)}
+                    for b, c in zip(buckets, bucket_counts)],
+        "epoch_tokens": {
+            "fixed": padding_stats(lengths, [max_length], scale),
+            "bucketed": padding_stats(lengths, buckets, scale)
+        }
+    }
+
+
+def load_length_report(path: str) -> Dict:
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    if "max_length" not in report:
+        raise ValueError(f"{path} is not a sequence length report")
+    return report
+
+
+def trim_padding(batch: Dict) -> Dict:
+    """Drop the fixed padding of tokenized rows and add the `length` column group_by_length sorts on"""
+    lengths = [sum(mask) for mask in batch["attention_mask"]]
+    # Every per-token column (input_ids, attention_mask, labels, token_type_ids)
+    out = {key: [row[:n] for row, n in zip(values, lengths)] for key, values in batch.items()
+           if values and isinstance(values[0], list)}
+    out["length"] = lengths
+    return out
+
+
+class BucketPaddingCollator:
+    """Pad a batch to the smallest bucket boundary that holds its longest row"""
+
+    def __init__(self, boundaries: List[int], pad_token_id: int, ignore_index: int = -100):
+        self.boundaries = sorted(boundaries)
+        self.pad_token_id = pad_token_id
+        self.ignore_index = ignore_index
+
+    def __call__(self, features: List[Dict]) -> Dict:
+        import torch
+
+        width = bucket_of(max(len(f["input_ids"]) for f in features), self.boundaries)
+        batch = {"input_ids": [], "attention_mask": [], "labels": []}
+        for f in features:
+            ids = list(f["input_ids"][:width])
+            mask = list(f.get("attention_mask", [1] * len(ids)))[:width]
+            # Text rows have no labels: the loss covers every real token
+            labels = list(f["labels"][:width]) if "labels" in f else \
+                [t if m else self.ignore_index for t, m in zip(ids, mask)]
+            n_pad = width - len(ids)
+            batch["input_ids"].append(ids + [self.pad_token_id] * n_pad)
+            batch["attention_mask"].append(mask + [0] * n_pad)
+            batch["labels"].append(labels + [self.ignore_index] * n_pad)
+        batch = {k: torch.tensor(v, dtype=torch.long) for k, v in batch.items()}
+        for key in features[0]:
+            if key in batch or key == "length":
+                continue
+            values = [f[key] for f in features]
+            if isinstance(values[0], (list, tuple)):
+                values = [list(v[:width]) + [0] * (width - len(v[:width])) for v in values]
+            batch[key] = torch.tensor(values)
+        return batch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Profile token lengths and recommend max_length / buckets')
+    parser.add_argument('--input', type=str, required=True, help='JSONL file or sharded dataset directory')
+    parser.add_argument('--tokenizer', type=str, default='HooshvareLab/bert-fa-base-uncased',
+                        help='Tokenizer used for training (name or directory)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Report path (default: <input>.length_report.json, or length_report.json '
+                             'inside a sharded dataset)')
+    parser.add_argument('--percentile', type=float, default=99.0, help='Length percentile max_length covers')
+    parser.add_argument('--num-buckets', type=int, default=4, help='Number of length buckets (1 disables)')
+    parser.add_argument('--pad-multiple', type=int, default=8, help='Round lengths up to a multiple of this')
+    parser.add_argument('--sample-fraction', type=float, default=1.0, help='Fraction of records to profile')
+    parser.add_argument('--workers', type=int, default=None, help='Tokenizer processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='Sampling seed')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.input):
+        print(f"❌ Input not found: {args.input}", file=sys.stderr)
+        return 1
+    if not 0 < args.sample_fraction <= 1:
+        print("❌ --sample-fraction must be in (0, 1]", file=sys.stderr)
+        return 1
+    output = args.output or (os.path.join(args.input, "length_report.json") if os.path.isdir(args.input)
+                             else os.path.splitext(args.input)[0] + ".length_report.json")
+
+    from transformers import AutoConfig
+    try:
+        config = AutoConfig.from_pretrained(args.tokenizer)
+        model_max_length = getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None)
+    except (OSError, ValueError):
+        # A tokenizer-only directory (train_tokenizer.py) has no model config
+        model_max_length = None
+
+    print(f"📏 Profiling {args.input} with {args.tokenizer} "
+          f"({100 * args.sample_fraction:g}% of records, {args.workers or os.cpu_count()} workers)")
+    start = time.perf_counter()
+    lengths = profile_lengths(args.input, args.tokenizer, args.sample_fraction, args.workers, args.seed)
+    seconds = time.perf_counter() - start
+    try:
+        report = build_report(lengths, args.percentile, args.num_buckets, args.pad_multiple,
+                              args.sample_fraction, model_max_length)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    report = {"dataset": args.input, "tokenizer": args.tokenizer, "sample_fraction": args.sample_fraction,
+              "profile_seconds": round(seconds, 2), **report}
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    fixed, bucketed = report["epoch_tokens"]["fixed"], report["epoch_tokens"]["bucketed"]
+    print(f"✅ {report['samples_profiled']} samples in {seconds:.1f}s: "
+          f"p50 {report['lengths']['p50']}, p99 {report['lengths']['p99']}, max {report['lengths']['max']}")
+    print(f"   max_length {report['max_length']} (p{args.percentile:g}, "
+          f"{100 * report['truncated_samples']:.1f}% of samples truncated)")
+    print(f"   buckets {[b['max_length'] for b in report['buckets']]}")
+    print(f"   tokens/epoch: fixed {fixed['padded_tokens']:,} ({100 * fixed['padding_waste']:.1f}% padding), "
+          f"bucketed {bucketed['padded_tokens']:,} ({100 * bucketed['padding_waste']:.1f}% padding)")
+    print(f"📄 Report: {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
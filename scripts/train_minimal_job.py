@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 """
 Minimal, safe PyTorch training script used as a real training runner.
-It reads a small CSV (or JSONL) dataset with two numeric columns: 'x' and 'y'
-and trains a tiny regression model for demonstration.
+It reads numeric columns from a CSV, TSV, JSONL or Parquet dataset (target 'y'
+or the last numeric column, all other numeric columns as features) and trains
+a tiny regression model for demonstration.
 
 Usage:
   python scripts/train_minimal_job.py --job_id JOB123 --dataset data/sample.csv --epochs 3 --batch-size 16 --lr 0.01
 """
 import argparse
 import json
+import math
 import os
 import sys
 import time
@@ -18,15 +20,22 @@ try:
     import torch
     import torch.nn as nn
     import torch.optim as optim
-    from torch.utils.data import TensorDataset, DataLoader
 except Exception as e:
     print(f"ERROR: PyTorch not installed: {e}", file=sys.stderr)
     sys.exit(2)
 
-import csv
-import random
 import numpy as np
 
+from metrics_exporter import TrainingMetrics
+from metrics_log import MetricsLogWriter
+from resource_sampler import ResourceSampler
+
+try:
+    import pandas as pd
+    HAS_PANDAS = True
+except ImportError:
+    HAS_PANDAS = False
+
 # For HTTP status updates
 try:
     import requests
@@ -59,64 +68,114 @@ def write_status(job_id, status_dict, backend_url="http://localhost:3001"):
             # Don't fail the training if status update fails
             print(f"WARNING: Failed to send status update: {e}", file=sys.stderr)
 
-def load_tabular_dataset(dataset_path):
-    """Load CSV/JSONL dataset or generate synthetic data"""
-    X = []
-    y = []
-    
-    if dataset_path:
-        p = Path(dataset_path)
-        if not p.exists():
-            raise FileNotFoundError(str(p))
-        
-        if p.suffix.lower() in [".csv", ".tsv"]:
-            delimiter = "," if p.suffix.lower() == ".csv" else "\t"
-            with open(p, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile, delimiter=delimiter)
-                rows = list(reader)
-                keys = list(reader.fieldnames or [])
-                
-                # Prefer columns named x and y
-                if "x" in keys and "y" in keys:
-                    xs = [float(r["x"]) for r in rows]
-                    ys = [float(r["y"]) for r in rows]
-                    X = [[v] for v in xs]
-                    y = ys
-                else:
-                    # Pick first two numeric columns
-                    numeric_cols = []
-                    for k in keys:
-                        try:
-                            float(rows[0][k])
-                            numeric_cols.append(k)
-                        except:
-                            continue
-                    if len(numeric_cols) >= 2:
-                        for r in rows:
-                            X.append([float(r[numeric_cols[0]])])
-                            y.append(float(r[numeric_cols[1]]))
-                    else:
-                        # Fallback to synthetic
-                        X, y = generate_synthetic_data(100)
-        else:
-            # Not CSV: use synthetic
-            X, y = generate_synthetic_data(100)
+# Rows per chunk when streaming large tabular files
+READ_CHUNK_ROWS = 1_000_000
+
+def _select_columns(columns, numeric, features=None, target=None):
+    """Pick feature and target columns.
+
+    Defaults: target is 'y' (or the last numeric column), features are all
+    other numeric columns.
+    """
+    if target is None:
+        target = "y" if "y" in numeric else (numeric[-1] if numeric else None)
+    if features is None:
+        features = [c for c in numeric if c != target]
+    missing = [c for c in list(features) + [target] if c not in columns]
+    if target is None or not features or missing:
+        raise ValueError(
+            f"Need a numeric target and at least one numeric feature column "
+            f"(columns: {list(columns)}, numeric: {numeric}, missing: {missing})"
+        )
+    return list(features), target
+
+def _to_arrays(frames, features, target):
+    """Concatenate float32 column blocks into X (n, d) and y (n, 1), dropping rows with NaN"""
+    data = np.concatenate(frames, axis=0) if len(frames) > 1 else frames[0]
+    data = data[~np.isnan(data).any(axis=1)]
+    X = np.ascontiguousarray(data[:, :len(features)])
+    y = np.ascontiguousarray(data[:, len(features):])
+    return X, y
+
+def _read_delimited(p, delimiter, features=None, target=None):
+    if HAS_PANDAS:
+        sample = pd.read_csv(p, sep=delimiter, nrows=1000)
+        numeric = [c for c in sample.columns if pd.api.types.is_numeric_dtype(sample[c])]
+        features, target = _select_columns(list(sample.columns), numeric, features, target)
+        cols = features + [target]
+        frames = [
+            chunk[cols].to_numpy(dtype=np.float32)
+            for chunk in pd.read_csv(p, sep=delimiter, usecols=cols, dtype=np.float32,
+                                     engine="c", chunksize=READ_CHUNK_ROWS)
+        ]
+    else:
+        with open(p, encoding="utf-8") as f:
+            header = f.readline().strip().split(delimiter)
+            first = f.readline().strip().split(delimiter)
+        numeric = []
+        for name, value in zip(header, first):
+            try:
+                float(value)
+                numeric.append(name)
+            except ValueError:
+                continue
+        features, target = _select_columns(header, numeric, features, target)
+        usecols = [header.index(c) for c in features + [target]]
+        frames = [np.loadtxt(p, delimiter=delimiter, skiprows=1, usecols=usecols,
+                             dtype=np.float32, ndmin=2)]
+    return _to_arrays(frames, features, target), features, target
+
+def _read_frame_source(p, features=None, target=None):
+    """JSONL and Parquet via pandas"""
+    if not HAS_PANDAS:
+        raise RuntimeError(f"Loading {p.suffix} datasets requires pandas. Install with: pip install pandas")
+    if p.suffix.lower() == ".parquet":
+        df = pd.read_parquet(p, columns=None if features is None or target is None else features + [target])
+        chunks = [df]
     else:
+        chunks = pd.read_json(p, lines=True, chunksize=READ_CHUNK_ROWS)
+    frames = []
+    for chunk in chunks:
+        if not frames:
+            numeric = [c for c in chunk.columns if pd.api.types.is_numeric_dtype(chunk[c])]
+            features, target = _select_columns(list(chunk.columns), numeric, features, target)
+        frames.append(chunk[features + [target]].to_numpy(dtype=np.float32))
+    if not frames:
+        raise ValueError(f"Dataset is empty: {p}")
+    return _to_arrays(frames, features, target), features, target
+
+def load_tabular_dataset(dataset_path, features=None, target=None):
+    """Load CSV/TSV/JSONL/Parquet numeric columns into float32 arrays, or generate synthetic data.
+
+    Returns (X, y) with shapes (n, n_features) and (n, 1).
+    """
+    if not dataset_path:
         # No dataset provided: generate synthetic
-        X, y = generate_synthetic_data(100)
+        return generate_synthetic_data(100)
     
-    X = np.array(X, dtype=np.float32)
-    y = np.array(y, dtype=np.float32).reshape(-1, 1)
+    p = Path(dataset_path)
+    if not p.exists():
+        raise FileNotFoundError(str(p))
+    
+    suffix = p.suffix.lower()
+    if suffix in [".csv", ".tsv"]:
+        delimiter = "," if suffix == ".csv" else "\t"
+        (X, y), features, target = _read_delimited(p, delimiter, features, target)
+    elif suffix in [".jsonl", ".json", ".parquet"]:
+        (X, y), features, target = _read_frame_source(p, features, target)
+    else:
+        raise ValueError(f"Unsupported dataset format '{suffix}' (expected .csv, .tsv, .jsonl or .parquet)")
+    
+    if len(X) == 0:
+        raise ValueError(f"No numeric rows found in {p}")
+    print(f"Loaded {len(X)} rows: features={features} target={target}", file=sys.stderr)
     return X, y
 
 def generate_synthetic_data(n_samples=100):
     """Generate simple y = 2x + noise synthetic dataset"""
-    X = []
-    y = []
-    for i in range(n_samples):
-        xv = random.random()
-        X.append([xv])
-        y.append(2.0 * xv + 0.1 * random.random())
+    rng = np.random.default_rng()
+    X = rng.random((n_samples, 1), dtype=np.float32)
+    y = 2.0 * X + 0.1 * rng.random((n_samples, 1), dtype=np.float32)
     return X, y
 
 class TinyRegressor(nn.Module):
@@ -132,13 +191,237 @@ class TinyRegressor(nn.Module):
     def forward(self, x):
         return self.net(x)
 
+def train_in_memory(model, X, y, epochs, batch_size, lr, report_every=5,
+                    on_report=None, on_epoch_end=None):
+    """Train on tensors that already hold the whole dataset.
+
+    Each epoch draws one random permutation and gathers batches by slicing it,
+    so there is no per-sample collation. The running loss stays on the tensor
+    side and is only read back (one host sync) every `report_every` steps.
+    Callbacks receive (epoch, step, total_steps, mean_epoch_loss).
+    """
+    criterion = nn.MSELoss()
+    optimizer = optim.Adam(model.parameters(), lr=lr)
+
+    n = X.shape[0]
+    steps_per_epoch = max(1, (n + batch_size - 1) // batch_size)
+    total_steps = epochs * steps_per_epoch
+    step = 0
+
+    for epoch in range(1, epochs + 1):
+        model.train()
+        loss_sum = torch.zeros((), device=X.device)
+        perm = torch.randperm(n, device=X.device)
+
+        for i, start in enumerate(range(0, n, batch_size)):
+            idx = perm[start:start + batch_size]
+            xb = X.index_select(0, idx)
+            yb = y.index_select(0, idx)
+
+            optimizer.zero_grad(set_to_none=True)
+            loss = criterion(model(xb), yb)
+            loss.backward()
+            optimizer.step()
+
+            loss_sum += loss.detach()
+            step += 1
+
+            if on_report is not None and step % report_every == 0:
+                on_report(epoch, step, total_steps, loss_sum.item() / (i + 1))
+
+        if on_epoch_end is not None:
+            on_epoch_end(epoch, step, total_steps, loss_sum.item() / steps_per_epoch)
+
+    return model
+
+class StackedTinyRegressor(nn.Module):
+    """K independent TinyRegressors evaluated as one batched model.
+
+    Weights are stacked along a leading model dimension, so a forward pass on
+    a shared batch x of shape (B, in_dim) returns predictions of shape (K, B, 1).
+    """
+    def __init__(self, n_models, in_dim=1, hidden=8):
+        super().__init__()
+        # Same initialization as nn.Linear
+        bound1 = 1.0 / (in_dim ** 0.5)
+        bound2 = 1.0 / (hidden ** 0.5)
+        self.w1 = nn.Parameter(torch.empty(n_models, in_dim, hidden).uniform_(-bound1, bound1))
+        self.b1 = nn.Parameter(torch.empty(n_models, 1, hidden).uniform_(-bound1, bound1))
+        self.w2 = nn.Parameter(torch.empty(n_models, hidden, 1).uniform_(-bound2, bound2))
+        self.b2 = nn.Parameter(torch.empty(n_models, 1, 1).uniform_(-bound2, bound2))
+    
+    def forward(self, x):
+        h = torch.relu(torch.matmul(x, self.w1) + self.b1)
+        return torch.baddbmm(self.b2, h, self.w2)
+    
+    def export(self, k):
+        """State dict of model k, loadable into TinyRegressor"""
+        return {
+            "net.0.weight": self.w1[k].t().contiguous().detach().clone(),
+            "net.0.bias": self.b1[k, 0].detach().clone(),
+            "net.2.weight": self.w2[k].t().contiguous().detach().clone(),
+            "net.2.bias": self.b2[k, 0].detach().clone(),
+        }
+
+class StackedAdam:
+    """Adam over stacked parameters with a separate learning rate per model"""
+    def __init__(self, params, lrs, betas=(0.9, 0.999), eps=1e-8):
+        self.params = list(params)
+        self.lrs = lrs
+        self.betas = betas
+        self.eps = eps
+        self.step_count = 0
+        self.exp_avg = [torch.zeros_like(p) for p in self.params]
+        self.exp_avg_sq = [torch.zeros_like(p) for p in self.params]
+    
+    def zero_grad(self):
+        for p in self.params:
+            p.grad = None
+    
+    @torch.no_grad()
+    def step(self):
+        beta1, beta2 = self.betas
+        self.step_count += 1
+        bias1 = 1 - beta1 ** self.step_count
+        bias2_sqrt = (1 - beta2 ** self.step_count) ** 0.5
+        for p, m, v in zip(self.params, self.exp_avg, self.exp_avg_sq):
+            m.mul_(beta1).add_(p.grad, alpha=1 - beta1)
+            v.mul_(beta2).addcmul_(p.grad, p.grad, value=1 - beta2)
+            denom = (v.sqrt() / bias2_sqrt).add_(self.eps)
+            lr = self.lrs.view(-1, *([1] * (p.dim() - 1)))
+            p.addcdiv_(m * (lr / bias1), denom, value=-1.0)
+
+def train_sweep_group(X, y, configs, epochs, job_id, num_threads=None):
+    """Train every config (all sharing one batch size) as a single stacked model.
+
+    Writes artifacts/jobs/<job_id>_cfg<NNN>.json for each config after every
+    epoch and returns one result dict per config.
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    X = torch.from_numpy(X)
+    y = torch.from_numpy(y)
+    batch_size = configs[0]["batch_size"]
+    lrs = torch.tensor([c["lr"] for c in configs], dtype=torch.float32)
+    
+    model = StackedTinyRegressor(len(configs), in_dim=X.shape[1])
+    optimizer = StackedAdam(model.parameters(), lrs)
+    
+    n = X.shape[0]
+    steps_per_epoch = max(1, (n + batch_size - 1) // batch_size)
+    statuses = [{
+        "job_id": f"{job_id}_cfg{c['config_id']:03d}",
+        "sweep_id": job_id,
+        "status": "RUNNING",
+        "config": c,
+        "created_at": time.time()
+    } for c in configs]
+    
+    for epoch in range(1, epochs + 1):
+        loss_sum = torch.zeros(len(configs))
+        perm = torch.randperm(n)
+        for start in range(0, n, batch_size):
+            idx = perm[start:start + batch_size]
+            xb = X.index_select(0, idx)
+            yb = y.index_select(0, idx)
+            
+            optimizer.zero_grad()
+            losses = (model(xb) - yb).pow(2).mean(dim=(1, 2))
+            losses.sum().backward()
+            optimizer.step()
+            loss_sum += losses.detach()
+        
+        epoch_losses = (loss_sum / steps_per_epoch).tolist()
+        for st, loss in zip(statuses, epoch_losses):
+            st.update({
+                "epoch": epoch,
+                "progress": round(100.0 * epoch / epochs, 3),
+                "loss": round(loss, 6) if math.isfinite(loss) else None,
+                "message": f"Training epoch {epoch}/{epochs}"
+            })
+            write_status(st["job_id"], st)
+    
+    results = []
+    for k, (c, st) in enumerate(zip(configs, statuses)):
+        diverged = st["loss"] is None
+        st.update({
+            "status": "FAILED" if diverged else "COMPLETED",
+            "message": "Loss diverged" if diverged else "Training completed successfully",
+            "finished_at": time.time()
+        })
+        write_status(st["job_id"], st)
+        results.append({**c, "final_loss": st["loss"], "state_dict": model.export(k)})
+    return results
+
+def run_sweep(job_id, X, y, lrs, batch_sizes, epochs, workers, status):
+    """Grid search over learning rates and batch sizes.
+
+    Configs with the same batch size run together as one stacked model; the
+    batch-size groups are spread over a process pool.
+    """
+    configs = [
+        {"config_id": i, "lr": lr, "batch_size": bs}
+        for i, (bs, lr) in enumerate((bs, lr) for bs in batch_sizes for lr in lrs)
+    ]
+    groups = {}
+    for c in configs:
+        groups.setdefault(c["batch_size"], []).append(c)
+    groups = list(groups.values())
+    
+    workers = max(1, min(workers, len(groups)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    status.update({
+        "status": "RUNNING",
+        "message": f"Sweeping {len(configs)} configs in {len(groups)} groups",
+        "sweep_size": len(configs)
+    })
+    write_status(job_id, status)
+    
+    results = []
+    if workers == 1:
+        for group in groups:
+            results.extend(train_sweep_group(X, y, group, epochs, job_id, threads))
+            status["progress"] = round(100.0 * len(results) / len(configs), 3)
+            write_status(job_id, status)
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(train_sweep_group, X, y, group, epochs, job_id, threads) for group in groups]
+            for future in as_completed(futures):
+                results.extend(future.result())
+                status["progress"] = round(100.0 * len(results) / len(configs), 3)
+                write_status(job_id, status)
+    
+    results.sort(key=lambda r: r["config_id"])
+    finished = [r for r in results if r["final_loss"] is not None]
+    best = min(finished, key=lambda r: r["final_loss"]) if finished else None
+    return results, best
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--job_id", required=True, help="Unique job identifier")
-    parser.add_argument("--dataset", required=False, default=None, help="Path to dataset CSV")
+    parser.add_argument("--dataset", required=False, default=None,
+                        help="Path to dataset (CSV, TSV, JSONL or Parquet)")
+    parser.add_argument("--features", default=None,
+                        help="Comma-separated feature columns (default: all numeric columns except the target)")
+    parser.add_argument("--target", default=None, help="Target column (default: 'y' or the last numeric column)")
     parser.add_argument("--epochs", type=int, default=3, help="Number of training epochs")
     parser.add_argument("--batch-size", type=int, default=16, help="Training batch size")
     parser.add_argument("--lr", type=float, default=1e-2, help="Learning rate")
+    parser.add_argument("--report-every", type=int, default=5, help="Write status every N steps")
+    parser.add_argument("--sweep-lrs", default=None,
+                        help="Comma-separated learning rates; enables sweep mode")
+    parser.add_argument("--sweep-batch-sizes", default=None,
+                        help="Comma-separated batch sizes; enables sweep mode")
+    parser.add_argument("--sweep-workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes used for batch-size groups in sweep mode")
+    parser.add_argument("--sample-interval", type=float, default=1.0,
+                        help="Seconds between resource usage samples")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-textfile", default=None,
+                        help="Write Prometheus metrics to this file (node_exporter textfile collector)")
     args = parser.parse_args()
 
     job_id = args.job_id
@@ -154,102 +437,172 @@ def main():
         "created_at": time.time()
     }
     write_status(job_id, status)
+    sampler = ResourceSampler(interval=args.sample_interval).start()
+    metrics = TrainingMetrics(job_id, "train_minimal_job").start(
+        port=args.metrics_port, textfile=args.metrics_textfile)
+    # A re-run of the same job id starts a fresh history
+    metrics_log = MetricsLogWriter(f"artifacts/jobs/{job_id}.metrics", reset=True)
+    status["metrics_log"] = str(metrics_log.path)
+
+    def finish_metrics(final_status):
+        metrics.set_status(final_status)
+        metrics.close()
+        metrics_log.close()
 
     try:
         # Load dataset
-        X, y = load_tabular_dataset(args.dataset)
+        features = args.features.split(",") if args.features else None
+        X, y = load_tabular_dataset(args.dataset, features=features, target=args.target)
         status.update({
             "status": "LOADING",
-            "message": f"Loaded {len(X)} samples"
+            "message": f"Loaded {len(X)} samples with {X.shape[1]} features"
         })
         write_status(job_id, status)
+        metrics.set_status("LOADING")
         
     except Exception as e:
         status.update({
             "status": "ERROR",
             "message": f"Dataset load error: {e}"
         })
+        sampler.stop()
+        status["resources"] = sampler.snapshot()
         write_status(job_id, status)
+        finish_metrics("ERROR")
         sys.exit(3)
 
-    # Setup training
-    device = torch.device("cpu")
-    ds = TensorDataset(torch.from_numpy(X), torch.from_numpy(y))
-    loader = DataLoader(ds, batch_size=args.batch_size, shuffle=True)
+    try:
+        if args.sweep_lrs or args.sweep_batch_sizes:
+            lrs = [float(v) for v in args.sweep_lrs.split(",")] if args.sweep_lrs else [args.lr]
+            batch_sizes = ([int(v) for v in args.sweep_batch_sizes.split(",")]
+                           if args.sweep_batch_sizes else [args.batch_size])
+            results, best = run_sweep(job_id, X, y, lrs, batch_sizes, args.epochs, args.sweep_workers, status)
+            sampler.stop()
+        
+            status.update({
+                "resources": sampler.snapshot(),
+                "sweep": [{k: v for k, v in r.items() if k != "state_dict"} for r in results],
+                "finished_at": time.time()
+            })
+            if best is None:
+                status.update({"status": "ERROR", "message": "All sweep configs diverged"})
+                write_status(job_id, status)
+                finish_metrics("ERROR")
+                sys.exit(4)
+        
+            model_dir = Path("models")
+            model_dir.mkdir(parents=True, exist_ok=True)
+            ckpt_path = model_dir / f"{job_id}.pt"
+            save_start = time.time()
+            torch.save(best["state_dict"], str(ckpt_path))
+            metrics.observe_checkpoint(time.time() - save_start)
+            metrics.set("loss", best["final_loss"])
+            status.update({
+                "status": "COMPLETED",
+                "progress": 100.0,
+                "loss": best["final_loss"],
+                "best_config": {k: v for k, v in best.items() if k != "state_dict"},
+                "message": f"Sweep completed: best lr={best['lr']} batch_size={best['batch_size']}",
+                "checkpoint": str(ckpt_path)
+            })
+            write_status(job_id, status)
+            finish_metrics("COMPLETED")
+            print(json.dumps(status))
+            sys.exit(0)
 
-    model = TinyRegressor(in_dim=X.shape[1])
-    model.to(device)
-    criterion = nn.MSELoss()
-    optimizer = optim.Adam(model.parameters(), lr=args.lr)
+        # Setup training
+        device = torch.device("cpu")
+        X_t = torch.from_numpy(X).to(device)
+        y_t = torch.from_numpy(y).to(device)
+
+        model = TinyRegressor(in_dim=X.shape[1])
+        model.to(device)
+
+        # Steps are only observed at report time, so latency is the mean over each interval
+        steps_per_epoch = max(1, -(-len(X) // args.batch_size))
+        last_report = {"step": 0, "samples": 0, "time": time.perf_counter()}
+
+        def on_report(epoch, step, total_steps, loss, full_resources=False):
+            now = time.perf_counter()
+            new_steps = step - last_report["step"]
+            if new_steps > 0:
+                full_epochs, partial = divmod(step, steps_per_epoch)
+                samples = full_epochs * len(X) + min(partial * args.batch_size, len(X))
+                metrics.observe_step((now - last_report["time"]) / new_steps,
+                                     samples=samples - last_report["samples"], steps=new_steps)
+                last_report.update(step=step, samples=samples)
+            last_report["time"] = now
+            metrics.set_status("RUNNING")
+            metrics.set("loss", loss)
+            metrics.set("learning_rate", args.lr)
+            metrics.set("epoch", epoch)
+            metrics.set("progress_ratio", step / float(total_steps))
+            metrics.write_textfile()
+            metrics_log.append(step, loss=loss, learning_rate=args.lr, epoch=epoch)
 
-    total_steps = args.epochs * max(1, len(loader))
-    step = 0
-    
-    # Training loop
-    for epoch in range(1, args.epochs + 1):
-        epoch_loss = 0.0
-        model.train()
-        
-        for xb, yb in loader:
-            xb = xb.to(device)
-            yb = yb.to(device)
-            
-            optimizer.zero_grad()
-            pred = model(xb)
-            loss = criterion(pred, yb)
-            loss.backward()
-            optimizer.step()
-            
-            epoch_loss += float(loss.item())
-            step += 1
-            
-            # Calculate progress
             prog = min(100.0, (step / float(total_steps)) * 100.0)
-            
-            # Update status
             status.update({
                 "status": "RUNNING",
                 "progress": round(prog, 3),
                 "epoch": epoch,
                 "step": step,
                 "total_steps": total_steps,
-                "loss": round(epoch_loss / max(1, step), 6),
-                "message": f"Training epoch {epoch}/{args.epochs}"
+                "loss": round(loss, 6),
+                "message": f"Training epoch {epoch}/{args.epochs}",
+                "resources": sampler.snapshot() if full_resources else {"summary": sampler.summary()}
             })
-            
-            # Write status periodically
-            if step % 5 == 0:
-                write_status(job_id, status)
-        
-        # End of epoch
-        avg_loss = epoch_loss / max(1, len(loader))
+            write_status(job_id, status)
+
+        def on_epoch_end(epoch, step, total_steps, avg_loss):
+            on_report(epoch, step, total_steps, avg_loss, full_resources=True)
+            # Short sleep to make progress observable
+            time.sleep(0.2)
+
+        train_in_memory(
+            model, X_t, y_t,
+            epochs=args.epochs,
+            batch_size=args.batch_size,
+            lr=args.lr,
+            report_every=args.report_every,
+            on_report=on_report,
+            on_epoch_end=on_epoch_end
+        )
+
+        # Training finished - save checkpoint
+        model_dir = Path("models")
+        model_dir.mkdir(parents=True, exist_ok=True)
+        ckpt_path = model_dir / f"{job_id}.pt"
+        save_start = time.time()
+        torch.save(model.state_dict(), str(ckpt_path))
+        metrics.observe_checkpoint(time.time() - save_start)
+        sampler.stop()
+    
+        # Final status
         status.update({
-            "epoch": epoch,
-            "loss": round(avg_loss, 6)
+            "resources": sampler.snapshot(),
+            "status": "COMPLETED",
+            "progress": 100.0,
+            "message": "Training completed successfully",
+            "checkpoint": str(ckpt_path),
+            "finished_at": time.time()
         })
         write_status(job_id, status)
-        
-        # Short sleep to make progress observable
-        time.sleep(0.2)
-
-    # Training finished - save checkpoint
-    model_dir = Path("models")
-    model_dir.mkdir(parents=True, exist_ok=True)
-    ckpt_path = model_dir / f"{job_id}.pt"
-    torch.save(model.state_dict(), str(ckpt_path))
-    
-    # Final status
-    status.update({
-        "status": "COMPLETED",
-        "progress": 100.0,
-        "message": "Training completed successfully",
-        "checkpoint": str(ckpt_path),
-        "finished_at": time.time()
-    })
-    write_status(job_id, status)
+        finish_metrics("COMPLETED")
     
-    print(json.dumps(status))
-    sys.exit(0)
+        print(json.dumps(status))
+        sys.exit(0)
+    except Exception as e:
+        status.update({
+            "status": "ERROR",
+            "message": f"Training error: {e}"
+        })
+        sampler.stop()
+        status["resources"] = sampler.snapshot()
+        write_status(job_id, status)
+        finish_metrics("ERROR")
+        import traceback
+        traceback.print_exc()
+        sys.exit(5)
 
 if __name__ == "__main__":
     main()
@@ -10,26 +10,32 @@ Usage:
                                    --epochs 3 \
                                    --batch-size 4 \
                                    --learning-rate 5e-5
+
+    # 4 data-parallel ranks on this host, each pinned to a quarter of the cores
+    python3 train_real_pytorch.py ... --nproc-per-node 4
+
+    # Two hosts, run on each with --node-rank 0 / 1
+    python3 train_real_pytorch.py ... --nproc-per-node 2 --nnodes 2 --node-rank 0 --master-addr 10.0.0.1
 """
 
 import argparse
 import json
 import os
+import signal
 import sys
 from pathlib import Path
-from typing import Dict, Any
+from typing import Any, Dict, List
 import time
 
 # Try to import PyTorch and Transformers
 try:
     import torch
     from transformers import (
-        AutoModelForCausalLM,
         AutoTokenizer,
         TrainingArguments,
-        Trainer,
         DataCollatorForLanguageModeling,
-        TrainerCallback
+        TrainerCallback,
+        default_data_collator
     )
     from datasets import load_dataset, Dataset
     PYTORCH_AVAILABLE = True
@@ -42,9 +48,12 @@ except ImportError as e:
 class ProgressCallback(TrainerCallback):
     """Custom callback to report training progress"""
     
-    def __init__(self, output_file: str):
+    def __init__(self, output_file: str, sampler=None, step_timer=None, metrics_log=None):
         self.output_file = output_file
         self.start_time = time.time()
+        self.sampler = sampler
+        self.step_timer = step_timer
+        self.metrics_log = metrics_log
     
     def on_log(self, args, state, control, logs=None, **kwargs):
         """Called when the trainer logs metrics"""
@@ -58,6 +67,24 @@ class ProgressCallback(TrainerCallback):
                 "elapsed_time": time.time() - self.start_time,
                 "timestamp": time.time()
             }
+            if self.sampler is not None:
+                progress_data["resources"] = self.sampler.summary()
+            timing = self.step_timer.stats() if self.step_timer is not None else None
+            if timing:
+                progress_data["timing"] = timing
+            
+            # The progress file only holds the latest point; history goes to the append-only log
+            if self.metrics_log is not None and "loss" in logs:
+                self.metrics_log.append(
+                    state.global_step,
+                    loss=logs.get("loss"),
+                    learning_rate=logs.get("learning_rate"),
+                    grad_norm=logs.get("grad_norm"),
+                    epoch=state.epoch,
+                    tokens_per_second=timing.get("tokens_per_second") if timing else None,
+                    step_ms=timing.get("step_ms_mean") if timing else None
+                )
+                progress_data["metrics_log"] = str(self.metrics_log.path)
             
             # Write progress to file
             with open(self.output_file, 'w') as f:
@@ -67,9 +94,106 @@ class ProgressCallback(TrainerCallback):
             print(f"[PROGRESS] Step {state.global_step}/{state.max_steps} - "
                   f"Loss: {logs.get('loss', 0):.4f} - "
                   f"LR: {logs.get('learning_rate', 0):.2e}")
+            if timing and "phase_ms" in timing:
+                phases = ", ".join(f"{k} {v:.0f}ms" for k, v in timing["phase_ms"].items())
+                print(f"[TIMING] p50 {timing['step_ms_p50']:.0f}ms p95 {timing['step_ms_p95']:.0f}ms - "
+                      f"{timing['tokens_per_second']:.0f} tok/s, {timing['samples_per_second']:.1f} samples/s - "
+                      f"{phases}")
             sys.stdout.flush()
 
 
+# Role labels used when rendering `messages` records into a single sequence
+CHAT_ROLE_LABELS = {
+    "system": "سیستم",
+    "user": "کاربر",
+    "assistant": "دستیار",
+}
+
+IGNORE_INDEX = -100
+
+
+def chat_segments(messages_batch):
+    """Role headers and turn contents of a batch of conversations, with trainable flags and owners"""
+    segments = []
+    trainable = []
+    owners = []
+    for conv_idx, messages in enumerate(messages_batch):
+        for message in messages or []:
+            role = message.get("role", "user")
+            content = message.get("content") or ""
+            segments.append(f"{CHAT_ROLE_LABELS.get(role, role)}: ")
+            trainable.append(False)
+            owners.append(conv_idx)
+            segments.append(content + "\n")
+            trainable.append(role == "assistant")
+            owners.append(conv_idx)
+    return segments, trainable, owners
+
+
+def chat_token_ids(messages_batch, tokenizer):
+    """Unpadded input ids and labels of each conversation; every assistant turn ends with EOS"""
+    segments, trainable, owners = chat_segments(messages_batch)
+    
+    segment_ids = tokenizer(segments, add_special_tokens=False)["input_ids"] if segments else []
+    eos = [tokenizer.eos_token_id] if tokenizer.eos_token_id is not None else []
+    
+    input_ids = [[] for _ in messages_batch]
+    labels = [[] for _ in messages_batch]
+    for ids, is_trainable, conv_idx in zip(segment_ids, trainable, owners):
+        if is_trainable:
+            ids = ids + eos
+            labels[conv_idx].extend(ids)
+        else:
+            labels[conv_idx].extend([IGNORE_INDEX] * len(ids))
+        input_ids[conv_idx].extend(ids)
+    return input_ids, labels
+
+
+def chat_prompt_ids(messages, tokenizer) -> List[int]:
+    """Token ids of a conversation laid out as in training, ending with an open assistant turn"""
+    header = tokenizer(f"{CHAT_ROLE_LABELS['assistant']}: ", add_special_tokens=False)["input_ids"]
+    return chat_token_ids([messages], tokenizer)[0][0] + header
+
+
+def tokenize_chat_batch(messages_batch, tokenizer, max_length: int = 512) -> Dict[str, Any]:
+    """
+    Render a batch of multi-turn conversations with the chat template and
+    tokenize them. Only assistant turns contribute to the loss; role headers,
+    user/system turns and padding get label -100.
+
+    All segments of the batch are tokenized in one call, and sequences are
+    assembled per segment, so there is no Python loop over tokens.
+    """
+    input_ids, labels = chat_token_ids(messages_batch, tokenizer)
+    
+    pad_id = tokenizer.pad_token_id
+    attention_mask = []
+    for i in range(len(input_ids)):
+        ids = input_ids[i][:max_length]
+        n_pad = max_length - len(ids)
+        input_ids[i] = ids + [pad_id] * n_pad
+        labels[i] = labels[i][:max_length] + [IGNORE_INDEX] * n_pad
+        attention_mask.append([1] * len(ids) + [0] * n_pad)
+    
+    return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+
+def load_sharded_dataset(dataset_path: str, num_proc: int = None):
+    """Load a sharded dataset directory, reading shards in parallel"""
+    from jsonl_shards import ShardedJsonlReader, dataset_fingerprint, generate_records
+    
+    with ShardedJsonlReader(dataset_path) as reader:
+        shards = list(range(len(reader.shard_names)))
+    num_proc = min(len(shards), num_proc or os.cpu_count() or 1)
+    
+    return Dataset.from_generator(
+        generate_records,
+        # Re-sharding into the same directory must not hit the old datasets cache
+        gen_kwargs={"path": dataset_path, "shards": shards, "fingerprint": dataset_fingerprint(dataset_path)},
+        num_proc=num_proc if num_proc > 1 else None
+    )
+
+
 def load_and_prepare_dataset(dataset_path: str, tokenizer, max_length: int = 512):
     """Load and tokenize the dataset"""
     print(f"📂 Loading dataset from: {dataset_path}")
@@ -77,14 +201,29 @@ def load_and_prepare_dataset(dataset_path: str, tokenizer, max_length: int = 512
     if not os.path.exists(dataset_path):
         raise FileNotFoundError(f"Dataset not found: {dataset_path}")
     
-    # Load JSONL dataset
-    dataset = load_dataset('json', data_files=dataset_path, split='train')
+    if os.path.isdir(dataset_path):
+        # Sharded output of normalize_persian_text.py --shard-dir
+        dataset = load_sharded_dataset(dataset_path)
+    else:
+        # Load JSONL dataset
+        dataset = load_dataset('json', data_files=dataset_path, split='train')
     
     print(f"✅ Loaded {len(dataset)} samples")
     
     # Check dataset format
     sample = dataset[0]
-    if 'question' in sample and 'answer' in sample:
+    if 'messages' in sample:
+        # Multi-turn chat records from normalize_persian_text.py
+        print("🔄 Tokenizing chat dataset (assistant-only loss)...")
+        tokenized_dataset = dataset.map(
+            lambda examples: tokenize_chat_batch(examples['messages'], tokenizer, max_length),
+            batched=True,
+            remove_columns=dataset.column_names,
+            desc="Tokenizing"
+        )
+        print(f"✅ Tokenization complete")
+        return tokenized_dataset
+    elif 'question' in sample and 'answer' in sample:
         # Convert Q&A format to text format
         def format_qa(example):
             return {
@@ -92,7 +231,7 @@ def load_and_prepare_dataset(dataset_path: str, tokenizer, max_length: int = 512
             }
         dataset = dataset.map(format_qa)
     elif 'text' not in sample:
-        raise ValueError("Dataset must have 'text' field or 'question'/'answer' fields")
+        raise ValueError("Dataset must have 'messages', 'text' or 'question'/'answer' fields")
     
     # Tokenize dataset
     def tokenize_function(examples):
@@ -128,7 +267,28 @@ def train_model_real(
     save_steps: int = 100,
     logging_steps: int = 10,
     use_gpu: bool = False,
-    run_id: str = "default"
+    run_id: str = "default",
+    gradient_accumulation_steps: int = 1,
+    auto_batch_size: bool = False,
+    ram_budget_gb: float = None,
+    target_batch_size: int = 16,
+    autotune_lengths: List[int] = None,
+    sample_interval: float = 1.0,
+    profile_steps: int = None,
+    profile_window: int = 5,
+    metrics_port: int = None,
+    metrics_textfile: str = None,
+    ddp_bucket_mb: int = 25,
+    optimizer_name: str = "adamw",
+    distill: bool = False,
+    student_model: str = None,
+    student_layers: int = None,
+    distill_alpha: float = 0.5,
+    distill_temperature: float = 2.0,
+    distill_top_k: int = 16,
+    teacher_cache: str = "auto",
+    tokenizer_path: str = None,
+    length_report: str = None
 ):
     """Real PyTorch training with HuggingFace Transformers"""
     
@@ -149,12 +309,38 @@ def train_model_real(
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
+    # Data-parallel rank layout (set by cpu_ddp.launch); only rank 0 writes
+    # progress, metrics and the final model
+    from cpu_ddp import broadcast_object, distributed_env, init_process_group, local_main_first
+    ddp = distributed_env()
+    is_main = ddp is None or ddp["rank"] == 0
+    if ddp:
+        init_process_group()
+        print(f"🔗 Rank {ddp['rank']}/{ddp['world_size']} joined (gloo), cores {ddp['cores']}")
+    
+    # max_length and length buckets from sequence_profiler.py
+    length_stats = None
+    buckets = None
+    if length_report:
+        from sequence_profiler import load_length_report
+        report = load_length_report(length_report)
+        if report.get("tokenizer") not in (None, tokenizer_path or model_name):
+            print(f"⚠️  {length_report} was profiled with {report['tokenizer']}, "
+                  f"training uses {tokenizer_path or model_name}")
+        max_length = report["max_length"]
+        if len(report["buckets"]) > 1:
+            buckets = [b["max_length"] for b in report["buckets"]]
+        length_stats = {"path": length_report, "max_length": max_length, "buckets": buckets}
+        print(f"📏 max_length {max_length} from {length_report}" + (f", buckets {buckets}" if buckets else ""))
+    
     # Progress file for real-time updates
     progress_file = f"training_progress_{run_id}.json"
     
     # Load tokenizer
     print("\n📥 Loading tokenizer...")
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if tokenizer_path and distill:
+        raise ValueError("--tokenizer cannot be combined with --distill (teacher and student share a vocabulary)")
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_path or model_name)
     
     # Add pad token if not present
     if tokenizer.pad_token is None:
@@ -162,28 +348,91 @@ def train_model_real(
     
     print(f"✅ Tokenizer loaded (vocab size: {len(tokenizer)})")
     
-    # Load model
+    # Load model (meta-device init + safetensors mmap)
     print("\n📥 Loading model...")
-    model = AutoModelForCausalLM.from_pretrained(model_name)
+    from model_loader import ensure_safetensors, load_causal_lm
+    # Rank 0 fills the safetensors conversion cache; the other ranks then load from it
+    with local_main_first():
+        if distill:
+            # --model-name is the teacher; the model trained here is the smaller student
+            from distillation import make_student
+            model, model_load = make_student(model_name, student_model, student_layers)
+            model_load["teacher"] = model_name
+        else:
+            model, model_load = load_causal_lm(model_name)
+    if distill and model.get_input_embeddings().num_embeddings < len(tokenizer):
+        raise ValueError("The student must share the teacher's tokenizer (its vocabulary is smaller)")
+    
+    tokenizer_stats = None
+    if tokenizer_path:
+        # New vocabulary (train_tokenizer.py): embeddings start from the old tokenizer's pieces
+        from train_tokenizer import transfer_embeddings
+        tokenizer_stats = transfer_embeddings(model, AutoTokenizer.from_pretrained(model_name), tokenizer)
+        tokenizer_stats["path"] = tokenizer_path
+        model_load["parameters"] = sum(p.numel() for p in model.parameters())
+        print(f"🔤 Embeddings resized to {tokenizer_stats['vocab_size']} tokens "
+              f"({tokenizer_stats['transferred']} initialized from the old vocabulary)")
     
     # Get model size
-    param_count = sum(p.numel() for p in model.parameters())
-    print(f"✅ Model loaded ({param_count:,} parameters)")
+    param_count = model_load["parameters"]
+    print(f"✅ Model loaded ({param_count:,} parameters) in {model_load['load_seconds']:.2f}s "
+          f"from {model_load['format']}, peak RSS {model_load['peak_rss_gb']} GB")
     
-    # Load and prepare dataset
-    tokenized_dataset = load_and_prepare_dataset(dataset_path, tokenizer, max_length)
+    autotune = None
+    if auto_batch_size:
+        from batch_autotune import autotune_batch_size, default_ram_budget_gb
+        
+        print("\n🔍 Auto-tuning batch size...")
+        # Every rank on a host holds its own model and optimizer state
+        ram_budget = (ram_budget_gb or default_ram_budget_gb()) / (ddp["local_world_size"] if ddp else 1)
+        if is_main:
+            autotune = autotune_batch_size(
+                model,
+                model_name,
+                ram_budget,
+                autotune_lengths or [max_length],
+                target_batch_size=target_batch_size,
+                optimizer=optimizer_name
+            )
+        # All ranks must run the same number of micro-batches per step
+        autotune = broadcast_object(autotune)
+        batch_size = autotune["batch_size"]
+        max_length = autotune["max_length"]
+        gradient_accumulation_steps = autotune["gradient_accumulation_steps"]
+        print(f"✅ Batch size {batch_size} x {gradient_accumulation_steps} accumulation steps, "
+              f"max length {max_length} ({autotune['tokens_per_second']} tokens/s, "
+              f"peak RSS {autotune['peak_rss_gb']} GB{', cached' if autotune['cached'] else ''})")
+    
+    # Load and prepare dataset (one rank per host fills the datasets cache first)
+    with local_main_first():
+        tokenized_dataset = load_and_prepare_dataset(dataset_path, tokenizer, max_length)
+        if buckets:
+            # Padded per batch up to the next bucket boundary instead of to max_length
+            from sequence_profiler import trim_padding
+            tokenized_dataset = tokenized_dataset.map(trim_padding, batched=True, desc="Trimming padding")
+    if distill:
+        # Row ids key the teacher logit cache
+        tokenized_dataset = tokenized_dataset.add_column("sample_idx", list(range(len(tokenized_dataset))))
     
     # Data collator for language modeling
-    data_collator = DataCollatorForLanguageModeling(
-        tokenizer=tokenizer,
-        mlm=False  # Causal LM (not masked LM)
-    )
+    if buckets:
+        from sequence_profiler import BucketPaddingCollator
+        data_collator = BucketPaddingCollator(buckets, tokenizer.pad_token_id)
+    elif 'labels' in tokenized_dataset.column_names:
+        # Chat records carry their own masked labels
+        data_collator = default_data_collator
+    else:
+        data_collator = DataCollatorForLanguageModeling(
+            tokenizer=tokenizer,
+            mlm=False  # Causal LM (not masked LM)
+        )
     
     # Training arguments
     training_args = TrainingArguments(
         output_dir=output_dir,
         num_train_epochs=epochs,
         per_device_train_batch_size=batch_size,
+        gradient_accumulation_steps=gradient_accumulation_steps,
         learning_rate=learning_rate,
         logging_steps=logging_steps,
         save_steps=save_steps,
@@ -200,17 +449,83 @@ def train_model_real(
         weight_decay=0.01,
         push_to_hub=False,
         disable_tqdm=False,
+        ddp_backend="gloo" if ddp else None,
+        ddp_bucket_cap_mb=ddp_bucket_mb if ddp else None,
+        ddp_find_unused_parameters=False if ddp else None,
+        ddp_broadcast_buffers=False if ddp else None,
+        remove_unused_columns=not distill,
+        group_by_length=bool(buckets),
     )
     
+    # Background resource usage sampling (CPU, RSS, page faults, disk I/O)
+    from resource_sampler import ResourceSampler
+    sampler = ResourceSampler(interval=sample_interval)
+    
+    # Per-step phase timing; torch.profiler on --profile-steps or SIGUSR1
+    from training_instrumentation import (
+        InstrumentationCallback, MetricsCallback, ProfilerWindow, StepTimer, TimedTrainer
+    )
+    step_timer = StepTimer()
+    profiler = ProfilerWindow(output_dir, num_steps=profile_window, start_step=profile_steps) if is_main else None
+    if not is_main and hasattr(signal, "SIGUSR1"):
+        # Only rank 0 profiles (cpu_ddp.launch forwards SIGUSR1 to it); the default action would kill this rank
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    
+    # Optional Prometheus endpoint / textfile
+    from metrics_exporter import TrainingMetrics
+    metrics = TrainingMetrics(run_id, "train_real_pytorch")
+    if is_main:
+        metrics.start(port=metrics_port, textfile=metrics_textfile)
+    
+    # Append-only loss/LR history for dashboard charts
+    from metrics_log import MetricsLogWriter
+    metrics_log = MetricsLogWriter(os.path.join(output_dir, 'metrics_log'), reset=True) if is_main else None
+    
+    # Memory-lean optimizer (the Trainer still builds the LR schedule around it)
+    optimizer = None
+    if optimizer_name != "adamw":
+        from lean_optimizers import create_optimizer
+        state_dir = os.path.join(output_dir, '.optimizer_state' + (f"_rank{ddp['rank']}" if ddp else ''))
+        optimizer = create_optimizer(optimizer_name, model, learning_rate,
+                                     weight_decay=training_args.weight_decay, state_dir=state_dir)
+        print(f"⚙️  Optimizer: {optimizer_name}")
+    
+    callbacks = [InstrumentationCallback(step_timer, profiler), MetricsCallback(metrics, step_timer)]
+    if is_main:
+        callbacks.insert(1, ProgressCallback(progress_file, sampler, step_timer, metrics_log))
+    
+    trainer_cls = TimedTrainer
+    trainer_kwargs = {}
+    if distill:
+        from distillation import DistillationTrainer, TeacherLogitCache
+        logit_cache = None
+        if teacher_cache:
+            cache_dir = os.path.join(output_dir, 'teacher_logits') if teacher_cache == "auto" else teacher_cache
+            with local_main_first():
+                logit_cache = TeacherLogitCache(cache_dir, model_name, dataset_path, len(tokenized_dataset),
+                                                max_length, distill_top_k)
+            print(f"🧑‍🏫 Teacher logit cache: {cache_dir} ({100 * logit_cache.coverage():.0f}% filled)")
+        trainer_cls = DistillationTrainer
+        trainer_kwargs = {
+            "teacher_loader": lambda: load_causal_lm(model_name)[0],
+            "logit_cache": logit_cache,
+            "alpha": distill_alpha,
+            "temperature": distill_temperature,
+            "top_k": distill_top_k
+        }
+    
     # Create trainer
     print("\n🏋️  Creating trainer...")
-    trainer = Trainer(
+    trainer = trainer_cls(
         model=model,
         args=training_args,
         train_dataset=tokenized_dataset,
         data_collator=data_collator,
         tokenizer=tokenizer,
-        callbacks=[ProgressCallback(progress_file)]
+        callbacks=callbacks,
+        optimizers=(optimizer, None),
+        step_timer=step_timer,
+        **trainer_kwargs
     )
     
     print(f"✅ Trainer initialized")
@@ -219,12 +534,40 @@ def train_model_real(
     print(f"{'='*80}\n")
     
     # Train the model
-    train_result = trainer.train()
-    
-    # Save final model
+    sampler.start()
+    try:
+        train_result = trainer.train()
+        from lean_optimizers import optimizer_state_bytes
+        optimizer_stats = {"name": optimizer_name, **optimizer_state_bytes(trainer.optimizer)}
+    except Exception:
+        metrics.set_status("ERROR")
+        metrics.close()
+        raise
+    finally:
+        sampler.stop()
+        if metrics_log is not None:
+            metrics_log.close()
+        # Removes the memory-mapped .optimizer_state*/ files, also after a failure
+        if hasattr(optimizer, "close"):
+            optimizer.close()
+    
+    distill_stats = None
+    if distill:
+        distill_stats = trainer.stats()
+        if trainer.logit_cache is not None:
+            trainer.logit_cache.flush()
+    
+    # Save final model (Trainer.save_model only writes on rank 0)
     print("\n💾 Saving final model...")
+    save_start = time.time()
     trainer.save_model()
+    metrics.observe_checkpoint(time.time() - save_start)
+    if not is_main:
+        metrics.close()
+        return output_dir
     tokenizer.save_pretrained(output_dir)
+    # Later loads (eval, fine-tuning) take the mmap path
+    ensure_safetensors(output_dir)
     
     # Save training stats
     stats_file = os.path.join(output_dir, 'training_stats.json')
@@ -237,7 +580,27 @@ def train_model_real(
             "dataset_path": dataset_path,
             "parameters": param_count,
             "training_time": train_result.metrics.get('train_runtime', 0),
-            "samples_per_second": train_result.metrics.get('train_samples_per_second', 0)
+            "samples_per_second": train_result.metrics.get('train_samples_per_second', 0),
+            "batch_size": batch_size,
+            "gradient_accumulation_steps": gradient_accumulation_steps,
+            "max_length": max_length,
+            "autotune": {k: v for k, v in autotune.items() if k != "probes"} if autotune else None,
+            "resources": sampler.snapshot(),
+            "timing": step_timer.stats(),
+            "profiler_traces": profiler.traces,
+            "metrics_log": str(metrics_log.path),
+            "model_load": model_load,
+            "optimizer": optimizer_stats,
+            "distillation": distill_stats,
+            "tokenizer": tokenizer_stats,
+            "length_report": length_stats,
+            "distributed": {
+                "backend": "gloo",
+                "world_size": ddp["world_size"],
+                "ranks_per_node": ddp["local_world_size"],
+                "cores_per_rank": len(ddp["cores"]) if ddp["cores"] else None,
+                "bucket_cap_mb": ddp_bucket_mb
+            } if ddp else None
         }, f, indent=2)
     
     print(f"\n{'='*80}")
@@ -248,6 +611,9 @@ def train_model_real(
     print(f"💾 Model saved to: {output_dir}")
     print(f"📈 Stats saved to: {stats_file}")
     
+    metrics.set_status("COMPLETED")
+    metrics.close()
+    
     # Clean up progress file
     if os.path.exists(progress_file):
         os.remove(progress_file)
@@ -325,7 +691,7 @@ def parse_args():
     parser.add_argument('--model-name', type=str, default='HooshvareLab/bert-fa-base-uncased',
                       help='Base model name from HuggingFace')
     parser.add_argument('--dataset-path', type=str, default='combined.jsonl',
-                      help='Path to training dataset (JSONL format)')
+                      help='Path to training dataset (JSONL file or sharded dataset directory)')
     parser.add_argument('--output-dir', type=str, default='models/persian-chat',
                       help='Output directory for trained model')
     parser.add_argument('--epochs', type=int, default=3,
@@ -344,6 +710,61 @@ def parse_args():
                       help='Use GPU if available')
     parser.add_argument('--run-id', type=str, default='default',
                       help='Unique run identifier')
+    parser.add_argument('--gradient-accumulation-steps', type=int, default=1,
+                      help='Accumulate gradients over N batches')
+    parser.add_argument('--auto-batch-size', action='store_true',
+                      help='Probe batch sizes and pick the fastest that fits --ram-budget-gb')
+    parser.add_argument('--ram-budget-gb', type=float, default=None,
+                      help='Peak RSS budget for --auto-batch-size (default: 80%% of available RAM)')
+    parser.add_argument('--target-batch-size', type=int, default=16,
+                      help='Effective batch size --auto-batch-size reaches via gradient accumulation')
+    parser.add_argument('--autotune-lengths', type=str, default=None,
+                      help='Comma-separated sequence lengths --auto-batch-size may choose from '
+                           '(longest that fits wins; default: --max-length only)')
+    parser.add_argument('--sample-interval', type=float, default=1.0,
+                      help='Seconds between resource usage samples')
+    parser.add_argument('--profile-steps', type=int, default=None,
+                      help='Run torch.profiler starting at this step (or send SIGUSR1 at any time)')
+    parser.add_argument('--profile-window', type=int, default=5,
+                      help='Number of steps captured per profiler trace')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                      help='Serve Prometheus metrics on this port')
+    parser.add_argument('--metrics-textfile', type=str, default=None,
+                      help='Write Prometheus metrics to this file (node_exporter textfile collector)')
+    parser.add_argument('--nproc-per-node', type=int, default=1,
+                      help='Data-parallel ranks on this host, each pinned to its own cores (gloo)')
+    parser.add_argument('--nnodes', type=int, default=1,
+                      help='Number of hosts taking part in data-parallel training')
+    parser.add_argument('--node-rank', type=int, default=0,
+                      help='Index of this host (0 runs the rendezvous)')
+    parser.add_argument('--master-addr', type=str, default='127.0.0.1',
+                      help='Rendezvous address: host of node 0')
+    parser.add_argument('--master-port', type=int, default=29500,
+                      help='Rendezvous port on node 0')
+    parser.add_argument('--ddp-bucket-mb', type=int, default=25,
+                      help='Gradient all-reduce bucket size in MB')
+    parser.add_argument('--distill', action='store_true',
+                      help='Distill --model-name (teacher) into a smaller student')
+    parser.add_argument('--student-model', type=str, default=None,
+                      help='Student checkpoint (default: the teacher with --student-layers layers)')
+    parser.add_argument('--student-layers', type=int, default=None,
+                      help='Layers kept (evenly spaced) when the student is derived from the teacher')
+    parser.add_argument('--distill-alpha', type=float, default=0.5,
+                      help='Weight of the KL term (1 - alpha weights the LM loss)')
+    parser.add_argument('--distill-temperature', type=float, default=2.0,
+                      help='Softmax temperature for teacher and student')
+    parser.add_argument('--distill-top-k', type=int, default=16,
+                      help='Teacher logits kept per position')
+    parser.add_argument('--teacher-cache', type=str, default='auto',
+                      help='Teacher logit cache directory ("auto": <output-dir>/teacher_logits, "" to disable)')
+    parser.add_argument('--tokenizer', type=str, default=None,
+                      help='Train with this tokenizer (e.g. from train_tokenizer.py); embeddings are resized')
+    parser.add_argument('--length-report', type=str, default=None,
+                      help='sequence_profiler.py report: sets max_length and pads per length bucket')
+    parser.add_argument('--optimizer', type=str, default='adamw',
+                      choices=['adamw', 'adafactor', 'adam8bit', 'adamw_mmap'],
+                      help='Optimizer: adamw, adafactor (factored moments), adam8bit (8-bit states) '
+                           'or adamw_mmap (states in memory-mapped files)')
     
     return parser.parse_args()
 
@@ -351,6 +772,12 @@ def parse_args():
 def main():
     args = parse_args()
     
+    from cpu_ddp import distributed_env, launch
+    if (args.nproc_per_node > 1 or args.nnodes > 1) and distributed_env() is None:
+        # Launcher: re-run this script once per local rank
+        return launch(sys.argv, args.nproc_per_node, args.nnodes, args.node_rank,
+                      args.master_addr, args.master_port)
+    
     try:
         if PYTORCH_AVAILABLE:
             train_model_real(
@@ -364,7 +791,28 @@ def main():
                 save_steps=args.save_steps,
                 logging_steps=args.logging_steps,
                 use_gpu=args.use_gpu,
-                run_id=args.run_id
+                run_id=args.run_id,
+                gradient_accumulation_steps=args.gradient_accumulation_steps,
+                auto_batch_size=args.auto_batch_size,
+                ram_budget_gb=args.ram_budget_gb,
+                target_batch_size=args.target_batch_size,
+                autotune_lengths=[int(v) for v in args.autotune_lengths.split(',')] if args.autotune_lengths else None,
+                sample_interval=args.sample_interval,
+                profile_steps=args.profile_steps,
+                profile_window=args.profile_window,
+                metrics_port=args.metrics_port,
+                metrics_textfile=args.metrics_textfile,
+                ddp_bucket_mb=args.ddp_bucket_mb,
+                optimizer_name=args.optimizer,
+                distill=args.distill,
+                student_model=args.student_model,
+                student_layers=args.student_layers,
+                distill_alpha=args.distill_alpha,
+                distill_temperature=args.distill_temperature,
+                distill_top_k=args.distill_top_k,
+                teacher_cache=args.teacher_cache,
+                tokenizer_path=args.tokenizer,
+                length_report=args.length_report
             )
         else:
             # Fallback to simulation
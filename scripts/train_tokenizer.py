@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Train a Persian tokenizer from the normalized corpus.
+
+General-purpose tokenizers (GPT-2 byte-level BPE, multilingual WordPiece)
+split Persian into far more pieces than necessary, and every extra token is
+paid for in training and inference. This trains a byte-level BPE (default)
+or Unigram tokenizer on combined.jsonl (or a sharded dataset directory):
+
+  - the corpus is streamed in batches, never loaded whole,
+  - training runs on all cores (the tokenizers library is multi-threaded;
+    RAYON_NUM_THREADS / --threads limits it),
+  - the result is saved as a transformers tokenizer (AutoTokenizer loads it),
+  - a report compares tokens per character with the current tokenizer on
+    held-out records.
+
+train_real_pytorch.py --tokenizer <dir> trains with it: the embedding matrix
+is resized and each new token's embedding starts as the mean of the
+embeddings of its pieces under the old tokenizer (transfer_embeddings).
+
+Usage:
+    python3 scripts/train_tokenizer.py --input datasets/text/persian_conversation/combined.jsonl \\
+        --output-dir models/tokenizer-fa --vocab-size 32000 --compare HooshvareLab/bert-fa-base-uncased
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, Optional
+
+SPECIAL_TOKENS = {"pad_token": "<pad>", "eos_token": "<eos>", "unk_token": "<unk>"}
+MODEL_TYPES = ("bpe", "unigram")
+
+
+def record_texts(record: Dict) -> List[str]:
+    """Every piece of text in a messages / text / question-answer record"""
+    if "messages" in record:
+        return [m.get("content") or "" for m in record["messages"] or []]
+    if "text" in record:
+        return [record["text"] or ""]
+    return [record.get("question") or "", record.get("answer") or ""]
+
+
+def iter_text_batches(data_path: str, batch_size: int = 1000, skip: int = 0,
+                      limit: Optional[int] = None) -> Iterator[List[str]]:
+    """Batches of texts from records [skip, skip + limit) of a JSONL file or sharded dataset"""
+    from eval_cpu import iter_records
+
+    batch = []
+    for i, record in enumerate(iter_records(data_path, None if limit is None else skip + limit)):
+        if i < skip:
+            continue
+        batch.extend(t for t in record_texts(record) if t)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def train_tokenizer(data_path: str, model_type: str = "bpe", vocab_size: int = 32000, min_frequency: int = 2,
+                    skip: int = 0):
+    """Train a tokenizer on records from `skip` on; returns a PreTrainedTokenizerFast"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    specials = list(SPECIAL_TOKENS.values())
+    if model_type == "bpe":
+        # Byte-level: no unknown tokens, and ZWNJ / diacritics survive untouched
+        backend = Tokenizer(models.BPE())
+        backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        backend.decoder = decoders.ByteLevel()
+        trainer = trainers.BpeTrainer(vocab_size=vocab_size, min_frequency=min_frequency, special_tokens=specials,
+                                      initial_alphabet=pre_tokenizers.ByteLevel.alphabet(), show_progress=False)
+    elif model_type == "unigram":
+        backend = Tokenizer(models.Unigram())
+        backend.pre_tokenizer = pre_tokenizers.Metaspace()
+        backend.decoder = decoders.Metaspace()
+        trainer = trainers.UnigramTrainer(vocab_size=vocab_size, special_tokens=specials,
+                                          unk_token=SPECIAL_TOKENS["unk_token"], show_progress=False)
+    else:
+        raise ValueError(f"Unknown tokenizer model: {model_type}")
+
+    seen = [0]
+
+    def counted():
+        for batch in iter_text_batches(data_path, skip=skip):
+            seen[0] += len(batch)
+            yield batch
+
+    backend.train_from_iterator(counted(), trainer=trainer)
+    if not seen[0]:
+        raise ValueError(f"No training text in {data_path} after skipping {skip} held-out records")
+    return PreTrainedTokenizerFast(tokenizer_object=backend, bos_token=SPECIAL_TOKENS["eos_token"],
+                                   **SPECIAL_TOKENS)
+
+
+def tokens_per_char(tokenizer, texts: List[str]) -> Dict:
+    """Token/character statistics of `tokenizer` over `texts`"""
+    chars = sum(len(t) for t in texts)
+    start = time.perf_counter()
+    tokens = sum(len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"])
+    seconds = time.perf_counter() - start
+    return {
+        "tokens": tokens,
+        "characters": chars,
+        "tokens_per_char": round(tokens / chars, 4) if chars else None,
+        "tokens_per_text": round(tokens / len(texts), 2) if texts else None,
+        "encode_chars_per_second": round(chars / seconds) if seconds else None
+    }
+
+
+def transfer_embeddings(model, old_tokenizer, new_tokenizer) -> Dict:
+    """Resize `model` to `new_tokenizer` and initialize each embedding from its old-tokenizer pieces"""
+    import torch
+
+    old_input = model.get_input_embeddings().weight.detach().clone()
+    old_output = model.get_output_embeddings()
+    untied = old_output is not None and old_output.weight.data_ptr() != model.get_input_embeddings().weight.data_ptr()
+    old_output = old_output.weight.detach().clone() if untied else None
+
+    model.resize_token_embeddings(len(new_tokenizer))
+    new_input = model.get_input_embeddings().weight
+    new_output = model.get_output_embeddings().weight if untied else None
+
+    vocab = new_tokenizer.convert_ids_to_tokens(list(range(len(new_tokenizer))))
+    special_ids = set(new_tokenizer.all_special_ids)
+    pieces = old_tokenizer([new_tokenizer.convert_tokens_to_string([tok]) for tok in vocab],
+                           add_special_tokens=False)["input_ids"]
+    mean = old_input.mean(0)
+    transferred = 0
+    with torch.no_grad():
+        for new_id, old_ids in enumerate(pieces):
+            old_ids = [i for i in old_ids if i < len(old_input)]
+            if new_id in special_ids or not old_ids:
+                new_input[new_id] = mean
+                if untied:
+                    new_output[new_id] = old_output.mean(0)
+                continue
+            new_input[new_id] = old_input[old_ids].mean(0)
+            if untied:
+                new_output[new_id] = old_output[old_ids].mean(0)
+            transferred += 1
+
+    for name in ("pad_token_id", "eos_token_id", "bos_token_id"):
+        value = getattr(new_tokenizer, name)
+        setattr(model.config, name, value)
+        if getattr(model, "generation_config", None) is not None:
+            setattr(model.generation_config, name, value)
+    return {"vocab_size": len(new_tokenizer), "transferred": transferred,
+            "initialized_to_mean": len(new_tokenizer) - transferred}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Train a Persian BPE/Unigram tokenizer from the corpus')
+    parser.add_argument('--input', type=str, required=True, help='JSONL file or sharded dataset directory')
+    parser.add_argument('--output-dir', type=str, required=True, help='Where to save the tokenizer')
+    parser.add_argument('--model-type', type=str, default='bpe', choices=MODEL_TYPES, help='Tokenizer model')
+    parser.add_argument('--vocab-size', type=int, default=32000, help='Vocabulary size')
+    parser.add_argument('--min-frequency', type=int, default=2, help='Minimum pair frequency (BPE)')
+    parser.add_argument('--eval-records', type=int, default=2000,
+                        help='Leading records held out of training for the tokens/char report '
+                             '(at most 10%% of the corpus)')
+    parser.add_argument('--compare', type=str, default='HooshvareLab/bert-fa-base-uncased',
+                        help='Current tokenizer to compare with ("" to skip)')
+    parser.add_argument('--threads', type=int, default=None, help='Training threads (default: all cores)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.input):
+        print(f"❌ Input not found: {args.input}", file=sys.stderr)
+        return 1
+    if args.threads:
+        os.environ["RAYON_NUM_THREADS"] = str(args.threads)
+
+    from eval_cpu import count_samples
+
+    # Small corpora keep most of their records for training
+    total = count_samples(args.input)
+    eval_records = min(args.eval_records, total // 10)
+    if eval_records < args.eval_records:
+        print(f"⚠️  Holding out {eval_records} of {total} records (--eval-records {args.eval_records})")
+    held_out = [t for batch in iter_text_batches(args.input, limit=eval_records) for t in batch]
+
+    print(f"🔤 Training {args.model_type} tokenizer (vocab {args.vocab_size}) on {args.input}")
+    start = time.perf_counter()
+    try:
+        tokenizer = train_tokenizer(args.input, args.model_type, args.vocab_size, args.min_frequency,
+                                    skip=eval_records)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    train_seconds = time.perf_counter() - start
+    os.makedirs(args.output_dir, exist_ok=True)
+    tokenizer.save_pretrained(args.output_dir)
+    print(f"✅ Trained in {train_seconds:.1f}s, saved to {args.output_dir} ({len(tokenizer)} tokens)")
+
+    report = {
+        "input": args.input,
+        "model_type": args.model_type,
+        "vocab_size": len(tokenizer),
+        "train_seconds": round(train_seconds, 2),
+        "held_out_records": eval_records,
+        "held_out_texts": len(held_out),
+        "tokenizer": tokens_per_char(tokenizer, held_out) if held_out else None,
+        "baseline": None,
+        "token_reduction": None
+    }
+    ours = report["tokenizer"]
+    if ours:
+        print(f"   tokens/char: {ours['tokens_per_char']} ({ours['tokens_per_text']} tokens per text)")
+    if args.compare and held_out:
+        try:
+            from transformers import AutoTokenizer
+            baseline = AutoTokenizer.from_pretrained(args.compare)
+            base = {"name": args.compare, "vocab_size": len(baseline), **tokens_per_char(baseline, held_out)}
+            report["baseline"] = base
+            report["token_reduction"] = round(1 - ours["tokens"] / base["tokens"], 4)
+            print(f"   {args.compare}: {base['tokens_per_char']} tokens/char "
+                  f"-> {100 * report['token_reduction']:.1f}% fewer tokens")
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not load {args.compare} for comparison: {e}")
+
+    with open(os.path.join(args.output_dir, "tokenizer_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
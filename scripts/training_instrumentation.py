@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Step-level timing and on-demand profiling for train_real_pytorch.py.
+
+Every optimizer step is split into forward, backward, optimizer, logging and
+checkpoint time; whatever remains of the wall-clock step (fetching and
+collating the next batch, callbacks) is reported as data loading. Moving
+averages, p50/p95 step latency and tokens/samples per second are computed
+over a sliding window.
+
+torch.profiler can be switched on for a window of steps with
+--profile-steps START, or at any time by sending SIGUSR1 to the training
+process; the Chrome trace is written to <output_dir>/profiles/.
+"""
+
+import os
+import signal
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import torch
+from transformers import Trainer, TrainerCallback
+
+PHASES = ("data", "forward", "backward", "optimizer", "logging", "checkpoint")
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class StepTimer:
+    """Accumulates per-phase time for the current step and keeps a window of finished steps"""
+
+    def __init__(self, window: int = 200):
+        self.window = deque(maxlen=window)
+        self.total_steps = 0
+        self.total_tokens = 0
+        self.total_samples = 0
+        # Called with each finished step record (e.g. to feed metrics exporters)
+        self.listeners = []
+        self._current: Optional[Dict] = None
+        self._step_start = None
+
+    def begin_step(self):
+        self.end_step()
+        self._step_start = time.perf_counter()
+        self._current = {phase: 0.0 for phase in PHASES}
+        self._current.update({"tokens": 0, "samples": 0})
+
+    def add(self, phase: str, seconds: float):
+        if self._current is not None:
+            self._current[phase] += seconds
+
+    def add_batch(self, samples: int, tokens: int):
+        if self._current is not None:
+            self._current["samples"] += samples
+            self._current["tokens"] += tokens
+
+    def end_step(self):
+        """Close the open step; time not attributed to a phase counts as data loading"""
+        if self._current is None:
+            return
+        record = self._current
+        record["total"] = time.perf_counter() - self._step_start
+        measured = sum(record[p] for p in PHASES if p != "data")
+        record["data"] = max(0.0, record["total"] - measured)
+        self.window.append(record)
+        self.total_steps += 1
+        self.total_tokens += record["tokens"]
+        self.total_samples += record["samples"]
+        self._current = None
+        for listener in self.listeners:
+            listener(record)
+
+    def stats(self) -> Dict:
+        if not self.window:
+            return {"steps": self.total_steps}
+        n = len(self.window)
+        elapsed = sum(r["total"] for r in self.window)
+        latencies = sorted(r["total"] for r in self.window)
+        return {
+            "steps": self.total_steps,
+            "window": n,
+            "phase_ms": {p: round(1000 * sum(r[p] for r in self.window) / n, 2) for p in PHASES},
+            "step_ms_mean": round(1000 * elapsed / n, 2),
+            "step_ms_p50": round(1000 * _percentile(latencies, 0.50), 2),
+            "step_ms_p95": round(1000 * _percentile(latencies, 0.95), 2),
+            "tokens_per_second": round(sum(r["tokens"] for r in self.window) / max(elapsed, 1e-9), 1),
+            "samples_per_second": round(sum(r["samples"] for r in self.window) / max(elapsed, 1e-9), 2),
+            "total_tokens": self.total_tokens,
+            "total_samples": self.total_samples
+        }
+
+
+class ProfilerWindow:
+    """Runs torch.profiler for `num_steps` steps when requested, then writes a Chrome trace"""
+
+    def __init__(self, output_dir: str, num_steps: int = 5, start_step: Optional[int] = None):
+        self.output_dir = os.path.join(output_dir, "profiles")
+        self.num_steps = num_steps
+        self.start_step = start_step
+        self.requested = False
+        self._profiler = None
+        self._first_step = None
+        self.traces = []
+
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self.requested = True
+
+    def on_step_begin(self, step: int):
+        if self._profiler is None and (self.requested or step == self.start_step):
+            self.requested = False
+            self._first_step = step
+            self._profiler = torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU],
+                record_shapes=True
+            )
+            self._profiler.__enter__()
+            print(f"[PROFILE] Profiling steps {step}-{step + self.num_steps - 1}", flush=True)
+
+    def on_step_end(self, step: int):
+        if self._profiler is not None and step - self._first_step + 1 >= self.num_steps:
+            self.stop()
+
+    def stop(self):
+        if self._profiler is None:
+            return
+        self._profiler.__exit__(None, None, None)
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"trace_step{self._first_step}.json")
+        self._profiler.export_chrome_trace(path)
+        self.traces.append(path)
+        self._profiler = None
+        print(f"[PROFILE] Chrome trace written to {path}", flush=True)
+
+
+class InstrumentationCallback(TrainerCallback):
+    """Marks step boundaries and times optimizer steps via optimizer hooks"""
+
+    def __init__(self, timer: StepTimer, profiler: Optional[ProfilerWindow] = None):
+        self.timer = timer
+        self.profiler = profiler
+        self._optimizer_start = None
+
+    def _pre_step(self, optimizer, args, kwargs):
+        self._optimizer_start = time.perf_counter()
+
+    def _post_step(self, optimizer, args, kwargs):
+        if self._optimizer_start is not None:
+            self.timer.add("optimizer", time.perf_counter() - self._optimizer_start)
+            self._optimizer_start = None
+
+    def on_train_begin(self, args, state, control, optimizer=None, **kwargs):
+        # Accelerate wraps the optimizer; hooks go on the underlying torch optimizer
+        inner = getattr(optimizer, "optimizer", optimizer)
+        if inner is not None and hasattr(inner, "register_step_pre_hook"):
+            inner.register_step_pre_hook(self._pre_step)
+            inner.register_step_post_hook(self._post_step)
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self.timer.begin_step()
+        if self.profiler is not None:
+            self.profiler.on_step_begin(state.global_step + 1)
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.profiler is not None:
+            self.profiler.on_step_end(state.global_step)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.timer.end_step()
+        if self.profiler is not None:
+            self.profiler.stop()
+
+
+class MetricsCallback(TrainerCallback):
+    """Feeds a metrics_exporter.TrainingMetrics from step records and trainer logs"""
+
+    def __init__(self, metrics, timer: StepTimer):
+        self.metrics = metrics
+        timer.listeners.append(self._on_step_record)
+
+    def _on_step_record(self, record: Dict):
+        self.metrics.observe_step(record["total"], tokens=record["tokens"], samples=record["samples"])
+        if record["checkpoint"] > 0:
+            self.metrics.observe_checkpoint(record["checkpoint"])
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.metrics.set_status("RUNNING")
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        logs = logs or {}
+        self.metrics.set("loss", logs.get("loss"))
+        self.metrics.set("learning_rate", logs.get("learning_rate"))
+        self.metrics.set("epoch", state.epoch)
+        if state.max_steps:
+            self.metrics.set("progress_ratio", state.global_step / state.max_steps)
+        self.metrics.write_textfile()
+
+
+class TimedTrainer(Trainer):
+    """Trainer that attributes forward, backward, logging and checkpoint time to the step timer"""
+
+    def __init__(self, *args, step_timer: StepTimer = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.step_timer = step_timer or StepTimer()
+        self._forward_seconds = 0.0
+
+    def compute_loss(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().compute_loss(*args, **kwargs)
+        finally:
+            self._forward_seconds = time.perf_counter() - start
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        input_ids = inputs.get("input_ids")
+        if input_ids is not None:
+            mask = inputs.get("attention_mask")
+            tokens = int(mask.sum()) if mask is not None else input_ids.numel()
+            self.step_timer.add_batch(input_ids.shape[0], tokens)
+
+        start = time.perf_counter()
+        self._forward_seconds = 0.0
+        loss = super().training_step(model, inputs, *args, **kwargs)
+        total = time.perf_counter() - start
+        self.step_timer.add("forward", self._forward_seconds)
+        self.step_timer.add("backward", max(0.0, total - self._forward_seconds))
+        return loss
+
+    def log(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().log(*args, **kwargs)
+        finally:
+            self.step_timer.add("logging", time.perf_counter() - start)
+
+    def _save_checkpoint(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super()._save_checkpoint(*args, **kwargs)
+        finally:
+            self.step_timer.add("checkpoint", time.perf_counter() - start)